@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request, jsonify
+from backend.metrics import get_registry
+from backend.current_user import load_current_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT = 'default'
+ANONYMOUS = 'anonymous'
+
+# Atomic token bucket in Redis: refill by elapsed time, take one token if
+# there is one, and return how many seconds until there would be (0 = allowed)
+_REDIS_TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens, at = tonumber(state[1]), tonumber(state[2])
+if tokens == nil then
+    tokens, at = burst, now
+end
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+# Give back a token taken for a request that was turned away further on
+_REDIS_REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens ~= nil then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + 1))
+end
+return 0
+"""
+
+
+class MemoryBuckets:
+    """
+    Token buckets in this process - limits apply per worker process
+    Least recently used buckets are dropped past max_keys (a dropped
+    bucket comes back full, which only ever errs on the side of allowing)
+    """
+
+    def __init__(self, max_keys=100000):
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - at) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key, burst):
+        """Give back a token taken with take()"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, at = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + 1), at)
+
+
+class RedisBuckets:
+    """
+    Token buckets shared by every worker process through Redis
+    Needs the optional `redis` package. If Redis can't be reached requests
+    are let through (and logged) rather than failing the API.
+    """
+
+    def __init__(self, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('ADMISSION_BACKEND=redis needs the redis package (pip install redis)')
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE_SCRIPT)
+        self._refund = self._client.register_script(_REDIS_REFUND_SCRIPT)
+        self._prefix = prefix
+        self._errors = redis.RedisError
+
+    def take(self, key, rate, burst):
+        try:
+            return float(self._take(keys=[self._prefix + key], args=[rate, burst]))
+        except self._errors:
+            logger.exception('Rate limit check failed, allowing the request')
+            return 0
+
+    def refund(self, key, burst):
+        try:
+            self._refund(keys=[self._prefix + key], args=[burst])
+        except self._errors:
+            logger.exception('Rate limit refund failed')
+
+
+class ConcurrencyLimiter:
+    """
+    Caps on requests in flight in this process, overall and per group
+    Never waits: a request over a cap is turned away straight away, so
+    requests don't queue up for database connections that aren't coming
+    """
+
+    def __init__(self, total, per_group):
+        self.total = total
+        self.per_group = per_group
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, group=None):
+        return self._in_flight.get(group, 0)
+
+    def acquire(self, group):
+        """Take a slot; returns a release function, or None when at a cap"""
+        group_cap = self.per_group.get(group)
+        with self._lock:
+            if self.total is not None and self._in_flight.get(None, 0) >= self.total:
+                return None
+            if group_cap is not None and self._in_flight.get(group, 0) >= group_cap:
+                return None
+            self._in_flight[None] = self._in_flight.get(None, 0) + 1
+            self._in_flight[group] = self._in_flight.get(group, 0) + 1
+
+        released = []
+
+        def release():
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+                self._in_flight[None] -= 1
+                self._in_flight[group] -= 1
+        return release
+
+
+def endpoint_group(endpoint, groups):
+    """The configured group of an endpoint ('tickets.get_tickets' or its blueprint 'tickets')"""
+    if endpoint in groups:
+        return groups[endpoint]
+    return groups.get(endpoint.rsplit('.', 1)[0], DEFAULT)
+
+
+def bucket_limit(limits, role, group):
+    """(rate, burst) for a role and group, falling back to 'default' entries; None = unlimited"""
+    table = limits.get(role) or limits.get(DEFAULT) or {}
+    return table.get(group, table.get(DEFAULT))
+
+
+def too_many_requests(retry_after, message):
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+
+def retry_after_header(retry_after):
+    return str(max(1, math.ceil(retry_after)))
+
+
+def pool_capacity(engine_options):
+    """pool_size + max_overflow from SQLALCHEMY_ENGINE_OPTIONS, or None when not set"""
+    if 'pool_size' not in engine_options:
+        return None
+    return engine_options['pool_size'] + engine_options.get('max_overflow', 0)
+
+
+class Rejected(Exception):
+    """A request turned away; retry_after is in seconds"""
+
+    def __init__(self, retry_after, message):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.message = message
+
+
+class Admission:
+    """
+    The admission checks, shared by the Flask hooks and the ASGI app
+    A request takes a token from its user's bucket and its role's bucket
+    and a concurrency slot, or none of them: tokens taken before a later
+    check turns the request away are given back.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        if config['ADMISSION_BACKEND'] == 'redis':
+            self.buckets = RedisBuckets(config['ADMISSION_REDIS_URL'], config['ADMISSION_REDIS_PREFIX'])
+        else:
+            self.buckets = MemoryBuckets()
+
+        max_in_flight = config['ADMISSION_MAX_IN_FLIGHT']
+        if max_in_flight is None:
+            max_in_flight = pool_capacity(config['SQLALCHEMY_ENGINE_OPTIONS'])
+        self.limiter = ConcurrencyLimiter(max_in_flight, config['ADMISSION_GROUP_MAX_IN_FLIGHT'])
+
+        self.groups = config['ADMISSION_ENDPOINT_GROUPS']
+        self.exempt = set(config['ADMISSION_EXEMPT_ENDPOINTS'])
+        self.user_limits = config['ADMISSION_USER_LIMITS']
+        self.role_limits = config['ADMISSION_ROLE_LIMITS']
+        self.retry_after = config['ADMISSION_CONCURRENCY_RETRY_AFTER']
+
+        registry = get_registry(app)
+        self._rejected = registry.counter('admission_rejected_total', 'API requests turned away with a 429',
+                                          ('reason', 'group'))
+        in_flight = registry.gauge('admission_in_flight', 'API requests being served in this process')
+        in_flight.set_function(lambda: self.limiter.in_flight())
+
+    def admit(self, endpoint, user, remote_addr):
+        """
+        Check a request to endpoint ('blueprint.view') from user (the current
+        User/CachedUser, or None when not logged in)
+        The user's current role picks the limits, not the one in the session
+        cookie, so role changes apply straight away. Returns a function to
+        call once the response is sent, or None for exempt endpoints; raises
+        Rejected when the request is turned away
+        """
+        if endpoint in self.exempt:
+            return None
+        group = endpoint_group(endpoint, self.groups)
+
+        role = user.role if user is not None else ANONYMOUS
+        client = f'user:{user.id}' if user is not None else f'ip:{remote_addr}'
+        taken = []
+        try:
+            for key, limit in ((f'{client}:{group}', bucket_limit(self.user_limits, role, group)),
+                               (f'role:{role}:{group}', bucket_limit(self.role_limits, role, group))):
+                if limit is None:
+                    continue
+                wait = self.buckets.take(key, *limit)
+                if wait:
+                    self._rejected.inc(reason='rate', group=group)
+                    raise Rejected(wait, 'Too many requests, please slow down')
+                taken.append((key, limit[1]))
+
+            release = self.limiter.acquire(group)
+            if release is None:
+                self._rejected.inc(reason='concurrency', group=group)
+                raise Rejected(self.retry_after, 'Server busy, please retry shortly')
+        except Rejected:
+            for key, burst in taken:
+                self.buckets.refund(key, burst)
+            raise
+        return release
+
+
+def init_app(app):
+    """
+    Rate limit and cap concurrency of blueprint (API) requests when
+    ADMISSION_ENABLED is on; see the ADMISSION_* settings in config.py
+    """
+    if not app.config['ADMISSION_ENABLED']:
+        return
+    admission = Admission(app)
+    app.extensions['admission'] = admission
+
+    @app.before_request
+    def admit():
+        if request.blueprint is None or request.endpoint is None or request.endpoint in admission.exempt:
+            return None
+        try:
+            release = admission.admit(request.endpoint, load_current_user(), request.remote_addr)
+        except Rejected as e:
+            return too_many_requests(e.retry_after, e.message)
+        if release is not None:
+            g.admission_release = release
+        return None
+
+    @app.after_request
+    def release_after_response(response):
+        # Streamed responses (exports) keep their slot until the body is sent
+        release = g.pop('admission_release', None)
+        if release is not None:
+            response.call_on_close(release)
+        return response
+
+    @app.teardown_request
+    def release_on_error(error=None):
+        release = g.pop('admission_release', None)
+        if release is not None:
+            release()
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, delete, insert, func, or_, and_
+from backend.models import (db, User, Ticket, ArchivedTicket, TicketTombstone, AnalyticsLedgerEntry,
+                            AnalyticsVolumeDaily, AnalyticsResolutionDaily, AnalyticsWatermark)
+from backend.stats import UNASSIGNED
+from backend import http_cache
+
+logger = logging.getLogger(__name__)
+
+# Breakdowns the analytics endpoints can group by
+DIMENSIONS = ('total', 'category', 'priority', 'technician')
+
+# A ticket counts as resolved while it is in one of these statuses
+RESOLVED_STATUSES = ('resolved', 'closed')
+
+# Time-to-resolve buckets are quarter-octaves (each ~19% wider than the
+# last), so a median or p90 read from them is within ~9% of the exact value
+BUCKETS_PER_DOUBLING = 4
+
+TICKETS_MARK = 'tickets'
+TOMBSTONES_MARK = 'tombstones'
+BEGINNING = (datetime.min, 0)
+
+# What a ticket contributes to the rollups; stored per ticket in the ledger
+LedgerEntry = namedtuple('LedgerEntry', 'category priority assigned_to created_day resolved_day resolve_seconds')
+
+_LEDGER_COLUMNS = (
+    AnalyticsLedgerEntry.category, AnalyticsLedgerEntry.priority, AnalyticsLedgerEntry.assigned_to,
+    AnalyticsLedgerEntry.created_day, AnalyticsLedgerEntry.resolved_day, AnalyticsLedgerEntry.resolve_seconds,
+)
+
+
+def _ticket_columns(model):
+    return (model.id, model.category, model.priority, model.assigned_to,
+            model.status, model.created_at, model.resolved_at)
+
+
+def duration_bucket(seconds):
+    return int(BUCKETS_PER_DOUBLING * math.log2(max(seconds, 1)))
+
+
+def bucket_value(bucket):
+    """Geometric middle of a bucket, in seconds"""
+    return 2 ** ((bucket + 0.5) / BUCKETS_PER_DOUBLING)
+
+
+def ledger_entry(row):
+    """The LedgerEntry for a ticket row with the _ticket_columns fields"""
+    resolved = row.status in RESOLVED_STATUSES and row.resolved_at is not None
+    return LedgerEntry(
+        row.category, row.priority, row.assigned_to, row.created_at.date(),
+        row.resolved_at.date() if resolved else None,
+        max(0.0, (row.resolved_at - row.created_at).total_seconds()) if resolved else None,
+    )
+
+
+def _dimension_keys(entry):
+    return [
+        ('total', 'all'),
+        ('category', entry.category),
+        ('priority', entry.priority),
+        ('technician', str(entry.assigned_to) if entry.assigned_to else UNASSIGNED),
+    ]
+
+
+def _add_entry(volume, resolution, entry, sign):
+    """Add (sign=1) or take back (sign=-1) one ledger entry's rollup counts"""
+    if entry is None:
+        return
+    bucket = duration_bucket(entry.resolve_seconds) if entry.resolved_day else None
+    for dimension, key in _dimension_keys(entry):
+        volume[(dimension, entry.created_day, key, 'opened')] += sign
+        if entry.resolved_day:
+            volume[(dimension, entry.resolved_day, key, 'closed')] += sign
+            resolution[(dimension, entry.resolved_day, key, bucket, 'tickets')] += sign
+            resolution[(dimension, entry.resolved_day, key, bucket, 'seconds')] += sign * entry.resolve_seconds
+
+
+def _rollup_params(deltas, key_names, value_names):
+    """Turn {(*key, field): delta} into one parameter dict per rollup row"""
+    rows = {}
+    for (*key, field), delta in deltas.items():
+        if delta:
+            row = rows.setdefault(tuple(key), dict(zip(key_names, key), **{name: 0 for name in value_names}))
+            row[field] += delta
+    return list(rows.values())
+
+
+def _add_statement(model, key_names, value_names):
+    """INSERT ... ON CONFLICT that adds to an existing rollup row"""
+    dialect_name = db.session.get_bind(mapper=model).dialect.name
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = model.__table__
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in key_names],
+        set_={name: table.c[name] + stmt.excluded[name] for name in value_names}
+    )
+
+
+def _apply(volume, resolution):
+    written = False
+    for model, key_names, value_names, deltas in (
+        (AnalyticsVolumeDaily, ('dimension', 'day', 'key'), ('opened', 'closed'), volume),
+        (AnalyticsResolutionDaily, ('dimension', 'day', 'key', 'bucket'), ('tickets', 'seconds'), resolution),
+    ):
+        params = _rollup_params(deltas, key_names, value_names)
+        if params:
+            db.session.execute(_add_statement(model, key_names, value_names), params)
+            written = True
+    # Re-read overlap rows can change counts without moving a watermark,
+    # so cached analytics responses follow this counter instead
+    if written:
+        http_cache.touch_analytics()
+
+
+def _ledger(ticket_ids):
+    rows = db.session.execute(
+        select(AnalyticsLedgerEntry.ticket_id, *_LEDGER_COLUMNS)
+        .where(AnalyticsLedgerEntry.ticket_id.in_(ticket_ids))
+    )
+    return {row[0]: LedgerEntry(*row[1:]) for row in rows}
+
+
+def _replace_ledger(ticket_ids, entries):
+    db.session.execute(delete(AnalyticsLedgerEntry).where(AnalyticsLedgerEntry.ticket_id.in_(ticket_ids)))
+    if entries:
+        db.session.execute(insert(AnalyticsLedgerEntry), entries)
+
+
+def fold_tickets(rows):
+    """
+    Bring the rollups in step with these ticket rows
+    Only tickets whose ledger entry changed touch the rollups, so
+    re-reading a ticket is harmless. Returns how many changed.
+    """
+    previous = _ledger([row.id for row in rows])
+    volume, resolution, changed = Counter(), Counter(), {}
+    for row in rows:
+        entry = ledger_entry(row)
+        old = previous.get(row.id)
+        if entry == old:
+            continue
+        _add_entry(volume, resolution, old, -1)
+        _add_entry(volume, resolution, entry, 1)
+        changed[row.id] = dict(entry._asdict(), ticket_id=row.id)
+
+    _apply(volume, resolution)
+    if changed:
+        _replace_ledger(list(changed), list(changed.values()))
+    return len(changed)
+
+
+def forget_tickets(ticket_ids):
+    """Take deleted tickets out of the rollups; returns how many had counted"""
+    # A new ticket may have been given a deleted one's id (SQLite can reuse
+    # the highest id); that ticket is handled by fold_tickets instead
+    live = set(db.session.scalars(select(Ticket.id).where(Ticket.id.in_(ticket_ids))))
+    gone = [ticket_id for ticket_id in set(ticket_ids) if ticket_id not in live]
+    previous = _ledger(gone) if gone else {}
+    volume, resolution = Counter(), Counter()
+    for entry in previous.values():
+        _add_entry(volume, resolution, entry, -1)
+    _apply(volume, resolution)
+    if previous:
+        _replace_ledger(list(previous), [])
+    return len(previous)
+
+
+def _after(time_col, id_col, mark):
+    """Rows strictly after a (timestamp, id) mark"""
+    timestamp, row_id = mark
+    return or_(time_col > timestamp, and_(time_col == timestamp, id_col > row_id))
+
+
+def _load_mark(name):
+    row = db.session.get(AnalyticsWatermark, name)
+    return (row.mark_at, row.mark_id) if row else None
+
+
+def _save_mark(name, mark, now):
+    db.session.merge(AnalyticsWatermark(name=name, mark_at=mark[0], mark_id=mark[1], refreshed_at=now))
+
+
+def _backfill_archived(batch_size):
+    """Fold in archived tickets, which the updated_at scan never sees (first run only)"""
+    last_id, folded = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(*_ticket_columns(ArchivedTicket))
+            .where(ArchivedTicket.id > last_id)
+            .order_by(ArchivedTicket.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return folded
+        folded += fold_tickets(rows)
+        last_id = rows[-1].id
+        db.session.commit()
+
+
+def refresh(batch_size=None, overlap_seconds=None):
+    """
+    Fold every ticket changed or deleted since the last run into the rollups
+    Tickets are read in batches off the (updated_at, id) index from the
+    saved watermark, and deletions from the tombstones the same way; each
+    batch commits with its watermark, so an interrupted run resumes where
+    it stopped. Each run re-reads a short overlap window for commits that
+    landed with an older updated_at. Returns the number of tickets changed.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['ANALYTICS_BATCH_SIZE']
+    overlap = timedelta(seconds=config['SYNC_OVERLAP_SECONDS'] if overlap_seconds is None else overlap_seconds)
+    now = datetime.utcnow()
+    changed = 0
+
+    mark = _load_mark(TICKETS_MARK)
+    if mark is None:
+        changed += _backfill_archived(batch_size)
+        mark = BEGINNING
+    elif mark[0] - datetime.min > overlap:
+        mark = (mark[0] - overlap, 0)
+
+    while True:
+        rows = db.session.execute(
+            select(*_ticket_columns(Ticket), Ticket.updated_at)
+            .where(_after(Ticket.updated_at, Ticket.id, mark))
+            .order_by(Ticket.updated_at, Ticket.id)
+            .limit(batch_size)
+        ).all()
+        if rows:
+            changed += fold_tickets(rows)
+            mark = (rows[-1].updated_at, rows[-1].id)
+            if _load_mark(TICKETS_MARK) != mark:
+                _save_mark(TICKETS_MARK, mark, now)
+        elif _load_mark(TICKETS_MARK) is None:
+            _save_mark(TICKETS_MARK, BEGINNING, now)
+        db.session.commit()
+        if len(rows) < batch_size:
+            break
+
+    mark = _load_mark(TOMBSTONES_MARK) or BEGINNING
+    if mark[0] - datetime.min > overlap:
+        mark = (mark[0] - overlap, 0)
+    while True:
+        rows = db.session.execute(
+            select(TicketTombstone.id, TicketTombstone.ticket_id, TicketTombstone.deleted_at)
+            .where(TicketTombstone.reason == 'deleted',
+                   _after(TicketTombstone.deleted_at, TicketTombstone.id, mark))
+            .order_by(TicketTombstone.deleted_at, TicketTombstone.id)
+            .limit(batch_size)
+        ).all()
+        if rows:
+            changed += forget_tickets([row.ticket_id for row in rows])
+            mark = (rows[-1].deleted_at, rows[-1].id)
+            if _load_mark(TOMBSTONES_MARK) != mark:
+                _save_mark(TOMBSTONES_MARK, mark, now)
+        db.session.commit()
+        if len(rows) < batch_size:
+            break
+
+    return changed
+
+
+def rebuild():
+    """Empty the rollups and the ledger so the next refresh recomputes everything"""
+    for model in (AnalyticsLedgerEntry, AnalyticsVolumeDaily, AnalyticsResolutionDaily, AnalyticsWatermark):
+        db.session.execute(delete(model))
+    http_cache.touch_analytics()
+    db.session.commit()
+
+
+def watermarks():
+    """{name: (mark_at, mark_id)} - what the rollups are up to date with"""
+    rows = db.session.execute(select(AnalyticsWatermark.name, AnalyticsWatermark.mark_at,
+                                     AnalyticsWatermark.mark_id)).all()
+    return {name: (mark_at, mark_id) for name, mark_at, mark_id in rows}
+
+
+def _percentile(buckets, total, fraction):
+    """Value at a fraction of the way through sorted (bucket, count) pairs"""
+    rank = max(1, math.ceil(fraction * total))
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= rank:
+            return round(bucket_value(bucket))
+    return None
+
+
+def _technician_usernames(keys):
+    ids = [int(key) for key in keys if key != UNASSIGNED]
+    if not ids:
+        return {}
+    return {str(user_id): username for user_id, username in db.session.execute(
+        select(User.id, User.username).where(User.id.in_(ids))
+    )}
+
+
+def read_resolution(group_by, since, until):
+    """
+    Time-to-resolve of tickets resolved between two days (inclusive)
+    Mean is exact; median and p90 come from the duration buckets.
+    Reads only the rollup rows for the range, never the tickets table.
+    """
+    rows = db.session.execute(
+        select(AnalyticsResolutionDaily.key, AnalyticsResolutionDaily.bucket,
+               func.sum(AnalyticsResolutionDaily.tickets), func.sum(AnalyticsResolutionDaily.seconds))
+        .where(AnalyticsResolutionDaily.dimension == group_by,
+               AnalyticsResolutionDaily.day >= since, AnalyticsResolutionDaily.day <= until)
+        .group_by(AnalyticsResolutionDaily.key, AnalyticsResolutionDaily.bucket)
+        .order_by(AnalyticsResolutionDaily.key, AnalyticsResolutionDaily.bucket)
+    ).all()
+
+    groups = {}
+    for key, bucket, tickets, seconds in rows:
+        if tickets:
+            group = groups.setdefault(key, {'buckets': [], 'tickets': 0, 'seconds': 0.0})
+            group['buckets'].append((bucket, tickets))
+            group['tickets'] += tickets
+            group['seconds'] += seconds
+
+    usernames = _technician_usernames(groups) if group_by == 'technician' else {}
+    results = []
+    for key, group in groups.items():
+        result = {
+            'key': key,
+            'tickets': group['tickets'],
+            'mean_seconds': round(group['seconds'] / group['tickets']),
+            'median_seconds': _percentile(group['buckets'], group['tickets'], 0.5),
+            'p90_seconds': _percentile(group['buckets'], group['tickets'], 0.9),
+        }
+        if group_by == 'technician':
+            result['username'] = usernames.get(key)
+        results.append(result)
+    results.sort(key=lambda result: -result['tickets'])
+    return results
+
+
+def read_volume(group_by, since, until):
+    """Tickets opened and resolved per day between two days (inclusive), per key"""
+    rows = db.session.execute(
+        select(AnalyticsVolumeDaily.day, AnalyticsVolumeDaily.key,
+               AnalyticsVolumeDaily.opened, AnalyticsVolumeDaily.closed)
+        .where(AnalyticsVolumeDaily.dimension == group_by,
+               AnalyticsVolumeDaily.day >= since, AnalyticsVolumeDaily.day <= until)
+        .order_by(AnalyticsVolumeDaily.day, AnalyticsVolumeDaily.key)
+    ).all()
+
+    by_day = {}
+    for day, key, opened, closed in rows:
+        if opened or closed:
+            by_day.setdefault(day.isoformat(), {})[key] = {'opened': opened, 'closed': closed}
+    return by_day
+
+
+class AnalyticsRefresher:
+    """Runs refresh() every ANALYTICS_REFRESH_SECONDS in a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['ANALYTICS_REFRESH_SECONDS']
+        self._stop = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    changed = refresh()
+                    if changed:
+                        logger.info('Analytics rollups updated for %d tickets', changed)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Analytics refresh failed')
+                finally:
+                    db.session.remove()
+                self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+def init_app(app):
+    """Refresh the rollups in a background thread when ANALYTICS_REFRESH_IN_PROCESS is on"""
+    if not app.config['ANALYTICS_REFRESH_IN_PROCESS']:
+        return
+    refresher = AnalyticsRefresher(app)
+    app.extensions['analytics_refresher'] = refresher
+    threading.Thread(target=refresher.run, name='analytics-refresh', daemon=True).start()
+
+
+def register_commands(app):
+    """Add `flask analytics-refresh` and `flask analytics-rebuild` to the app's CLI"""
+
+    @app.cli.command('analytics-refresh')
+    def analytics_refresh_command():
+        """Fold tickets changed since the last run into the analytics rollups (run from cron)"""
+        changed = refresh()
+        click.echo(f'Analytics rollups updated for {changed} tickets')
+
+    @app.cli.command('analytics-rebuild')
+    def analytics_rebuild_command():
+        """Recompute the analytics rollups from every ticket, including archived ones"""
+        rebuild()
+        changed = refresh()
+        click.echo(f'Analytics rollups rebuilt from {changed} tickets')
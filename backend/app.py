@@ -4,6 +4,7 @@ from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from backend.models import db
 from backend.config import config
+from backend import database, replicas, migrations, stats, sync, events, current_user, search, metrics, instrumentation, assignment, sla, archive, serialization, http_cache, passwords, audit, analytics, admission, jobs, notifications
 import os
 
 def create_app(config_name='development'):
@@ -18,37 +19,89 @@ def create_app(config_name='development'):
     # Load configuration
     app.config.from_object(config[config_name])
     
-    # Initialize database
+    # Fast JSON encoding for responses (orjson when installed)
+    serialization.init_app(app)
+    
+    # Initialize database (plus per-connection SQLite settings)
     db.init_app(app)
+    database.init_app(app)
+    
+    # Send read-only requests to read replicas when any are configured
+    replicas.init_app(app)
+    
+    # Pub/sub bus for pushing ticket changes to connected clients
+    events.init_app(app)
+    
+    # Short-lived cache behind load_current_user()
+    current_user.init_app(app)
+    
+    # Automatic assignment of new tickets (follows loads through the event bus)
+    assignment.init_app(app)
+    
+    # Metrics served at /api/metrics, and the opt-in request timing that feeds them
+    metrics.init_app(app)
+    instrumentation.init_app(app)
+    
+    # Bounded worker pool for password hashing (login/register)
+    passwords.init_app(app)
+    
+    # Per-user/role rate limits and concurrency caps on API requests
+    admission.init_app(app)
     
     # Enable CORS (allow frontend origin and cookies in development)
     CORS(
         app,
         supports_credentials=True,
         resources={
-            r"/api/*": {
-                "origins": [
-                    "http://127.0.0.1:5500",
-                    "http://localhost:5500",
-                    "http://127.0.0.1:8000",
-                    "http://localhost:8000",
-                ]
-            }
+            r"/api/*": {"origins": app.config['CORS_ORIGINS']}
         },
     )
     
-    # Create database tables if they don't exist
-    with app.app_context():
-        db.create_all()
+    # Bring the database schema up to date (creates tables on a fresh database)
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            migrations.upgrade_database()
+    
+    # Buffered activity log writer (AUDIT_WRITE_MODE=buffered), and replay of
+    # anything a crashed process left in its spool
+    audit.init_app(app)
+    
+    # Maintenance commands (flask db-upgrade, flask stats-rebuild, ...)
+    migrations.register_commands(app)
+    stats.register_commands(app)
+    sync.register_commands(app)
+    search.register_commands(app)
+    sla.register_commands(app)
+    archive.register_commands(app)
+    analytics.register_commands(app)
+    jobs.register_commands(app)
+    
+    # SLA scheduler thread (only when SLA_SCHEDULER_IN_PROCESS is on)
+    sla.init_app(app)
+    
+    # Analytics rollup refresh thread (only when ANALYTICS_REFRESH_IN_PROCESS is on)
+    analytics.init_app(app)
+    
+    # Notification emails, and the job workers that send them (only when
+    # JOBS_IN_PROCESS is on; otherwise run `flask jobs-run`)
+    notifications.init_app(app)
+    jobs.init_app(app)
     
     # Register blueprints (we'll create these next)
-    from backend.routes.auth_routes import auth_bp
+    from backend.routes.auth_routes import auth_bp, role_required
     from backend.routes.ticket_routes import ticket_bp
     from backend.routes.user_routes import user_bp
+    from backend.routes.export_routes import export_bp
+    from backend.routes.analytics_routes import analytics_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(ticket_bp, url_prefix='/api/tickets')
     app.register_blueprint(user_bp, url_prefix='/api/users')
+    app.register_blueprint(export_bp, url_prefix='/api/export')
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    
+    # gzip/brotli for large JSON responses
+    http_cache.init_app(app)
     
     # Health check endpoint (useful for monitoring if app is running)
     @app.route('/api/health', methods=['GET'])
@@ -58,6 +111,16 @@ def create_app(config_name='development'):
             'message': 'Ticketing system is running'
         }), 200
     
+    # Prometheus scrape endpoint, for scrapers sending METRICS_TOKEN as a
+    # bearer token and for managers
+    manager_metrics = role_required('manager')(metrics.metrics_response)
+    
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics_endpoint():
+        if metrics.scraper_authorized():
+            return metrics.metrics_response()
+        return manager_metrics()
+    
     # Root endpoint
     @app.route('/', methods=['GET'])
     def root():
@@ -66,22 +129,28 @@ def create_app(config_name='development'):
             'version': '1.0.0',
             'endpoints': {
                 'health': '/api/health',
+                'metrics': '/api/metrics',
                 'auth': '/api/auth',
                 'tickets': '/api/tickets',
-                'users': '/api/users'
+                'users': '/api/users',
+                'export': '/api/export',
+                'analytics': '/api/analytics'
             }
         }), 200
 
     # Serve frontend files directly from Flask for same-origin dev
     frontend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend'))
 
+    # Cacheable by browsers and proxies; revalidated with ETag/Last-Modified
+    frontend_max_age = app.config['FRONTEND_CACHE_MAX_AGE']
+
     @app.route('/login.html')
     def serve_login():
-        return send_from_directory(frontend_dir, 'login.html')
+        return send_from_directory(frontend_dir, 'login.html', max_age=frontend_max_age)
 
     @app.route('/dashboard.html')
     def serve_dashboard():
-        return send_from_directory(frontend_dir, 'dashboard.html')
+        return send_from_directory(frontend_dir, 'dashboard.html', max_age=frontend_max_age)
     
     return app
 
@@ -98,4 +167,9 @@ if __name__ == '__main__':
     print(f"Environment: {env}")
     print("Server running on http://127.0.0.1:5000")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if app.config['SERVER_MODE'] == 'asgi':
+        # Async handlers for the hot endpoints (see backend/asgi.py)
+        import uvicorn
+        uvicorn.run('backend.asgi:create_asgi_app', factory=True, host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, insert, delete, literal, DateTime, String
+from backend.models import db, Ticket, ActivityLog, ArchivedTicket, ArchivedActivityLog, TicketTombstone
+from backend import search, http_cache
+
+
+def _copy_columns(source, target):
+    """Column names shared by a hot table and its archive (everything but archived_at)"""
+    return [column.name for column in source.__table__.columns if column.name in target.__table__.columns]
+
+
+def archive_batch(cutoff, statuses, batch_size):
+    """
+    Move one batch of tickets resolved before cutoff, with their activity
+    logs, into the archive tables in a single transaction
+    Stats counters are left alone (archived tickets still count), the
+    tickets leave the search index, and 'archived' tombstones tell
+    delta-sync clients to drop them. Returns the number of tickets moved.
+    """
+    batch = db.session.execute(
+        select(Ticket.id, Ticket.created_by, Ticket.assigned_to)
+        .where(Ticket.status.in_(statuses), Ticket.resolved_at < cutoff)
+        .order_by(Ticket.resolved_at, Ticket.id)
+        .limit(batch_size)
+    ).all()
+    if not batch:
+        return 0
+    ticket_ids = [row.id for row in batch]
+
+    now = literal(datetime.utcnow(), DateTime)
+    tickets = Ticket.__table__
+    activity_logs = ActivityLog.__table__
+
+    ticket_columns = _copy_columns(Ticket, ArchivedTicket)
+    db.session.execute(insert(ArchivedTicket).from_select(
+        ticket_columns + ['archived_at'],
+        select(*[tickets.c[name] for name in ticket_columns], now).where(tickets.c.id.in_(ticket_ids))
+    ))
+    activity_columns = _copy_columns(ActivityLog, ArchivedActivityLog)
+    db.session.execute(insert(ArchivedActivityLog).from_select(
+        activity_columns + ['archived_at'],
+        select(*[activity_logs.c[name] for name in activity_columns], now)
+        .where(activity_logs.c.ticket_id.in_(ticket_ids))
+    ))
+    db.session.execute(insert(TicketTombstone).from_select(
+        ['ticket_id', 'created_by', 'assigned_to', 'reason', 'deleted_at'],
+        select(tickets.c.id, tickets.c.created_by, tickets.c.assigned_to,
+               literal('archived', String), now).where(tickets.c.id.in_(ticket_ids))
+    ))
+
+    search.remove_tickets(ticket_ids)
+    http_cache.touch(*{user_id for row in batch for user_id in (row.created_by, row.assigned_to)})
+
+    # Activity logs first - the ORM cascade doesn't run for bulk deletes
+    db.session.execute(
+        delete(ActivityLog).where(ActivityLog.ticket_id.in_(ticket_ids)),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.execute(
+        delete(Ticket).where(Ticket.id.in_(ticket_ids)),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return len(ticket_ids)
+
+
+def archive_tickets(older_than_days=None, batch_size=None, log=None):
+    """
+    Archive every ticket resolved more than older_than_days ago
+    Works in batches of ARCHIVE_BATCH_SIZE so each transaction stays short.
+    Returns the number of tickets archived.
+    """
+    config = current_app.config
+    days = config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, config['ARCHIVE_STATUSES'], batch_size)
+        if not moved:
+            return total
+        total += moved
+        if log:
+            log(f'Archived {total} tickets')
+
+
+def register_commands(app):
+    """Add `flask archive-tickets` to the app's CLI"""
+
+    @app.cli.command('archive-tickets')
+    @click.option('--older-than-days', type=int, default=None,
+                  help='Archive tickets resolved more than this many days ago (default: ARCHIVE_AFTER_DAYS)')
+    @click.option('--batch-size', type=int, default=None, help='Tickets moved per transaction')
+    def archive_tickets_command(older_than_days, batch_size):
+        """Move old resolved/closed tickets and their activity into the archive tables"""
+        total = archive_tickets(older_than_days, batch_size, log=click.echo)
+        click.echo(f'Archived {total} tickets')
@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import re
+import time
+from urllib.parse import parse_qsl
+from itsdangerous import BadSignature
+from sqlalchemy import select, update, func
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie, dump_cookie, parse_accept_header, http_date
+from werkzeug.sansio.http import is_resource_modified
+from backend import database, events, http_cache, passwords
+from backend.admission import Rejected, retry_after_header
+from backend.app import create_app
+from backend.current_user import CachedUser
+from backend.models import db, User, Ticket, ActivityLog
+from backend.pagination import parse_limit, keyset_condition, trim_page
+from backend.permissions import visible_tickets, can_view_ticket
+from backend.replicas import LAST_WRITE_KEY
+from backend.serialization import USER_FIELDS, ticket_rows_select, activity_rows_select, rows_to_dicts
+from backend.ticket_filters import apply_ticket_filters
+
+# Async drivers for the sync URLs in SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(flask_app):
+    """ASYNC_DATABASE_URL, or the app's database URL switched to its async driver"""
+    if flask_app.config['ASYNC_DATABASE_URL']:
+        return flask_app.config['ASYNC_DATABASE_URL']
+    # The engine's URL rather than the config one: Flask-SQLAlchemy moves
+    # relative SQLite paths into the instance folder
+    with flask_app.app_context():
+        url = db.engine.url
+    backend_name = url.get_backend_name()
+    if backend_name not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver known for {backend_name}; set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend_name])
+
+
+def create_async_engine_for(flask_app):
+    """Async engine on the app's database, with the same pool and SQLite settings"""
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError:
+        raise RuntimeError('SERVER_MODE=asgi needs SQLAlchemy asyncio support (pip install "sqlalchemy[asyncio]")')
+
+    url = async_database_url(flask_app)
+    engine = create_async_engine(url, **flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if engine.dialect.name == 'sqlite':
+        pragmas = database.sqlite_pragmas(flask_app.config)
+        if pragmas:
+            database.configure_sqlite(engine.sync_engine, pragmas)
+    return engine
+
+
+class SessionCookie:
+    """
+    Reads and writes Flask's signed session cookie outside a Flask request,
+    so both servers accept the same login
+    """
+
+    def __init__(self, flask_app):
+        interface = flask_app.session_interface
+        self.name = interface.get_cookie_name(flask_app)
+        self._serializer = interface.get_signing_serializer(flask_app)
+        self._max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self._options = {
+            'domain': interface.get_cookie_domain(flask_app),
+            'path': interface.get_cookie_path(flask_app),
+            'secure': interface.get_cookie_secure(flask_app),
+            'httponly': interface.get_cookie_httponly(flask_app),
+            'samesite': interface.get_cookie_samesite(flask_app),
+        }
+
+    def load(self, cookies):
+        value = cookies.get(self.name)
+        if not value or self._serializer is None:
+            return {}
+        try:
+            return dict(self._serializer.loads(value, max_age=self._max_age))
+        except BadSignature:
+            return {}
+
+    def dump(self, data):
+        """Set-Cookie header value carrying data"""
+        return dump_cookie(self.name, self._serializer.dumps(data), **self._options)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its request body arrived"""
+
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP request the async handlers use"""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+
+async def send_response(send, status, headers, body=b''):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsyncTicketApp:
+    """
+    ASGI application serving the hottest read endpoints and the event
+    stream natively, with everything else handed to the Flask app
+
+    Native routes (same URLs, session cookie, JSON, ETags, permissions and
+    admission limits as the Flask views):
+        GET  /api/tickets              GET  /api/tickets/<id>
+        GET  /api/tickets/events       POST /api/auth/login
+        GET  /api/auth/me
+    They query through an async engine, so a request waiting on the
+    database or on a password hash holds no thread, and an open event
+    stream costs a coroutine instead of a worker thread.
+    Writes, exports, archived tickets and all other endpoints run in Flask
+    on asgiref's thread pool, unchanged. Request instrumentation and read
+    replica routing only apply to those.
+    """
+
+    def __init__(self, flask_app, engine, fallback):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.engine = engine
+        self.fallback = fallback
+        self.session_cookie = SessionCookie(flask_app)
+        # (method, path, handler, endpoint of the Flask view it stands in for)
+        self.routes = [
+            ('GET', re.compile(r'/api/tickets'), self.list_tickets, 'tickets.get_tickets'),
+            ('GET', re.compile(r'/api/tickets/events'), self.ticket_events, 'tickets.stream_ticket_events'),
+            ('GET', re.compile(r'/api/tickets/(\d+)'), self.get_ticket, 'tickets.get_ticket'),
+            ('POST', re.compile(r'/api/auth/login'), self.login, 'auth.login'),
+            ('GET', re.compile(r'/api/auth/me'), self.me, 'auth.get_current_user'),
+        ] if self.config['ASGI_ASYNC_ROUTES'] else []
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http':
+            for method, pattern, handler, endpoint in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match and scope['method'] == method:
+                    request = AsyncRequest(scope, receive)
+                    # Same rate limits and concurrency caps as the Flask views
+                    admission = self.flask_app.extensions.get('admission')
+                    release = None
+                    if admission is not None and endpoint not in admission.exempt:
+                        client = scope.get('client')
+                        try:
+                            user = await self._session_user(self.session_cookie.load(request.cookies))
+                            release = admission.admit(endpoint, user, client[0] if client else None)
+                        except Rejected as e:
+                            return await self._error(request, send, 429, e.message,
+                                                     [('Retry-After', retry_after_header(e.retry_after))])
+                    try:
+                        return await handler(request, send, *match.groups())
+                    except ClientDisconnected:
+                        return
+                    finally:
+                        if release is not None:
+                            release()
+
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Responses
+
+    def _cors_headers(self, request):
+        origin = request.headers.get('origin')
+        if origin not in self.config['CORS_ORIGINS']:
+            return []
+        return [
+            ('Access-Control-Allow-Origin', origin),
+            ('Access-Control-Allow-Credentials', 'true'),
+            ('Vary', 'Origin'),
+        ]
+
+    @staticmethod
+    def _validator_headers(etag, last_modified):
+        # Same as http_cache.set_validators
+        headers = [('ETag', f'W/"{etag}"'), ('Cache-Control', 'private, no-cache')]
+        if last_modified is not None:
+            headers.append(('Last-Modified', http_date(last_modified)))
+        return headers
+
+    async def _json(self, request, send, status, data, headers=(), validators=None):
+        # Through the Flask app's JSON provider, so the bytes match the sync views
+        body = self.flask_app.json.response(data).get_data()
+        headers = [('Content-Type', 'application/json'), ('Vary', 'Cookie')] + list(headers)
+        if validators:
+            headers += self._validator_headers(*validators)
+
+        if self.config['COMPRESS_ENABLED'] and status == 200:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if len(body) >= self.config['COMPRESS_MIN_SIZE']:
+                accepted = parse_accept_header(request.headers.get('accept-encoding'))
+                encoding, body = http_cache.encode_body(body, accepted, self.config)
+                if encoding:
+                    headers.append(('Content-Encoding', encoding))
+
+        headers.append(('Content-Length', str(len(body))))
+        await send_response(send, status, headers + self._cors_headers(request), body)
+
+    async def _error(self, request, send, status, message, headers=()):
+        await self._json(request, send, status, {'error': message}, headers)
+
+    async def _not_modified(self, request, send, etag, last_modified):
+        """Send a 304 and return True if the client's copy is still current"""
+        if is_resource_modified(
+            http_if_modified_since=request.headers.get('if-modified-since'),
+            http_if_none_match=request.headers.get('if-none-match'),
+            http_if_match=request.headers.get('if-match'),
+            etag=etag,
+            last_modified=last_modified,
+        ):
+            return False
+        headers = self._validator_headers(etag, last_modified) + self._cors_headers(request)
+        await send_response(send, 304, headers)
+        return True
+
+    # Shared lookups
+
+    async def _current_user(self, conn, session):
+        """Same as load_current_user(), sharing the app's user cache"""
+        user_id = session.get('user_id')
+        if user_id is None:
+            return None
+        cache = self.flask_app.extensions.get('user_cache')
+        user = cache.get(user_id) if cache else None
+        if user is None:
+            row = (await conn.execute(select(*USER_FIELDS).where(User.id == user_id))).first()
+            if row is None:
+                return None
+            user = CachedUser(*row)
+            if cache:
+                cache.put(user)
+        return user
+
+    async def _session_user(self, session):
+        """_current_user, only taking a connection when the user cache misses"""
+        user_id = session.get('user_id')
+        if user_id is None:
+            return None
+        cache = self.flask_app.extensions.get('user_cache')
+        user = cache.get(user_id) if cache else None
+        if user is None:
+            async with self.engine.connect() as conn:
+                user = await self._current_user(conn, session)
+        return user
+
+    def _limit(self, request, default_key, maximum_key):
+        return parse_limit(request.args.get('limit'), self.config[default_key], self.config[maximum_key])
+
+    # Handlers
+
+    async def list_tickets(self, request, send):
+        """Async GET /api/tickets - see ticket_routes.get_tickets"""
+        session = self.session_cookie.load(request.cookies)
+        if 'user_id' not in session:
+            return await self._error(request, send, 401, 'Authentication required')
+
+        try:
+            async with self.engine.connect() as conn:
+                user = await self._current_user(conn, session)
+                if user is None:
+                    return await self._error(request, send, 401, 'Authentication required')
+
+                include_users = request.args.get('include_users', '').lower() in ('1', 'true', 'yes')
+                scopes = http_cache.list_scopes(user, include_users)
+                versions = (await conn.execute(http_cache.scopes_version_select(scopes))).all()
+                etag, last_modified = http_cache.scopes_validators_from(scopes, versions)
+                if await self._not_modified(request, send, etag, last_modified):
+                    return
+
+                statement = visible_tickets(ticket_rows_select(include_users), user)
+                try:
+                    statement = apply_ticket_filters(statement, request.args)
+                    limit = self._limit(request, 'TICKETS_PAGE_SIZE', 'TICKETS_MAX_PAGE_SIZE')
+                    condition = keyset_condition(Ticket.created_at, Ticket.id, request.args.get('cursor'))
+                except ValueError as e:
+                    return await self._error(request, send, 400, str(e))
+
+                page = statement if condition is None else statement.where(condition)
+                page = page.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(limit + 1)
+                tickets, next_cursor = trim_page((await conn.execute(page)).all(), limit,
+                                                 Ticket.created_at, Ticket.id)
+                tickets_data = rows_to_dicts(tickets)
+
+                response = {
+                    'tickets': tickets_data,
+                    'count': len(tickets_data),
+                    'next_cursor': next_cursor
+                }
+                if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+                    total = select(func.count()).select_from(statement.subquery())
+                    response['total'] = (await conn.execute(total)).scalar()
+        except Exception as e:
+            return await self._error(request, send, 500, str(e))
+
+        await self._json(request, send, 200, response, validators=(etag, last_modified))
+
+    async def get_ticket(self, request, send, ticket_id):
+        """Async GET /api/tickets/<id> for tickets still in the hot table"""
+        ticket_id = int(ticket_id)
+        session = self.session_cookie.load(request.cookies)
+        if 'user_id' not in session:
+            return await self._error(request, send, 401, 'Authentication required')
+
+        try:
+            async with self.engine.connect() as conn:
+                head = (await conn.execute(
+                    select(Ticket.created_by, Ticket.assigned_to, Ticket.updated_at)
+                    .where(Ticket.id == ticket_id)
+                )).first()
+                if head is not None:
+                    result = await self._ticket_detail(request, send, conn, session, ticket_id, head)
+        except Exception as e:
+            return await self._error(request, send, 500, str(e))
+
+        if head is None:
+            # Archived or missing - rare enough to leave to the Flask view
+            # (whose admission check counts the request a second time)
+            return await self.fallback(request.scope, request.receive, send)
+        if result is not None:
+            await self._json(request, send, 200, result[0], validators=result[1])
+
+    async def _ticket_detail(self, request, send, conn, session, ticket_id, head):
+        """(body, validators) for get_ticket, or None once an error/304 was sent"""
+        user = await self._current_user(conn, session)
+        if user is None:
+            await self._error(request, send, 401, 'Authentication required')
+            return None
+        if not can_view_ticket(user, head.created_by, head.assigned_to):
+            await self._error(request, send, 403, 'Access denied')
+            return None
+
+        last_modified = head.updated_at
+        etag = http_cache.make_etag(Ticket.__tablename__, ticket_id, last_modified.isoformat())
+        if await self._not_modified(request, send, etag, last_modified):
+            return None
+
+        try:
+            limit = self._limit(request, 'ACTIVITY_PAGE_SIZE', 'ACTIVITY_MAX_PAGE_SIZE')
+        except ValueError as e:
+            await self._error(request, send, 400, str(e))
+            return None
+
+        ticket = (await conn.execute(ticket_rows_select(include_users=True).where(Ticket.id == ticket_id))).first()
+        if ticket is None:
+            await self._error(request, send, 404, 'Ticket not found')
+            return None
+
+        activities = (await conn.execute(
+            activity_rows_select(ActivityLog, include_user=True)
+            .where(ActivityLog.ticket_id == ticket_id)
+            .order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc())
+            .limit(limit + 1)
+        )).all()
+        activities, next_cursor = trim_page(activities, limit, ActivityLog.created_at, ActivityLog.id)
+
+        return {
+            'ticket': rows_to_dicts([ticket])[0],
+            'activities': rows_to_dicts(activities),
+            'activities_next_cursor': next_cursor
+        }, (etag, last_modified)
+
+    async def ticket_events(self, request, send):
+        """Async GET /api/tickets/events - see ticket_routes.stream_ticket_events"""
+        session = self.session_cookie.load(request.cookies)
+        if 'user_id' not in session:
+            return await self._error(request, send, 401, 'Authentication required')
+        async with self.engine.connect() as conn:
+            user = await self._current_user(conn, session)
+        if user is None:
+            return await self._error(request, send, 401, 'Authentication required')
+        user_id, role = user.id, user.role
+
+        bus = self.flask_app.extensions['event_bus']
+        subscription = bus.subscribe(lambda event: events.can_receive(user_id, role, event),
+                                     loop=asyncio.get_running_loop())
+        heartbeat = self.config['SSE_HEARTBEAT_SECONDS']
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await request.receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            headers = [
+                ('Content-Type', 'text/event-stream; charset=utf-8'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+            ] + self._cors_headers(request)
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+            chunk = 'retry: 5000\n\n'
+            while not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+                event = await subscription.get_async(heartbeat)
+                if event is None:
+                    chunk = ': keep-alive\n\n'
+                elif event is events.OVERFLOW:
+                    chunk = 'event: resync\ndata: {}\n\n'
+                else:
+                    chunk = events.format_sse(event)
+        finally:
+            watcher.cancel()
+            bus.unsubscribe(subscription)
+
+    async def login(self, request, send):
+        """Async POST /api/auth/login - see auth_routes.login"""
+        try:
+            data = self.flask_app.json.loads(await request.body() or b'null')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'username' not in data or 'password' not in data:
+            return await self._error(request, send, 400, 'Username and password are required')
+
+        hasher = self.flask_app.extensions['password_hasher']
+        try:
+            # Connection goes back to the pool before the (slow) hash check
+            async with self.engine.connect() as conn:
+                row = (await conn.execute(
+                    select(*USER_FIELDS, User.password_hash).where(User.username == data['username'])
+                )).first()
+            if row is None or not await hasher.verify_async(row.password_hash, data['password']):
+                return await self._error(request, send, 401, 'Invalid username or password')
+
+            # Hashed with older PASSWORD_HASH_* settings - upgrade while we have the password
+            if hasher.needs_rehash(row.password_hash):
+                new_hash = await hasher.hash_async(data['password'])
+                async with self.engine.begin() as conn:
+                    await conn.execute(update(User).where(User.id == row.id).values(password_hash=new_hash))
+        except passwords.HashingBusy as e:
+            return await self._error(request, send, 503, 'Too many logins in progress, please retry shortly',
+                                     headers=[('Retry-After', str(e.retry_after))])
+        except Exception as e:
+            return await self._error(request, send, 500, str(e))
+
+        session = self.session_cookie.load(request.cookies)
+        session.update(user_id=row.id, username=row.username, role=row.role)
+        if self.flask_app.extensions.get('replica_engines'):
+            # The Flask app does this after any write; a rehash may be one
+            session[LAST_WRITE_KEY] = time.time()
+
+        user = CachedUser(row.id, row.username, row.email, row.role, row.created_at)
+        await self._json(request, send, 200, {
+            'message': 'Login successful',
+            'user': user.to_dict()
+        }, headers=[('Set-Cookie', self.session_cookie.dump(session))])
+
+    async def me(self, request, send):
+        """Async GET /api/auth/me"""
+        session = self.session_cookie.load(request.cookies)
+        if 'user_id' not in session:
+            return await self._error(request, send, 401, 'Authentication required')
+        try:
+            async with self.engine.connect() as conn:
+                user = await self._current_user(conn, session)
+        except Exception as e:
+            return await self._error(request, send, 500, str(e))
+        if user is None:
+            return await self._error(request, send, 404, 'User not found')
+        await self._json(request, send, 200, {'user': user.to_dict()})
+
+
+def create_asgi_app(config_name=None):
+    """
+    ASGI entry point
+    uvicorn --factory backend.asgi:create_asgi_app
+    Needs sqlalchemy[asyncio], asgiref and the async driver for the
+    database (aiosqlite or asyncpg)
+    """
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        raise RuntimeError('SERVER_MODE=asgi needs the asgiref package (pip install asgiref)')
+
+    flask_app = create_app(config_name or os.environ.get('FLASK_ENV', 'development'))
+    engine = create_async_engine_for(flask_app)
+    return AsyncTicketApp(flask_app, engine, WsgiToAsgi(flask_app))
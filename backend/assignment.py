@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from sqlalchemy import select, func
+from backend.models import db, User, Ticket
+from backend import events
+
+# Tickets that count towards a technician's load
+OPEN_STATUSES = ('open', 'in_progress')
+
+
+def _is_open(ticket):
+    return ticket.get('status') in OPEN_STATUSES
+
+
+class LoadIndex:
+    """
+    Open-ticket count per technician, kept as lazy min-heaps
+    One heap covers every technician and one per category covers those with
+    history in that category. Changing a load pushes a fresh entry instead of
+    re-sorting; stale entries are dropped when they reach the top, so picking
+    the least loaded technician is O(log n) amortized.
+    Not thread-safe on its own - AssignmentEngine holds the lock.
+    """
+
+    def __init__(self):
+        self.loads = {}
+        self.categories = {}  # category -> set of technician ids
+        self._heaps = {None: []}
+        self._last_assigned = {}
+        self._sequence = itertools.count()
+        # Bumped whenever the set of technicians changes
+        self.version = 0
+
+    def load(self, technicians, open_counts, category_pairs):
+        self.loads = {tech_id: open_counts.get(tech_id, 0) for tech_id in technicians}
+        self.categories = {}
+        for tech_id, category in category_pairs:
+            if tech_id in self.loads:
+                self.categories.setdefault(category, set()).add(tech_id)
+        self._heaps = {None: []}
+        for category in self.categories:
+            self._heaps[category] = []
+        for tech_id in self.loads:
+            self._push(tech_id)
+        self.version += 1
+
+    def _entry(self, tech_id):
+        # Equal loads go to whoever was assigned to least recently
+        return (self.loads[tech_id], self._last_assigned.get(tech_id, -1), tech_id)
+
+    def _push(self, tech_id):
+        entry = self._entry(tech_id)
+        heapq.heappush(self._heaps[None], entry)
+        for category, members in self.categories.items():
+            if tech_id in members:
+                heapq.heappush(self._heaps[category], entry)
+
+    def _compact(self, key):
+        heap = self._heaps[key]
+        members = self.loads if key is None else self.categories[key]
+        if len(heap) > 4 * len(members) + 64:
+            self._heaps[key] = [self._entry(tech_id) for tech_id in members if tech_id in self.loads]
+            heapq.heapify(self._heaps[key])
+
+    def _top(self, heap):
+        # Drop stale entries until the smallest one is current
+        while heap:
+            entry = heap[0]
+            if entry[2] in self.loads and entry == self._entry(entry[2]):
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def least_loaded(self, category=None, exclude=None):
+        """Technician id with the fewest open tickets (in category), or None"""
+        key = category if category in self._heaps else None
+        heap = self._heaps[key]
+        entry = self._top(heap)
+        if entry is None:
+            return None
+        if entry[2] != exclude:
+            return entry[2]
+        # Set the excluded technician aside to look at the runner-up
+        heapq.heappop(heap)
+        runner_up = self._top(heap)
+        heapq.heappush(heap, entry)
+        return runner_up[2] if runner_up else None
+
+    def adjust(self, tech_id, delta):
+        if tech_id not in self.loads:
+            return
+        self.loads[tech_id] = max(0, self.loads[tech_id] + delta)
+        self._push(tech_id)
+        for key in list(self._heaps):
+            self._compact(key)
+
+    def assigned(self, tech_id, category):
+        """Record an assignment made by the engine: one more open ticket"""
+        self._last_assigned[tech_id] = next(self._sequence)
+        if category is not None and tech_id in self.loads:
+            if category not in self.categories:
+                self.categories[category] = set()
+                self._heaps[category] = []
+            self.categories[category].add(tech_id)
+        self.adjust(tech_id, 1)
+
+    def add_technician(self, tech_id):
+        if tech_id not in self.loads:
+            self.loads[tech_id] = 0
+            self._push(tech_id)
+            self.version += 1
+
+    def remove_technician(self, tech_id):
+        if self.loads.pop(tech_id, None) is not None:
+            self.version += 1
+        for members in self.categories.values():
+            members.discard(tech_id)
+
+
+class RoundRobin:
+    """Hand tickets to technicians in turn, ignoring load"""
+
+    def __init__(self, config):
+        self._position = 0
+        self._technicians = []
+        self._version = None
+
+    def choose(self, index, ticket):
+        if self._version != index.version:
+            self._technicians, self._version = sorted(index.loads), index.version
+        if not self._technicians:
+            return None
+        tech_id = self._technicians[self._position % len(self._technicians)]
+        self._position += 1
+        return tech_id
+
+
+class LeastLoad:
+    """Give the ticket to the technician with the fewest open tickets"""
+
+    def __init__(self, config):
+        pass
+
+    def choose(self, index, ticket):
+        return index.least_loaded()
+
+
+class CategoryAffinity:
+    """
+    Least loaded technician among those who have worked the ticket's
+    category before, unless they have more than ASSIGNMENT_AFFINITY_SLACK
+    open tickets above the least loaded technician overall (so newcomers
+    without history still get work)
+    """
+
+    def __init__(self, config):
+        self.slack = config['ASSIGNMENT_AFFINITY_SLACK']
+
+    def choose(self, index, ticket):
+        anyone = index.least_loaded()
+        specialist = index.least_loaded(ticket.category)
+        if specialist is None or index.loads[specialist] - index.loads[anyone] > self.slack:
+            return anyone
+        return specialist
+
+
+# Strategies selectable with ASSIGNMENT_STRATEGY; add more with register_strategy()
+# A strategy is built with the app config and has choose(index, ticket)
+STRATEGIES = {
+    'round_robin': RoundRobin,
+    'least_load': LeastLoad,
+    'category_affinity': CategoryAffinity,
+}
+
+
+def register_strategy(name, strategy_class):
+    STRATEGIES[name] = strategy_class
+
+
+class AssignmentEngine:
+    """
+    Picks a technician for each new ticket
+    The load index is read from the database on first use and every
+    ASSIGNMENT_RESYNC_SECONDS after that (to pick up technicians added or
+    removed, and changes made by other processes on the memory event bus).
+    In between it follows ticket events.
+    """
+
+    def __init__(self, strategy, max_open=None, resync_seconds=300):
+        self.strategy = strategy
+        self.max_open = max_open
+        self.resync_seconds = resync_seconds
+        self.index = LoadIndex()
+        self._loaded_at = None
+        # Assignments made here whose ticket.created event hasn't arrived yet
+        self._reserved = Counter()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        technicians = db.session.execute(select(User.id).where(User.role == 'technician')).scalars().all()
+        open_counts = dict(db.session.execute(
+            select(Ticket.assigned_to, func.count())
+            .where(Ticket.assigned_to.isnot(None), Ticket.status.in_(OPEN_STATUSES))
+            .group_by(Ticket.assigned_to)
+        ).all())
+        category_pairs = db.session.execute(
+            select(Ticket.assigned_to, Ticket.category)
+            .where(Ticket.assigned_to.isnot(None))
+            .group_by(Ticket.assigned_to, Ticket.category)
+        ).all()
+        with self._lock:
+            self.index.load(technicians, open_counts, category_pairs)
+            self._reserved.clear()
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.resync_seconds:
+            self._load()
+
+    def assign(self, ticket):
+        """
+        Set ticket.assigned_to on a new ticket
+        Returns the technician id, or None if nobody is available
+        """
+        self._ensure_loaded()
+        with self._lock:
+            tech_id = self.strategy.choose(self.index, ticket)
+            if tech_id is None:
+                return None
+            if self.max_open is not None and self.index.loads[tech_id] >= self.max_open:
+                return None
+            self.index.assigned(tech_id, ticket.category)
+            # The ticket.created event for it must not count it a second time
+            self._reserved[tech_id] += 1
+        ticket.assigned_to = tech_id
+        return tech_id
+
+    def choose_reassignments(self, tickets):
+        """
+        Pick a new technician for each (ticket_id, category, assigned_to),
+        never the current one; returns {ticket_id: technician id or None}
+        Loads are raised while choosing so one technician doesn't get the
+        whole batch, then put back - the ticket.updated events published for
+        the change record it for real.
+        """
+        self._ensure_loaded()
+        chosen = {}
+        with self._lock:
+            for ticket_id, category, current in tickets:
+                tech_id = self.index.least_loaded(category, exclude=current) \
+                    or self.index.least_loaded(exclude=current)
+                if tech_id is not None and self.max_open is not None \
+                        and self.index.loads[tech_id] >= self.max_open:
+                    tech_id = None
+                if tech_id is not None:
+                    self.index.adjust(tech_id, 1)
+                chosen[ticket_id] = tech_id
+            for tech_id in chosen.values():
+                if tech_id is not None:
+                    self.index.adjust(tech_id, -1)
+        return chosen
+
+    def on_event(self, event):
+        """Event bus listener: follow load changes from ticket events"""
+        if self._loaded_at is None or event['type'] == events.TICKET_ASSIGNED:
+            # TICKET_ASSIGNED always comes with a TICKET_UPDATED for the same change
+            return
+        ticket, previous = event['ticket'], event['previous']
+        with self._lock:
+            if event['type'] == events.TICKET_CREATED:
+                tech_id = ticket['assigned_to']
+                if not tech_id or not _is_open(ticket):
+                    pass
+                elif self._reserved[tech_id]:
+                    # Counted when assigned. If that ticket was rolled back
+                    # instead, skipping this one evens the count out again
+                    self._reserved[tech_id] -= 1
+                else:
+                    self.index.adjust(tech_id, 1)
+            elif event['type'] == events.TICKET_UPDATED:
+                before = previous.get('assigned_to') if _is_open(previous) else None
+                after = ticket['assigned_to'] if _is_open(ticket) else None
+                if before != after:
+                    if before:
+                        self.index.adjust(before, -1)
+                    if after:
+                        self.index.adjust(after, 1)
+            elif event['type'] == events.TICKET_DELETED:
+                if ticket['assigned_to'] and _is_open(ticket):
+                    self.index.adjust(ticket['assigned_to'], -1)
+
+    def technician_changed(self, user_id, role):
+        """Add or drop a user from the pool after a role change or delete"""
+        with self._lock:
+            if role == 'technician':
+                self.index.add_technician(user_id)
+            else:
+                self.index.remove_technician(user_id)
+
+
+def init_app(app):
+    """Create the assignment engine and subscribe it to ticket events"""
+    if not app.config['AUTO_ASSIGN_ENABLED']:
+        return
+    name = app.config['ASSIGNMENT_STRATEGY']
+    if name not in STRATEGIES:
+        raise ValueError(f'Unknown ASSIGNMENT_STRATEGY {name!r}, expected one of {", ".join(STRATEGIES)}')
+    engine = AssignmentEngine(
+        STRATEGIES[name](app.config),
+        max_open=app.config['ASSIGNMENT_MAX_OPEN_PER_TECHNICIAN'],
+        resync_seconds=app.config['ASSIGNMENT_RESYNC_SECONDS'],
+    )
+    app.extensions['assignment'] = engine
+    app.extensions['event_bus'].add_listener(engine.on_event)
+
+
+def get_engine():
+    """The app's assignment engine, or None when auto-assignment is off"""
+    return current_app.extensions.get('assignment')
+
+
+def auto_assign(ticket):
+    """Assign a new ticket if auto-assignment is on; returns the technician id"""
+    engine = get_engine()
+    if engine is None or ticket.assigned_to is not None:
+        return None
+    return engine.assign(ticket)
+
+
+def technician_changed(user_id, role):
+    engine = get_engine()
+    if engine is not None:
+        engine.technician_changed(user_id, role)
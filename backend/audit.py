@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select, insert, delete, text
+from sqlalchemy.orm import Session
+from backend import search
+from backend.metrics import get_registry
+from backend.models import db, Ticket, ActivityLog, AuditSpoolBatch
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SYNC = 'sync'
+BUFFERED = 'buffered'
+
+# session.info keys for entries waiting on the transaction to commit
+_PENDING_KEY = 'audit_entries'
+_WRITER_KEY = 'audit_writer'
+
+# Batch ids are kept this long so a spool file left behind by a crash can
+# still be recognised as already written
+SPOOL_BATCH_RETENTION = timedelta(days=7)
+
+_RETURNING = (ActivityLog.id, ActivityLog.ticket_id, ActivityLog.description)
+
+
+def log_activities(entries):
+    """
+    Write activity log entries as part of the current transaction
+    entries are dicts with ticket_id, user_id, action and description.
+    In sync mode they are inserted (and indexed for search) right away; in
+    buffered mode they go to the audit writer once the transaction commits,
+    and are dropped with it if it rolls back.
+    """
+    if not entries:
+        return
+    now = datetime.utcnow()
+    rows = [dict(entry, created_at=now) for entry in entries]
+
+    writer = current_app.extensions.get('audit_writer')
+    if writer is None:
+        inserted = db.session.execute(insert(ActivityLog).returning(*_RETURNING), rows)
+        search.index_activities([row._asdict() for row in inserted])
+    else:
+        db.session.info.setdefault(_PENDING_KEY, []).extend(rows)
+        db.session.info[_WRITER_KEY] = writer
+
+
+@event.listens_for(Session, 'after_commit')
+def _hand_off_after_commit(session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    writer = session.info.pop(_WRITER_KEY, None)
+    if rows and writer:
+        writer.submit(rows)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_WRITER_KEY, None)
+
+
+def row_batch_id(segment_id, index):
+    """Batch id for one row of a spool file, written when the row goes in on its own"""
+    return hashlib.md5(f'{segment_id}:{index}'.encode()).hexdigest()
+
+
+def write_batch(batch_ids, rows):
+    """
+    Insert spooled rows and record their batch ids in one transaction
+    Rows for tickets deleted or archived meanwhile are dropped.
+    Returns (written, dropped)
+    """
+    ticket_ids = {row['ticket_id'] for row in rows}
+    existing = set(db.session.scalars(select(Ticket.id).where(Ticket.id.in_(ticket_ids)))) if ticket_ids else set()
+    kept = [row for row in rows if row['ticket_id'] in existing]
+    if kept:
+        inserted = db.session.execute(insert(ActivityLog).returning(*_RETURNING), kept)
+        search.index_activities([row._asdict() for row in inserted])
+
+    now = datetime.utcnow()
+    db.session.execute(insert(AuditSpoolBatch), [{'id': batch_id, 'flushed_at': now} for batch_id in batch_ids])
+    db.session.execute(delete(AuditSpoolBatch).where(AuditSpoolBatch.flushed_at < now - SPOOL_BATCH_RETENTION))
+    db.session.commit()
+    return len(kept), len(rows) - len(kept)
+
+
+class SpoolSegment:
+    """
+    One spool file of JSON lines, named after its batch id
+    Held under an exclusive flock while this process owns it, so other
+    worker processes recovering the spool directory leave it alone
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.splitext(os.path.basename(path))[0]
+        self.rows = []
+        # Indexes of rows already written (or dead-lettered) one at a time,
+        # and failed attempts per row
+        self.done = set()
+        self.failures = Counter()
+        self._file = open(path, 'a+', encoding='utf-8')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                raise
+
+    @classmethod
+    def create(cls, directory):
+        while True:
+            try:
+                return cls(os.path.join(directory, uuid.uuid4().hex + '.jsonl'))
+            except BlockingIOError:
+                # Another process recovering the spool locked the new file first
+                continue
+
+    def append(self, rows, fsync):
+        self._file.write(''.join(
+            json.dumps(dict(row, created_at=row['created_at'].isoformat())) + '\n' for row in rows
+        ))
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        self.rows.extend(rows)
+
+    def load(self):
+        """Read back the rows of a file left by an earlier process"""
+        self._file.seek(0)
+        for line in self._file:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Torn last line from a crash mid-write; it never reached the caller
+                continue
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+            self.rows.append(row)
+
+    def pending(self):
+        """(index, row) for the rows still to be written"""
+        return [(index, row) for index, row in enumerate(self.rows) if index not in self.done]
+
+    def discard(self):
+        os.unlink(self.path)
+        self._file.close()
+
+
+class AuditWriter:
+    """
+    Write-behind activity log writer
+    Committed entries are appended to this process's spool file (fsynced
+    when AUDIT_SPOOL_FSYNC is on) and queued in memory. A background thread
+    seals the file and inserts its rows with one multi-row INSERT every
+    AUDIT_FLUSH_SECONDS, or sooner once AUDIT_FLUSH_SIZE entries are queued.
+    When a batch fails with the database up, its files are retried one at
+    a time and then row by row, so one bad row doesn't hold back the rest;
+    a row that fails AUDIT_MAX_ATTEMPTS flushes goes to the dead-letter
+    file. Everything else is kept and retried on the next flush; files
+    left by a crashed process are picked up by start().
+    """
+
+    def __init__(self, app, spool_dir, flush_size, flush_seconds, fsync, registry, max_attempts, dead_letter_path):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self._segment = None
+        self._sealed = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._flush_latency = registry.histogram('audit_flush_seconds', 'Time to write one audit batch')
+        self._written = registry.counter('audit_rows_written_total', 'Activity log rows written by the audit writer')
+        self._dropped = registry.counter('audit_rows_dropped_total',
+                                         'Buffered activity rows dropped because their ticket was gone')
+        self._errors = registry.counter('audit_flush_errors_total', 'Audit flushes that failed and will be retried')
+        self._dead_lettered = registry.counter('audit_rows_dead_lettered_total',
+                                               'Activity rows moved to the dead-letter file after repeated failures')
+        registry.gauge('audit_queue_depth', 'Activity log rows spooled but not yet written').set_function(
+            lambda: self.depth)
+
+    @property
+    def depth(self):
+        """Rows spooled but not written yet"""
+        segment = self._segment
+        return sum(len(sealed.rows) - len(sealed.done) for sealed in self._sealed) + (len(segment.rows) if segment else 0)
+
+    def submit(self, rows):
+        with self._lock:
+            if self._segment is None:
+                self._segment = SpoolSegment.create(self.spool_dir)
+            self._segment.append(rows, self.fsync)
+            full = len(self._segment.rows) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def recover(self):
+        """Queue spool files no live process owns; returns how many rows they hold"""
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, '*.jsonl'))):
+            try:
+                segment = SpoolSegment(path)
+            except OSError:
+                continue
+            segment.load()
+            self._sealed.append(segment)
+
+        if self._sealed:
+            with self.app.app_context():
+                written = set(db.session.scalars(
+                    select(AuditSpoolBatch.id).where(AuditSpoolBatch.id.in_([s.id for s in self._sealed]))
+                ))
+                for segment in self._sealed:
+                    if segment.id in written:
+                        # Written just before the crash, only the file was left
+                        segment.done.update(range(len(segment.rows)))
+                        continue
+                    # Rows a failing flush wrote one at a time
+                    row_ids = {row_batch_id(segment.id, index): index for index in range(len(segment.rows))}
+                    segment.done.update(row_ids[batch_id] for batch_id in db.session.scalars(
+                        select(AuditSpoolBatch.id).where(AuditSpoolBatch.id.in_(list(row_ids)))
+                    ))
+                db.session.remove()
+            for segment in [s for s in self._sealed if len(s.done) == len(s.rows)]:
+                segment.discard()
+                self._sealed.remove(segment)
+        return self.depth
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                if self._segment is not None:
+                    self._sealed.append(self._segment)
+                    self._segment = None
+            if not self._sealed:
+                return 0
+
+            started = time.perf_counter()
+            with self.app.app_context():
+                try:
+                    written, dropped = write_batch([s.id for s in self._sealed],
+                                                   [row for s in self._sealed for _, row in s.pending()])
+                    finished = list(self._sealed)
+                except Exception:
+                    db.session.rollback()
+                    self._errors.inc()
+                    if not self._database_up():
+                        logger.exception('Audit flush failed, %d rows kept for retry', self.depth)
+                        return 0
+                    logger.exception('Audit flush failed, retrying its spool files one at a time')
+                    written, dropped, finished = self._write_isolated()
+                finally:
+                    db.session.remove()
+
+            for segment in finished:
+                segment.discard()
+                self._sealed.remove(segment)
+            self._flush_latency.observe(time.perf_counter() - started)
+            self._written.inc(written)
+            if dropped:
+                self._dropped.inc(dropped)
+            return written
+
+    def _database_up(self):
+        """Whether a failed write was the rows' fault rather than the database's"""
+        try:
+            db.session.execute(text('SELECT 1'))
+            return True
+        except Exception:
+            db.session.rollback()
+            return False
+
+    def _write_isolated(self):
+        """
+        Write each sealed file on its own, and the rows of a failing file
+        one by one; returns (written, dropped, files finished)
+        """
+        written = dropped = 0
+        finished = []
+        for segment in self._sealed:
+            try:
+                counts = write_batch([segment.id], [row for _, row in segment.pending()])
+                segment.done.update(range(len(segment.rows)))
+            except Exception:
+                db.session.rollback()
+                counts = self._write_rows(segment)
+            written += counts[0]
+            dropped += counts[1]
+            if len(segment.done) == len(segment.rows):
+                finished.append(segment)
+        return written, dropped, finished
+
+    def _write_rows(self, segment):
+        """Write a file's pending rows one per transaction; returns (written, dropped)"""
+        written = dropped = 0
+        for index, row in segment.pending():
+            try:
+                counts = write_batch([row_batch_id(segment.id, index)], [row])
+            except Exception as e:
+                db.session.rollback()
+                segment.failures[index] += 1
+                if segment.failures[index] < self.max_attempts:
+                    continue
+                logger.error('Audit row failed %d flushes, moved to %s: %s',
+                             segment.failures[index], self.dead_letter_path, e)
+                self._dead_letter(row, e)
+                counts = (0, 0)
+            segment.done.add(index)
+            written += counts[0]
+            dropped += counts[1]
+        return written, dropped
+
+    def _dead_letter(self, row, error):
+        os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(row, created_at=row['created_at'].isoformat(), error=str(error))) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._dead_lettered.inc()
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        recovered = self.recover()
+        if recovered:
+            logger.info('Replaying %d activity log rows from the audit spool', recovered)
+        self._thread = threading.Thread(target=self.run, name='audit-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the thread and write what is left"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+def init_app(app):
+    """
+    Start the buffered audit writer when AUDIT_WRITE_MODE is 'buffered'
+    In sync mode, rows some earlier buffered run left in the spool are
+    written once at startup and the spool is not used after that
+    """
+    config = app.config
+    if config['AUDIT_WRITE_MODE'] not in (SYNC, BUFFERED):
+        raise RuntimeError(f"AUDIT_WRITE_MODE must be '{SYNC}' or '{BUFFERED}'")
+
+    spool_dir = config['AUDIT_SPOOL_DIR'] or os.path.join(app.instance_path, 'audit-spool')
+    buffered = config['AUDIT_WRITE_MODE'] == BUFFERED
+    if not buffered and not glob.glob(os.path.join(spool_dir, '*.jsonl')):
+        return
+    os.makedirs(spool_dir, exist_ok=True)
+
+    writer = AuditWriter(
+        app, spool_dir,
+        flush_size=config['AUDIT_FLUSH_SIZE'],
+        flush_seconds=config['AUDIT_FLUSH_SECONDS'],
+        fsync=config['AUDIT_SPOOL_FSYNC'],
+        registry=get_registry(app),
+        max_attempts=config['AUDIT_MAX_ATTEMPTS'],
+        dead_letter_path=config['AUDIT_DEAD_LETTER_FILE'] or os.path.join(app.instance_path, 'audit-dead-letter.jsonl'),
+    )
+    if buffered:
+        app.extensions['audit_writer'] = writer
+        writer.start()
+    else:
+        writer.recover()
+        writer.flush()
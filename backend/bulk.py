@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import update, delete, insert, func
+from backend.models import db, Ticket, ActivityLog, TicketTombstone
+from backend.permissions import visible_tickets, can_view_ticket
+from backend.ticket_filters import apply_ticket_filters, STATUSES, PRIORITIES
+from backend import stats, events, search, http_cache, notifications, audit
+
+# Fields a bulk update may change, and the roles allowed to change them
+# (same rules as update_ticket)
+EDITABLE_FIELDS = {
+    'status': ('manager', 'technician'),
+    'priority': ('manager', 'technician'),
+    'assigned_to': ('manager',),
+}
+
+
+class BulkError(Exception):
+    """A bulk request that can't be run at all (bad input or not allowed)"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def resolve_ticket_ids(user, data):
+    """
+    Turn a bulk request body into the list of ticket ids it targets
+    Either an explicit 'ticket_ids' list or a 'filter' object using the same
+    parameters as GET /api/tickets. A filter only ever matches tickets the
+    user can see.
+    """
+    max_tickets = current_app.config['BULK_MAX_TICKETS']
+
+    if 'ticket_ids' in data:
+        ticket_ids = data['ticket_ids']
+        if not isinstance(ticket_ids, list) or not all(isinstance(i, int) for i in ticket_ids):
+            raise BulkError('ticket_ids must be a list of integers')
+        ticket_ids = list(dict.fromkeys(ticket_ids))
+    elif isinstance(data.get('filter'), dict):
+        try:
+            query = apply_ticket_filters(visible_tickets(Ticket.query, user), data['filter'])
+        except ValueError as e:
+            raise BulkError(str(e))
+        ticket_ids = [row.id for row in query.with_entities(Ticket.id).limit(max_tickets + 1)]
+    else:
+        raise BulkError('Provide ticket_ids or filter')
+
+    if not ticket_ids:
+        raise BulkError('No tickets matched')
+    if len(ticket_ids) > max_tickets:
+        raise BulkError(f'A bulk request can touch at most {max_tickets} tickets')
+    return ticket_ids
+
+
+def validate_changes(user, changes):
+    """Check a bulk update's changes against allowed fields, values and roles"""
+    if not isinstance(changes, dict) or not changes:
+        raise BulkError('changes must be a non-empty object')
+
+    for field in changes:
+        if field not in EDITABLE_FIELDS:
+            raise BulkError(f'{field} cannot be changed in bulk')
+        if user.role not in EDITABLE_FIELDS[field]:
+            raise BulkError(f'Insufficient permissions to change {field}', 403)
+
+    if 'status' in changes and changes['status'] not in STATUSES:
+        raise BulkError(f'status must be one of {", ".join(STATUSES)}')
+    if 'priority' in changes and changes['priority'] not in PRIORITIES:
+        raise BulkError(f'priority must be one of {", ".join(PRIORITIES)}')
+    if 'assigned_to' in changes and changes['assigned_to'] is not None \
+            and not isinstance(changes['assigned_to'], int):
+        raise BulkError('assigned_to must be a user id or null')
+
+
+def _load_targets(user, ticket_ids):
+    """
+    Load the targeted tickets in one query and sort them into those the user
+    may act on and per-ticket results for the rest
+    """
+    tickets = Ticket.query.filter(Ticket.id.in_(ticket_ids)).all()
+    by_id = {ticket.id: ticket for ticket in tickets}
+
+    allowed, results = [], {}
+    for ticket_id in ticket_ids:
+        ticket = by_id.get(ticket_id)
+        if ticket is None:
+            results[ticket_id] = 'not_found'
+        elif not can_view_ticket(user, ticket.created_by, ticket.assigned_to):
+            results[ticket_id] = 'forbidden'
+        else:
+            allowed.append(ticket)
+    return allowed, results
+
+
+def _change_descriptions(ticket, changes):
+    """Activity log lines for one ticket, worded like update_ticket's"""
+    lines = []
+    if 'priority' in changes and changes['priority'] != ticket.priority:
+        lines.append(f'Priority changed from {ticket.priority} to {changes["priority"]}')
+    if 'status' in changes and changes['status'] != ticket.status:
+        lines.append(f'Status changed from {ticket.status} to {changes["status"]}')
+    if 'assigned_to' in changes and changes['assigned_to'] != ticket.assigned_to:
+        if ticket.assigned_to:
+            lines.append(f'Reassigned from user {ticket.assigned_to} to user {changes["assigned_to"]}')
+        else:
+            lines.append(f'Assigned to user {changes["assigned_to"]}')
+    return lines
+
+
+def _summarize(ticket_ids, results):
+    return {
+        'results': [{'id': ticket_id, 'result': results[ticket_id]} for ticket_id in ticket_ids],
+        'summary': dict(Counter(results.values()))
+    }
+
+
+def bulk_update(user, ticket_ids, changes):
+    """
+    Apply the same changes to many tickets with one set-based UPDATE
+    Activity log rows, stats counters and tombstones are written in bulk in
+    the same transaction; events are published after commit.
+    Returns a per-ticket result summary.
+    """
+    validate_changes(user, changes)
+    targets, results = _load_targets(user, ticket_ids)
+
+    now = datetime.utcnow()
+    changed, activity_rows, tombstone_rows, deltas, published = [], [], [], Counter(), []
+
+    for ticket in targets:
+        lines = _change_descriptions(ticket, changes)
+        if not lines:
+            results[ticket.id] = 'unchanged'
+            continue
+
+        results[ticket.id] = 'updated'
+        changed.append(ticket.id)
+        activity_rows.extend(
+            {'ticket_id': ticket.id, 'user_id': user.id, 'action': 'updated',
+             'description': line}
+            for line in lines
+        )
+
+        before = ticket.to_dict()
+        after = dict(before, **changes)
+        after['updated_at'] = now.isoformat()
+        if changes.get('status') in ('resolved', 'closed') and not ticket.resolved_at:
+            after['resolved_at'] = now.isoformat()
+
+        deltas.update(stats.diff_keys(
+            stats.ticket_stat_keys(ticket),
+            stats.stat_keys(after['status'], after['priority'], ticket.category,
+                            after['assigned_to'], ticket.created_at)
+        ))
+
+        if ticket.assigned_to and after['assigned_to'] != ticket.assigned_to:
+            tombstone_rows.append({'ticket_id': ticket.id, 'created_by': ticket.created_by,
+                                   'assigned_to': ticket.assigned_to, 'reason': 'unassigned',
+                                   'deleted_at': now})
+
+        previous = {key: before[key] for key in ('status', 'priority', 'assigned_to')}
+        published.append((after, previous))
+
+    if changed:
+        values = dict(changes, updated_at=now)
+        if changes.get('status') in ('resolved', 'closed'):
+            values['resolved_at'] = func.coalesce(Ticket.resolved_at, now)
+
+        db.session.execute(
+            update(Ticket).where(Ticket.id.in_(changed)).values(**values),
+            execution_options={'synchronize_session': False}
+        )
+        audit.log_activities(activity_rows)
+        if tombstone_rows:
+            db.session.execute(insert(TicketTombstone), tombstone_rows)
+        stats.apply_deltas(deltas)
+        http_cache.touch(*{user_id for ticket_data, previous in published
+                           for user_id in (ticket_data['created_by'], ticket_data['assigned_to'],
+                                           previous['assigned_to'])})
+        notifications.notify_ticket_changes(published, user.id)
+
+    db.session.commit()
+
+    for ticket_data, previous in published:
+        events.publish(events.TICKET_UPDATED, ticket_data, previous)
+        if ticket_data['assigned_to'] != previous['assigned_to']:
+            events.publish(events.TICKET_ASSIGNED, ticket_data, previous)
+
+    return _summarize(ticket_ids, results)
+
+
+def bulk_delete(user, ticket_ids):
+    """
+    Delete many tickets (and their activity logs) with set-based DELETEs
+    Managers only, like delete_ticket. Returns a per-ticket result summary.
+    """
+    if user.role != 'manager':
+        raise BulkError('Insufficient permissions', 403)
+
+    targets, results = _load_targets(user, ticket_ids)
+    if targets:
+        now = datetime.utcnow()
+        target_ids = [ticket.id for ticket in targets]
+        deltas = Counter()
+        published = []
+        for ticket in targets:
+            results[ticket.id] = 'deleted'
+            for key in stats.ticket_stat_keys(ticket):
+                deltas[key] -= 1
+            published.append(ticket.to_dict())
+
+        search.remove_tickets(target_ids)
+        
+        # Activity logs first - the ORM cascade doesn't run for bulk deletes
+        db.session.execute(
+            delete(ActivityLog).where(ActivityLog.ticket_id.in_(target_ids)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(
+            delete(Ticket).where(Ticket.id.in_(target_ids)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(insert(TicketTombstone), [
+            {'ticket_id': ticket.id, 'created_by': ticket.created_by,
+             'assigned_to': ticket.assigned_to, 'reason': 'deleted', 'deleted_at': now}
+            for ticket in targets
+        ])
+        stats.apply_deltas(deltas)
+        http_cache.touch(*{user_id for ticket in targets for user_id in (ticket.created_by, ticket.assigned_to)})
+        db.session.commit()
+
+        for ticket_data in published:
+            events.publish(events.TICKET_DELETED, ticket_data)
+
+    return _summarize(ticket_ids, results)
@@ -23,8 +23,292 @@ class Config:
     # Disable SQLAlchemy event system (not needed, saves memory)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool, per worker process (overridden per environment below)
+    # pre_ping replaces connections the server has dropped; recycle retires
+    # them before database/proxy idle timeouts do
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+    
+    # Read replicas, as comma-separated database URLs
+    # Read-only requests are routed to them; a client that just wrote stays
+    # on the primary for REPLICA_STICKY_SECONDS so it reads its own writes
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    SQLALCHEMY_BINDS = {f'replica_{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_STICKY_SECONDS = 5
+    
+    # SQLite settings applied to every new connection (None to skip one)
+    # WAL lets readers run alongside a writer, busy_timeout makes writers
+    # queue instead of failing with "database is locked", NORMAL only fsyncs
+    # at checkpoints (safe in WAL mode) and the cache is given in KiB
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+    SQLITE_CACHE_SIZE_KB = 65536
+    
+    # Apply pending schema migrations when the app starts (development and
+    # tests); production runs `flask db-upgrade` as a deploy step instead
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'true').lower() == 'true'
+    
     # CORS configuration - allows frontend to communicate with backend
     CORS_HEADERS = 'Content-Type'
+    # Frontend origins allowed to call /api/* with cookies (development)
+    CORS_ORIGINS = [
+        "http://127.0.0.1:5500",
+        "http://localhost:5500",
+        "http://127.0.0.1:8000",
+        "http://localhost:8000",
+    ]
+    
+    # Pagination for list endpoints (GET /api/tickets?limit=...)
+    TICKETS_PAGE_SIZE = 50
+    TICKETS_MAX_PAGE_SIZE = 200
+    ACTIVITY_PAGE_SIZE = 20
+    ACTIVITY_MAX_PAGE_SIZE = 200
+    
+    # Most tickets one POST /api/tickets/bulk request may touch
+    BULK_MAX_TICKETS = 1000
+    
+    # Deepest result GET /api/tickets/search will page to
+    SEARCH_MAX_RESULTS = 1000
+    
+    # Rows fetched from the database per round trip when streaming exports
+    EXPORT_BATCH_SIZE = 1000
+    
+    # Delta sync (GET /api/tickets/changes)
+    # Tombstones for deleted tickets are kept this long; clients that
+    # haven't synced within the window are told to reload from scratch
+    TOMBSTONE_RETENTION_DAYS = 30
+    # How far back each sync re-reads to catch commits that landed late
+    SYNC_OVERLAP_SECONDS = 2
+    
+    # Ticket change events (GET /api/tickets/events)
+    # 'memory' only reaches clients connected to the same process;
+    # use 'redis' when running several worker processes
+    EVENT_BUS_BACKEND = os.environ.get('EVENT_BUS_BACKEND', 'memory')
+    EVENT_BUS_URL = os.environ.get('EVENT_BUS_URL', 'redis://localhost:6379/0')
+    EVENT_BUS_CHANNEL = 'ticket-events'
+    # Events buffered per connection before a slow client is told to resync
+    SSE_QUEUE_SIZE = 256
+    # Comment line sent on idle connections so proxies don't close them
+    SSE_HEARTBEAT_SECONDS = 15
+    
+    # Cache of logged-in users so protected requests rarely need a user query
+    # Entries expire after the TTL so role changes made by other worker
+    # processes are picked up quickly
+    USER_CACHE_ENABLED = True
+    USER_CACHE_TTL_SECONDS = 30
+    USER_CACHE_MAX_SIZE = 1024
+    
+    # Assign new tickets to a technician automatically
+    # ASSIGNMENT_STRATEGY: 'least_load' (fewest open tickets), 'round_robin'
+    # or 'category_affinity' (least loaded among technicians who have worked
+    # the ticket's category). Tickets stay unassigned when every candidate
+    # already has ASSIGNMENT_MAX_OPEN_PER_TECHNICIAN open tickets (None = no cap).
+    # Loads are re-read from the database every ASSIGNMENT_RESYNC_SECONDS.
+    AUTO_ASSIGN_ENABLED = os.environ.get('AUTO_ASSIGN_ENABLED', 'true').lower() == 'true'
+    ASSIGNMENT_STRATEGY = os.environ.get('ASSIGNMENT_STRATEGY', 'least_load')
+    ASSIGNMENT_MAX_OPEN_PER_TECHNICIAN = None
+    # category_affinity skips the category's specialists once they have this
+    # many more open tickets than the least loaded technician
+    ASSIGNMENT_AFFINITY_SLACK = 3
+    ASSIGNMENT_RESYNC_SECONDS = 300
+    
+    # SLA targets per priority, in minutes from creation: first response
+    # (the ticket leaves 'open') and resolution
+    SLA_TARGETS = {
+        'critical': {'response': 15, 'resolution': 4 * 60},
+        'high': {'response': 60, 'resolution': 8 * 60},
+        'medium': {'response': 4 * 60, 'resolution': 3 * 24 * 60},
+        'low': {'response': 24 * 60, 'resolution': 7 * 24 * 60},
+    }
+    # A missed response target raises the priority one step; a missed
+    # resolution target either 'reassign's to the least loaded other
+    # technician (needs AUTO_ASSIGN_ENABLED) or does 'bump_priority' too
+    SLA_RESOLUTION_ACTION = 'reassign'
+    # The scheduler runs with `flask sla-run`; set this to run it in a
+    # background thread of the web process instead (one process only)
+    SLA_SCHEDULER_IN_PROCESS = os.environ.get('SLA_SCHEDULER_IN_PROCESS', 'false').lower() == 'true'
+    SLA_TICK_SECONDS = 30
+    # Most tickets escalated (and ticket changes read) per tick
+    SLA_BATCH_SIZE = 500
+    # Account escalations and automatic assignments are logged under
+    # (created automatically, can't log in)
+    SLA_SYSTEM_USERNAME = 'sla-bot'
+
+    # `flask archive-tickets` moves tickets in these statuses, resolved more
+    # than ARCHIVE_AFTER_DAYS ago, into the archive tables (still readable by id)
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_STATUSES = ('resolved', 'closed')
+    ARCHIVE_BATCH_SIZE = 1000
+    
+    # Resolution-time and volume analytics (GET /api/analytics/*) are read
+    # from rollup tables. `flask analytics-refresh` (e.g. from cron) folds in
+    # tickets changed since its last run, ANALYTICS_BATCH_SIZE at a time; set
+    # ANALYTICS_REFRESH_IN_PROCESS to run it every ANALYTICS_REFRESH_SECONDS
+    # in a background thread of the web process instead (one process only)
+    ANALYTICS_REFRESH_IN_PROCESS = os.environ.get('ANALYTICS_REFRESH_IN_PROCESS', 'false').lower() == 'true'
+    ANALYTICS_REFRESH_SECONDS = 60
+    ANALYTICS_BATCH_SIZE = 1000
+    # Date range of a request when since is left out, and the longest allowed
+    ANALYTICS_DEFAULT_DAYS = 30
+    ANALYTICS_MAX_DAYS = 366
+    
+    # Activity log writes from ticket create/update. 'sync' inserts them in
+    # the request's own transaction (strict audit trail); 'buffered' appends
+    # them to a spool file in AUDIT_SPOOL_DIR (default <instance>/audit-spool)
+    # once the request commits, and a background thread inserts them in
+    # multi-row batches every AUDIT_FLUSH_SECONDS or AUDIT_FLUSH_SIZE rows.
+    # Spooled rows left by a crash are written when the app next starts.
+    # In buffered mode new activity shows up in a ticket's history after the
+    # flush, and a cached ticket detail may miss it until the ticket changes.
+    AUDIT_WRITE_MODE = os.environ.get('AUDIT_WRITE_MODE', 'sync')
+    AUDIT_SPOOL_DIR = os.environ.get('AUDIT_SPOOL_DIR')
+    AUDIT_FLUSH_SIZE = 500
+    AUDIT_FLUSH_SECONDS = 1.0
+    # fsync the spool on every append; off trades crash safety for speed
+    AUDIT_SPOOL_FSYNC = True
+    # A row that fails this many flushes on its own (database up) is moved
+    # to AUDIT_DEAD_LETTER_FILE (default <instance>/audit-dead-letter.jsonl)
+    AUDIT_MAX_ATTEMPTS = 5
+    AUDIT_DEAD_LETTER_FILE = os.environ.get('AUDIT_DEAD_LETTER_FILE')
+    
+    # Email technicians when a ticket is assigned to them and creators when
+    # their ticket's status changes. Emails are queued in the jobs table with
+    # the change and sent NOTIFY_DEDUP_SECONDS later, so a burst of updates
+    # to one ticket becomes one email.
+    NOTIFICATIONS_ENABLED = os.environ.get('NOTIFICATIONS_ENABLED', 'false').lower() == 'true'
+    NOTIFY_DEDUP_SECONDS = 60
+    # 'smtp', 'log' (just log each message) or 'memory' (keep them in
+    # app.extensions['mailer'].outbox)
+    MAIL_BACKEND = os.environ.get('MAIL_BACKEND', 'log')
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'localhost')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 25))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'false').lower() == 'true'
+    MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_FROM = os.environ.get('MAIL_FROM', 'helpdesk@localhost')
+    MAIL_TIMEOUT = 10
+    
+    # Background jobs (see jobs.py) are run by `flask jobs-run`; set
+    # JOBS_IN_PROCESS to run JOBS_WORKERS worker threads in the web process
+    # instead. Each worker claims up to JOBS_BATCH_SIZE due jobs at a time
+    # and checks for new ones every JOBS_POLL_SECONDS when idle. A claimed
+    # job goes back on the queue if it isn't finished within the lease.
+    JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', 'false').lower() == 'true'
+    JOBS_WORKERS = 2
+    JOBS_BATCH_SIZE = 50
+    JOBS_POLL_SECONDS = 1.0
+    JOBS_LEASE_SECONDS = 300
+    # Failed jobs are retried after JOBS_RETRY_BASE_SECONDS, doubling each
+    # time up to JOBS_RETRY_MAX_SECONDS, and kept as 'failed' after
+    # JOBS_MAX_ATTEMPTS tries (`flask jobs-retry` requeues them)
+    JOBS_MAX_ATTEMPTS = 8
+    JOBS_RETRY_BASE_SECONDS = 30
+    JOBS_RETRY_MAX_SECONDS = 3600
+    
+    # Password hashing parameters, in werkzeug's method format
+    # ('scrypt:N:r:p' or 'pbkdf2:sha256:iterations'). Changing them upgrades
+    # each user's stored hash the next time they log in.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_SALT_LENGTH = 16
+    # Hashes run on a pool of this many threads per process, leaving the
+    # other cores to everything else during login storms. Up to
+    # PASSWORD_HASH_QUEUE_SIZE more wait; past that a login waits at most
+    # PASSWORD_HASH_WAIT_SECONDS for a slot, then gets 503 + Retry-After
+    PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+    PASSWORD_HASH_QUEUE_SIZE = 32
+    PASSWORD_HASH_WAIT_SECONDS = 2.0
+    PASSWORD_HASH_RETRY_AFTER = 1
+    
+    # Admission control for API (blueprint) requests: 429 + Retry-After
+    # instead of queueing for database connections under load.
+    # Endpoints are grouped by 'blueprint.endpoint' or by blueprint name;
+    # anything not listed is in the 'default' group.
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_ENDPOINT_GROUPS = {
+        'tickets.get_tickets': 'list',
+        'tickets.get_ticket_changes': 'list',
+        'tickets.search_tickets': 'list',
+        'tickets.get_ticket_stats': 'stats',
+        'analytics': 'stats',
+        'export': 'export',
+    }
+    # Long-lived streams hold no database connection while idle
+    ADMISSION_EXEMPT_ENDPOINTS = ('tickets.stream_ticket_events',)
+    # Token buckets as role -> group -> (requests per second, burst), or None
+    # for no limit. A missing role uses 'default', a missing group the
+    # role's 'default'. USER limits apply to each user (anonymous requests
+    # per client address); ROLE limits are shared by everyone with the role.
+    ADMISSION_USER_LIMITS = {
+        'default': {'default': (10, 40), 'list': (5, 20), 'stats': (1, 5), 'export': (0.1, 2)},
+        'manager': {'default': (20, 80), 'list': (10, 40), 'stats': (2, 10), 'export': (0.2, 4)},
+        'anonymous': {'default': (5, 20)},
+    }
+    ADMISSION_ROLE_LIMITS = {
+        'default': {'default': None, 'stats': (20, 40), 'export': (1, 4)},
+    }
+    # 'memory' keeps buckets per worker process; 'redis' shares them between
+    # processes (pip install redis). If Redis is unreachable requests are let through.
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory')
+    ADMISSION_REDIS_URL = os.environ.get('ADMISSION_REDIS_URL', 'redis://localhost:6379/0')
+    ADMISSION_REDIS_PREFIX = 'admission:'
+    # Requests in flight per worker process. None = pool_size + max_overflow
+    # of SQLALCHEMY_ENGINE_OPTIONS (no cap when the pool size isn't set).
+    # Group caps keep slow stats/export requests from taking every slot.
+    ADMISSION_MAX_IN_FLIGHT = None
+    ADMISSION_GROUP_MAX_IN_FLIGHT = {'list': None, 'stats': 4, 'export': 2}
+    ADMISSION_CONCURRENCY_RETRY_AFTER = 1
+    
+    # gzip (or brotli, with pip install brotli) for buffered responses of these
+    # types at least COMPRESS_MIN_SIZE bytes, when the client accepts it.
+    # Turn off when a reverse proxy already compresses.
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIMETYPES = ('application/json',)
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+    
+    # Browser cache lifetime for login.html/dashboard.html. The file names
+    # aren't versioned, so keep it short enough for deploys to reach users;
+    # after that the browser revalidates with the ETag
+    FRONTEND_CACHE_MAX_AGE = 24 * 3600
+    
+    # ASGI serving (SERVER_MODE=asgi, or uvicorn --factory backend.asgi:create_asgi_app)
+    # Ticket list/detail, the event stream, login and /me are served by
+    # async handlers on an async engine; everything else runs the Flask
+    # views in a thread pool. Needs sqlalchemy[asyncio], asgiref, uvicorn and
+    # aiosqlite or asyncpg. The async URL is derived from the main one unless
+    # ASYNC_DATABASE_URL is set (e.g. postgresql+asyncpg://...).
+    SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    # Turn off to serve every endpoint through the Flask app
+    ASGI_ASYNC_ROUTES = True
+    
+    # JSON encoder for API responses: 'orjson' (pip install orjson), 'stdlib',
+    # or 'auto' for orjson when it is installed
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+    
+    # Per-request timing (wall, SQL and to_dict time) reported in a
+    # Server-Timing header and at GET /api/metrics. Off by default; metrics
+    # are per worker process.
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'false').lower() == 'true'
+    INSTRUMENTATION_HEADERS = True
+    # Log a possible N+1 when one SELECT runs more than this many times in a request
+    INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 10
+    # Share of requests run under cProfile (0 = never); the dumps of the
+    # slowest INSTRUMENTATION_PROFILE_KEEP are kept in the profile directory
+    # (default: <tmp>/ticketing-profiles)
+    INSTRUMENTATION_PROFILE_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_PROFILE_SAMPLE_RATE', '0'))
+    INSTRUMENTATION_PROFILE_KEEP = 20
+    INSTRUMENTATION_PROFILE_DIR = os.environ.get('INSTRUMENTATION_PROFILE_DIR')
+    # GET /api/metrics is for managers; Prometheus can scrape it by sending
+    # "Authorization: Bearer <METRICS_TOKEN>" (unset = managers only)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 
 class DevelopmentConfig(Config):
@@ -34,6 +318,12 @@ class DevelopmentConfig(Config):
     """
     DEBUG = True
     TESTING = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
 
 
 class ProductionConfig(Config):
@@ -43,6 +333,18 @@ class ProductionConfig(Config):
     """
     DEBUG = False
     TESTING = False
+    # Size pool_size + max_overflow to the threads per worker, and keep
+    # workers x that total under the database's max_connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    # Every worker calls create_app, so leave migrations to the deploy
+    # (AUTO_MIGRATE=true opts back in)
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'false').lower() == 'true'
 
 
 class TestingConfig(Config):
@@ -51,7 +353,19 @@ class TestingConfig(Config):
     Used when running automated tests
     """
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///test_ticketing_system.db'
+    # Point TEST_DATABASE_URL at another database (e.g. PostgreSQL) to run
+    # tests and benchmarks against it
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///test_ticketing_system.db'
+    # Optional replica for routing tests (e.g. a copy of the test database)
+    SQLALCHEMY_BINDS = {'replica_0': os.environ['TEST_DATABASE_REPLICA_URL']} \
+        if os.environ.get('TEST_DATABASE_REPLICA_URL') else {}
+    # No pool sizing so in-memory SQLite URLs (which use a single shared
+    # connection) work too
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Tests and benchmarks replay requests far faster than a person would
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'false').lower() == 'true'
+    # Notification emails stay in app.extensions['mailer'].outbox
+    MAIL_BACKEND = 'memory'
 
 
 # Dictionary to easily select configuration based on environment
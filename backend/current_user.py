@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask import g, session, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from backend.models import db, User
+
+
+class CachedUser:
+    """
+    Read-only snapshot of a User row
+    Safe to share between requests because it isn't attached to any
+    database session. Load the real User if you need to change it.
+    """
+    __slots__ = ('id', 'username', 'email', 'role', 'created_at')
+
+    def __init__(self, id, username, email, role, created_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.role, user.created_at)
+
+    # Same JSON shape as the model
+    to_dict = User.to_dict
+
+
+class UserCache:
+    """
+    Small thread-safe LRU cache of CachedUser entries with a time-to-live
+    The TTL bounds how stale a user can be in other worker processes,
+    which don't see this process's invalidations
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic() + self._ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_app(app):
+    """Set up the optional user cache from config"""
+    if app.config['USER_CACHE_ENABLED']:
+        app.extensions['user_cache'] = UserCache(
+            app.config['USER_CACHE_MAX_SIZE'],
+            app.config['USER_CACHE_TTL_SECONDS']
+        )
+
+
+def _get_cache():
+    return current_app.extensions.get('user_cache') if has_app_context() else None
+
+
+def load_current_user():
+    """
+    Return the logged-in user for this request as a CachedUser, or None
+    Looked up at most once per request (memoized on flask.g), and usually
+    answered from the user cache without touching the database
+    """
+    if 'current_user' in g:
+        return g.current_user
+
+    user = None
+    user_id = session.get('user_id')
+    if user_id is not None:
+        cache = _get_cache()
+        user = cache.get(user_id) if cache else None
+        if user is None:
+            row = db.session.get(User, user_id)
+            if row is not None:
+                user = CachedUser.from_user(row)
+                if cache:
+                    cache.put(user)
+
+    g.current_user = user
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user from the cache after it was changed or deleted"""
+    cache = _get_cache()
+    if cache:
+        cache.invalidate(user_id)
+
+
+def system_user_id():
+    """
+    Id of the SLA_SYSTEM_USERNAME account that automatic changes (SLA
+    escalations, auto-assignment) are logged under
+    Created and committed on first use, with role 'system' and a random
+    password so nobody can log in as it. Call it before adding anything
+    else to the session.
+    """
+    user_id = current_app.extensions.get('system_user_id')
+    if user_id is not None:
+        return user_id
+    username = current_app.config['SLA_SYSTEM_USERNAME']
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, email=f'{username}@localhost', role='system')
+        user.set_password(secrets.token_urlsafe(32))
+        db.session.add(user)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process created it first
+            db.session.rollback()
+            user = User.query.filter_by(username=username).one()
+    current_app.extensions['system_user_id'] = user.id
+    return user.id
+
+
+# Invalidate on every User update/delete, however it happens. We drop the
+# entry when the change is flushed and again after commit, so a request
+# that reads the old row in between can't leave it cached.
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+    object_session(target).info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('changed_user_ids', None)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import event
+from backend.models import db
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements to run on every new SQLite connection, from config"""
+    pragmas = []
+    if config['SQLITE_JOURNAL_MODE']:
+        pragmas.append(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+    if config['SQLITE_BUSY_TIMEOUT_MS'] is not None:
+        pragmas.append(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    if config['SQLITE_SYNCHRONOUS']:
+        pragmas.append(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    if config['SQLITE_CACHE_SIZE_KB']:
+        # Negative cache_size is in KiB rather than pages
+        pragmas.append(f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}")
+    return pragmas
+
+
+def configure_sqlite(engine, pragmas):
+    """Run the pragmas on each new connection of a (sync) engine"""
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def init_app(app):
+    """
+    Apply per-connection settings to the app's engines
+    Pool sizing comes from SQLALCHEMY_ENGINE_OPTIONS; on SQLite each new
+    connection also gets WAL journaling, a busy timeout, relaxed fsyncs and
+    a bigger page cache so concurrent writers wait instead of failing with
+    "database is locked" and readers no longer block on writers.
+    """
+    pragmas = sqlite_pragmas(app.config)
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                configure_sqlite(engine, pragmas)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Event types pushed to clients
+TICKET_CREATED = 'ticket.created'
+TICKET_UPDATED = 'ticket.updated'
+TICKET_ASSIGNED = 'ticket.assigned'
+TICKET_DELETED = 'ticket.deleted'
+
+# Put on a subscriber's queue when it fell too far behind and events were dropped
+OVERFLOW = object()
+
+
+class Subscription:
+    """
+    One listener on the bus (usually one open SSE connection)
+    Holds a bounded queue so a slow client can never grow memory without limit
+    """
+
+    def __init__(self, accepts, queue_size):
+        self.accepts = accepts
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._overflowed = False
+
+    def deliver(self, event):
+        if self._overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Drop the backlog and tell the client to resync instead
+            self._overflowed = True
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self._queue.put_nowait(OVERFLOW)
+
+    def get(self, timeout):
+        """Next event, OVERFLOW, or None if nothing arrived within timeout"""
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event is OVERFLOW:
+            self._overflowed = False
+        return event
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription read from an asyncio event loop
+    Publishers (any thread) wake the loop instead of a blocked thread, so an
+    open stream costs a coroutine rather than a worker thread
+    """
+
+    def __init__(self, accepts, queue_size, loop):
+        super().__init__(accepts, queue_size)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def deliver(self, event):
+        super().deliver(event)
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Loop already closed; the subscriber is going away
+            pass
+
+    async def get_async(self, timeout):
+        """Like get(), without blocking the event loop"""
+        deadline = self._loop.time() + timeout
+        while True:
+            self._wakeup.clear()
+            event = self.get(timeout=0)
+            if event is not None:
+                return event
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+class MemoryBackend:
+    """
+    In-process backend - events only reach subscribers in this process
+    Fine for the development server or a single worker
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def start(self, dispatch):
+        self._dispatch = dispatch
+
+    def publish(self, event):
+        event['id'] = next(self._ids)
+        self._dispatch(event)
+
+
+class RedisBackend:
+    """
+    Redis pub/sub backend - every worker process publishes to one channel and
+    a background thread in each process fans events out to its subscribers
+    Event ids come from a counter in Redis (<channel>:id) so they are unique
+    across processes. Needs the optional `redis` package
+    """
+
+    def __init__(self, url, channel):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('EVENT_BUS_BACKEND=redis needs the redis package (pip install redis)')
+        self._client = redis.Redis.from_url(url)
+        self._channel = channel
+        self._id_key = f'{channel}:id'
+
+    def start(self, dispatch):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel)
+
+        def listen():
+            for message in pubsub.listen():
+                dispatch(json.loads(message['data']))
+
+        threading.Thread(target=listen, name='event-bus-redis', daemon=True).start()
+
+    def publish(self, event):
+        event['id'] = self._client.incr(self._id_key)
+        self._client.publish(self._channel, json.dumps(event))
+
+
+class EventBus:
+    """
+    Publish/subscribe hub for ticket change events
+    Subscribers get events through their own bounded queue; listeners are
+    plain callbacks for in-process consumers and run on the delivering thread
+    (which may be a background thread with no app context)
+    """
+
+    def __init__(self, backend, queue_size=256):
+        self._backend = backend
+        self._queue_size = queue_size
+        self._subscriptions = []
+        self._listeners = []
+        self._lock = threading.Lock()
+        backend.start(self._dispatch)
+
+    def subscribe(self, accepts=None, loop=None):
+        """Add a subscription; pass the event loop to await it with get_async()"""
+        accepts = accepts or (lambda event: True)
+        if loop is not None:
+            subscription = AsyncSubscription(accepts, self._queue_size, loop)
+        else:
+            subscription = Subscription(accepts, self._queue_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def add_listener(self, callback):
+        with self._lock:
+            self._listeners = self._listeners + [callback]
+
+    def publish(self, event_type, ticket, previous=None):
+        self._backend.publish({
+            'id': None,  # set by the backend, unique across processes
+            'type': event_type,
+            'ticket': ticket,
+            'previous': previous or {},
+            'at': datetime.utcnow().isoformat()
+        })
+
+    def _dispatch(self, event):
+        # The subscriber list is replaced, never mutated, so no lock is needed here
+        for subscription in self._subscriptions:
+            if subscription.accepts(event):
+                subscription.deliver(event)
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('Event listener failed')
+
+
+def can_receive(user_id, role, event):
+    """
+    Same visibility rules as get_tickets, applied to a single event
+    Technicians also hear about tickets taken away from them so they can drop them
+    """
+    ticket = event['ticket']
+    if role == 'manager':
+        return True
+    if role == 'user':
+        return ticket['created_by'] == user_id
+    if role == 'technician':
+        return (ticket['assigned_to'] == user_id
+                or event['previous'].get('assigned_to') == user_id)
+    return False
+
+
+def init_app(app):
+    """Create the app's event bus from config and store it on the app"""
+    if app.config['EVENT_BUS_BACKEND'] == 'redis':
+        backend = RedisBackend(app.config['EVENT_BUS_URL'], app.config['EVENT_BUS_CHANNEL'])
+    else:
+        backend = MemoryBackend()
+    app.extensions['event_bus'] = EventBus(backend, app.config['SSE_QUEUE_SIZE'])
+
+
+def get_bus():
+    return current_app.extensions['event_bus']
+
+
+def publish(event_type, ticket, previous=None):
+    """Publish a ticket event - call only after the change has been committed"""
+    get_bus().publish(event_type, ticket, previous)
+
+
+def format_sse(event):
+    """Encode an event in the text/event-stream wire format"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+from datetime import datetime
+from flask import request, current_app
+from sqlalchemy import select
+from werkzeug.http import is_resource_modified
+from backend.models import db, ChangeCounter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Scope bumped by every ticket change - what managers see
+ALL_SCOPE = 'all'
+
+# Scope bumped when a username changes or a user is deleted, for lists that
+# show usernames (include_users)
+USERS_SCOPE = 'users'
+
+# Scope bumped whenever the analytics refresh writes rollup rows
+ANALYTICS_SCOPE = 'analytics'
+
+
+def user_scope(user_id):
+    """Scope for tickets a user created or is assigned to"""
+    return f'user:{user_id}'
+
+
+def scope_for(user):
+    """The change counter scope covering every ticket this user can see"""
+    return ALL_SCOPE if user.role == 'manager' else user_scope(user.id)
+
+
+def list_scopes(user, include_users=False):
+    """The scopes a ticket list for this user is built from"""
+    scope = scope_for(user)
+    return (scope, USERS_SCOPE) if include_users else (scope,)
+
+
+def _upsert_statement(dialect_name):
+    """INSERT ... ON CONFLICT that moves an existing counter one version on"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = ChangeCounter.__table__
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.scope],
+        set_={'version': table.c.version + 1, 'changed_at': stmt.excluded.changed_at}
+    )
+
+
+def touch(*user_ids):
+    """
+    Record a ticket change seen by these users (creator, old and new
+    assignee) and by managers, so their cached lists and stats go stale
+    Runs in the caller's session, so it commits or rolls back with the change
+    """
+    _bump({ALL_SCOPE} | {user_scope(user_id) for user_id in user_ids if user_id})
+
+
+def touch_users():
+    """Record a username change or a deleted user, in the caller's session"""
+    _bump({USERS_SCOPE})
+
+
+def touch_analytics():
+    """Record a change to the analytics rollups, in the caller's session"""
+    _bump({ANALYTICS_SCOPE})
+
+
+def _bump(scopes):
+    now = datetime.utcnow()
+    dialect_name = db.session.get_bind(mapper=ChangeCounter).dialect.name
+    # Sorted so concurrent writers lock the rows in the same order
+    db.session.execute(_upsert_statement(dialect_name), [
+        {'scope': scope, 'version': 1, 'changed_at': now} for scope in sorted(scopes)
+    ])
+
+
+def make_etag(*parts):
+    """Opaque ETag value for a response determined by parts"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:24]
+
+
+def scope_version_select(scope):
+    return select(ChangeCounter.version, ChangeCounter.changed_at).where(ChangeCounter.scope == scope)
+
+
+def validators_from(scope, row, *extra):
+    """(etag, last_modified) from a scope_version_select row (None if no counter yet)"""
+    version, changed_at = row if row else (0, None)
+    return make_etag(scope, version, *extra), changed_at
+
+
+def scope_validators(scope, *extra):
+    """(etag, last_modified) for a response built from a scope's tickets"""
+    return validators_from(scope, db.session.execute(scope_version_select(scope)).first(), *extra)
+
+
+def scopes_version_select(scopes):
+    return (select(ChangeCounter.scope, ChangeCounter.version, ChangeCounter.changed_at)
+            .where(ChangeCounter.scope.in_(scopes)))
+
+
+def scopes_validators_from(scopes, rows):
+    """
+    (etag, last_modified) from scopes_version_select rows, changing when any
+    of the scopes does (for one scope, the same as validators_from)
+    """
+    counters = {row.scope: (row.version, row.changed_at) for row in rows}
+    versions = [counters.get(scope, (0, None)) for scope in scopes]
+    changed = [changed_at for _, changed_at in versions if changed_at is not None]
+    return make_etag(*scopes, *(version for version, _ in versions)), max(changed, default=None)
+
+
+def scopes_validators(scopes):
+    return scopes_validators_from(scopes, db.session.execute(scopes_version_select(scopes)).all())
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Add ETag/Last-Modified to a response; clients must revalidate before reuse
+    The ETag is weak so it stays valid when the body is compressed
+    """
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """A 304 response if the client's copy is still current, otherwise None"""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def encode_body(body, accepted, config):
+    """(encoding, encoded body) for the client's Accept-Encoding, or (None, body)"""
+    if brotli is not None and accepted['br']:
+        return 'br', brotli.compress(body, quality=config['COMPRESS_BROTLI_QUALITY'])
+    if accepted['gzip']:
+        return 'gzip', gzip.compress(body, compresslevel=config['COMPRESS_GZIP_LEVEL'])
+    return None, body
+
+
+def compress_response(response, config):
+    """gzip or brotli encode a large enough buffered response the client accepts"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding, body = encode_body(body, request.accept_encodings, config)
+    if encoding is None:
+        return response
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """Compress API responses when COMPRESS_ENABLED is on"""
+    if not app.config['COMPRESS_ENABLED']:
+        return
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import functools
+import heapq
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from backend import metrics, serialization
+from backend.models import User, Ticket, ActivityLog
+
+logger = logging.getLogger(__name__)
+
+# Models whose to_dict() time is reported as serialization time
+SERIALIZED_MODELS = (User, Ticket, ActivityLog)
+
+# JSON provider methods timed the same way - list endpoints skip to_dict()
+# (plain rows), so for them encoding the response is the serialization
+SERIALIZED_PROVIDER_METHODS = ('dumps', 'response')
+
+# "IN (?, ?, ?)" and "IN (%(id_1_1)s, %(id_1_2)s)" both become "IN (?)" so
+# the same query with different list lengths counts as one statement
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+_UNSAFE_FILENAME = re.compile(r'[^\w.-]')
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def normalize_statement(statement):
+    """SQL text with parameter lists and whitespace collapsed, for grouping"""
+    return _IN_LIST.sub('IN (?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class RequestStats:
+    """Everything measured for one request, kept on g while it runs"""
+
+    __slots__ = ('started', 'query_count', 'query_time', 'serialize_time',
+                 'serializing', 'statements', 'profile')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+        self.statements = Counter()
+        self.profile = None
+
+    def worst_repeat(self):
+        """(statement, count) of the most repeated SELECT, or (None, 0)"""
+        selects = [(count, statement) for statement, count in self.statements.items()
+                   if statement[:6].upper() == 'SELECT']
+        if not selects:
+            return None, 0
+        count, statement = max(selects)
+        return statement, count
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return g.get('_instrumentation')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None and context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current()
+    started = getattr(context, '_instrumentation_started', None)
+    if stats is None or started is None:
+        return
+    stats.query_count += 1
+    stats.query_time += time.perf_counter() - started
+    stats.statements[normalize_statement(statement)] += 1
+
+
+def _timed_serializer(function):
+    """Wrap a to_dict() or JSON encoder so its time (outermost call only) lands on the request"""
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        stats = _current()
+        if stats is None or stats.serializing:
+            return function(*args, **kwargs)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.serialize_time += time.perf_counter() - started
+            stats.serializing = False
+
+    return timed
+
+
+def _install():
+    """
+    Hook SQLAlchemy, the models and the JSON providers once per process
+    The hooks do nothing unless the current request is being instrumented,
+    so apps created with instrumentation off are unaffected.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        for model in SERIALIZED_MODELS:
+            model.to_dict = _timed_serializer(model.to_dict)
+        for provider in serialization.PROVIDERS.values():
+            for name in SERIALIZED_PROVIDER_METHODS:
+                setattr(provider, name, _timed_serializer(getattr(provider, name)))
+        _installed = True
+
+
+class SlowRequestProfiler:
+    """
+    Runs cProfile on a random sample of requests and keeps the dumps of the
+    slowest `keep` of them (files are named <ms>ms-<endpoint>-<ns>.prof and
+    open with `python -m pstats` or snakeviz)
+    """
+
+    def __init__(self, directory, keep=20, sample_rate=0.0):
+        self.directory = directory
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self._kept = []  # min-heap of (duration, path)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return None
+        return profile
+
+    def finish(self, profile, duration, label):
+        """Stop profiling; returns the dump's path if it made the slowest list"""
+        profile.disable()
+        with self._lock:
+            if len(self._kept) >= self.keep and duration <= self._kept[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            name = f'{int(duration * 1000)}ms-{_UNSAFE_FILENAME.sub("_", label)}-{time.time_ns()}.prof'
+            path = os.path.join(self.directory, name)
+            profile.dump_stats(path)
+            if len(self._kept) >= self.keep:
+                _, evicted = heapq.heapreplace(self._kept, (duration, path))
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+            else:
+                heapq.heappush(self._kept, (duration, path))
+        return path
+
+
+def init_app(app):
+    """
+    Time every request when INSTRUMENTATION_ENABLED is on
+    Reports wall, SQL and serialization (to_dict and JSON encoding) time
+    in a Server-Timing header plus the query count, flags N+1 query patterns, feeds GET /api/metrics and
+    optionally profiles a sample of requests.
+    """
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+
+    _install()
+
+    registry = metrics.get_registry(app)
+    request_duration = registry.histogram(
+        'http_request_duration_seconds', 'Request wall time', ('method', 'endpoint'))
+    requests_total = registry.counter(
+        'http_requests_total', 'Requests served', ('method', 'endpoint', 'status'))
+    sql_queries = registry.counter(
+        'sql_queries_total', 'SQL statements executed while serving requests', ('endpoint',))
+    sql_seconds = registry.counter(
+        'sql_query_seconds_total', 'Time spent in SQL statements', ('endpoint',))
+    serialize_seconds = registry.counter(
+        'serialization_seconds_total', 'Time spent in to_dict() calls and JSON encoding', ('endpoint',))
+    n_plus_one = registry.counter(
+        'n_plus_one_requests_total', 'Requests that repeated one SELECT past the threshold', ('endpoint',))
+
+    threshold = app.config['INSTRUMENTATION_N_PLUS_ONE_THRESHOLD']
+    send_headers = app.config['INSTRUMENTATION_HEADERS']
+    profiler = SlowRequestProfiler(
+        app.config['INSTRUMENTATION_PROFILE_DIR'] or os.path.join(tempfile.gettempdir(), 'ticketing-profiles'),
+        keep=app.config['INSTRUMENTATION_PROFILE_KEEP'],
+        sample_rate=app.config['INSTRUMENTATION_PROFILE_SAMPLE_RATE'],
+    )
+    app.extensions['instrumentation'] = profiler
+
+    @app.before_request
+    def start_instrumentation():
+        stats = g._instrumentation = RequestStats()
+        stats.profile = profiler.start()
+
+    @app.after_request
+    def finish_instrumentation(response):
+        stats = _current()
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        request_duration.observe(duration, method=request.method, endpoint=endpoint)
+        requests_total.inc(method=request.method, endpoint=endpoint, status=str(response.status_code))
+        sql_queries.inc(stats.query_count, endpoint=endpoint)
+        sql_seconds.inc(stats.query_time, endpoint=endpoint)
+        serialize_seconds.inc(stats.serialize_time, endpoint=endpoint)
+
+        statement, repeats = stats.worst_repeat()
+        if repeats > threshold:
+            n_plus_one.inc(endpoint=endpoint)
+            logger.warning('Possible N+1 on %s %s: %d x %s', request.method, request.path, repeats, statement)
+
+        if stats.profile is not None:
+            path = profiler.finish(stats.profile, duration, request.endpoint or 'unmatched')
+            stats.profile = None
+            if path:
+                logger.info('Saved profile of %s %s (%.1f ms) to %s',
+                            request.method, request.path, duration * 1000, path)
+
+        if send_headers:
+            response.headers['Server-Timing'] = (
+                f'app;dur={duration * 1000:.2f}, '
+                f'db;dur={stats.query_time * 1000:.2f};desc="{stats.query_count} queries", '
+                f'serialize;dur={stats.serialize_time * 1000:.2f}'
+            )
+            response.headers['X-Query-Count'] = str(stats.query_count)
+            if repeats > threshold:
+                response.headers['X-N-Plus-One'] = str(repeats)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # after_request doesn't run if the request died before a response
+        stats = _current()
+        if stats is not None and stats.profile is not None:
+            stats.profile.disable()
+            stats.profile = None
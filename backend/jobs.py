@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, update, delete, func, and_, or_, exists, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from backend.metrics import get_registry
+from backend.models import db, Job
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+FAILED = 'failed'
+
+# Registered handlers as kind -> function
+HANDLERS = {}
+
+_CLAIMED_COLUMNS = (Job.id, Job.kind, Job.payload, Job.attempts, Job.created_at)
+
+
+def handler(kind):
+    """
+    Decorator to register the handler for a kind of job
+    The function receives a list of claimed jobs (rows with id, kind,
+    payload, attempts and created_at), all of that kind, so it can do a
+    batch of them at once. It returns {job id: error message} for the jobs
+    that failed and should be retried (nothing when all succeeded); an
+    exception fails the whole batch.
+    """
+    def decorator(f):
+        HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def _upsert_statement(dialect_name):
+    """INSERT ... ON CONFLICT that replaces the payload of a pending job with the same dedup_key"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = Job.__table__
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.dedup_key],
+        index_where=text("status = 'pending'"),
+        set_={'payload': stmt.excluded.payload}
+    )
+
+
+def enqueue(jobs, delay=0):
+    """
+    Add jobs as part of the current transaction
+    jobs are dicts with kind, payload and optionally dedup_key. They run
+    no sooner than delay seconds from now; a job whose dedup_key matches one
+    still pending only updates that job's payload, so it keeps its place.
+    Of several jobs with the same dedup_key in one call the last one wins
+    (one upsert statement can't touch the same row twice).
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    rows = [{'kind': job['kind'], 'payload': job['payload'], 'dedup_key': job.get('dedup_key'),
+             'status': PENDING, 'run_at': now + timedelta(seconds=delay), 'attempts': 0,
+             'created_at': now} for job in jobs]
+    deduplicated = {}
+    for index, row in enumerate(rows):
+        deduplicated[row['dedup_key'] or index] = row
+    rows = list(deduplicated.values())
+    dialect_name = db.session.get_bind(mapper=Job).dialect.name
+    db.session.execute(_upsert_statement(dialect_name), rows)
+
+
+def retry_delay(attempts, base, maximum):
+    """Seconds before the next try: exponential in attempts, capped, with jitter"""
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _due(now):
+    """Pending jobs whose time has come, and running jobs whose worker went away"""
+    return or_(and_(Job.status == PENDING, Job.run_at <= now),
+               and_(Job.status == RUNNING, Job.locked_until < now))
+
+
+def claim(token, limit, lease_seconds, now=None):
+    """Lease up to limit due jobs to token, oldest first; returns the claimed rows"""
+    now = now or datetime.utcnow()
+    due_ids = (
+        select(Job.id)
+        .where(_due(now))
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    # Re-checking _due makes a job another worker claimed first drop out
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(due_ids.scalar_subquery()), _due(now))
+        .values(status=RUNNING, locked_by=token, locked_until=now + timedelta(seconds=lease_seconds),
+                attempts=Job.attempts + 1)
+        .returning(*_CLAIMED_COLUMNS),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+    return claimed
+
+
+def finish(token, succeeded, failed, max_attempts, retry_base, retry_max, now=None):
+    """
+    Record the outcome of claimed jobs
+    succeeded are job ids; failed is (claimed row, error message) pairs.
+    Failed jobs go back to pending after a backoff, or become 'failed' once
+    out of attempts. A retry is dropped if a pending job with the same
+    dedup_key already covers it. Jobs whose lease ran out and were claimed
+    by another worker meanwhile are left alone.
+    """
+    now = now or datetime.utcnow()
+    mine = Job.locked_by == token
+    if succeeded:
+        # Committed on their own so a failed retry below can't resend them
+        db.session.execute(delete(Job).where(Job.id.in_(succeeded), mine),
+                           execution_options={'synchronize_session': False})
+        db.session.commit()
+
+    newer = aliased(Job)
+    superseded = exists().where(newer.dedup_key == Job.dedup_key, newer.status == PENDING)
+    for job, error in failed:
+        values = {'locked_by': None, 'locked_until': None, 'last_error': error[:2000]}
+        conditions = [Job.id == job.id, mine]
+        if job.attempts >= max_attempts:
+            values['status'] = FAILED
+            logger.error('Job %d (%s) failed for good after %d attempts: %s', job.id, job.kind, job.attempts, error)
+        else:
+            values['status'] = PENDING
+            values['run_at'] = now + timedelta(seconds=retry_delay(job.attempts, retry_base, retry_max))
+            conditions.append(~superseded)
+        try:
+            db.session.execute(update(Job).where(*conditions).values(**values),
+                               execution_options={'synchronize_session': False})
+            # Still running under this token: a pending job with the same key covers it
+            db.session.execute(delete(Job).where(Job.id == job.id, mine, Job.status == RUNNING),
+                               execution_options={'synchronize_session': False})
+            db.session.commit()
+        except IntegrityError:
+            # Such a job was enqueued between the check and the update
+            db.session.rollback()
+            db.session.execute(delete(Job).where(Job.id == job.id, mine),
+                               execution_options={'synchronize_session': False})
+            db.session.commit()
+
+
+class JobRunner:
+    """
+    Runs queued jobs on a pool of worker threads
+    Each worker claims up to JOBS_BATCH_SIZE due jobs at a time under a
+    lease of JOBS_LEASE_SECONDS, hands each kind's share to its handler in
+    one call and records the outcome. Claims are conditional UPDATEs, so any
+    number of workers and processes can share the queue; jobs held by a
+    worker that died are picked up again once their lease runs out.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.workers = config['JOBS_WORKERS']
+        self.batch_size = config['JOBS_BATCH_SIZE']
+        self.poll_seconds = config['JOBS_POLL_SECONDS']
+        self.lease_seconds = config['JOBS_LEASE_SECONDS']
+        self.max_attempts = config['JOBS_MAX_ATTEMPTS']
+        self.retry_base = config['JOBS_RETRY_BASE_SECONDS']
+        self.retry_max = config['JOBS_RETRY_MAX_SECONDS']
+        self._stop = threading.Event()
+        self._threads = []
+
+        registry = get_registry(app)
+        self._processed = registry.counter('jobs_processed_total', 'Background jobs run, by outcome',
+                                           ('kind', 'result'))
+        self._batch_latency = registry.histogram('jobs_batch_seconds', 'Time to run one batch of jobs', ('kind',))
+
+    def _run_kind(self, kind, jobs):
+        """Run one kind's jobs through its handler; returns (job row, error) for those that failed"""
+        run = HANDLERS.get(kind)
+        if run is None:
+            return [(job, f'No handler for job kind {kind!r}') for job in jobs]
+        started = time.perf_counter()
+        try:
+            errors = run(jobs) or {}
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('%s batch of %d jobs failed', kind, len(jobs))
+            errors = {job.id: f'{type(e).__name__}: {e}' for job in jobs}
+        self._batch_latency.observe(time.perf_counter() - started, kind=kind)
+        return [(job, errors[job.id]) for job in jobs if job.id in errors]
+
+    def run_once(self):
+        """Claim and run one batch; returns how many jobs were claimed"""
+        token = uuid.uuid4().hex
+        claimed = claim(token, self.batch_size, self.lease_seconds)
+        if not claimed:
+            return 0
+
+        by_kind = defaultdict(list)
+        for job in claimed:
+            by_kind[job.kind].append(job)
+        failed = []
+        for kind, jobs in by_kind.items():
+            errors = self._run_kind(kind, jobs)
+            failed.extend(errors)
+            self._processed.inc(len(jobs) - len(errors), kind=kind, result='succeeded')
+            for job, _ in errors:
+                gave_up = job.attempts >= self.max_attempts
+                self._processed.inc(kind=kind, result='failed' if gave_up else 'retried')
+
+        failed_ids = {job.id for job, _ in failed}
+        succeeded = [job.id for job in claimed if job.id not in failed_ids]
+        finish(token, succeeded, failed, self.max_attempts, self.retry_base, self.retry_max)
+        return len(claimed)
+
+    def run(self):
+        """Work through the queue until stop() is called, polling when it is empty"""
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    claimed = self.run_once()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Job worker pass failed')
+                    claimed = 0
+                finally:
+                    db.session.remove()
+                if claimed < self.batch_size:
+                    self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the workers after their current batch"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def queue_status():
+    """Job counts as {(kind, status): count}"""
+    rows = db.session.execute(select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status))
+    return {(kind, status): count for kind, status, count in rows}
+
+
+def init_app(app):
+    """Start the worker pool in this process when JOBS_IN_PROCESS is on"""
+    if not app.config['JOBS_IN_PROCESS']:
+        return
+    runner = JobRunner(app)
+    app.extensions['job_runner'] = runner
+    runner.start()
+
+
+def register_commands(app):
+    """Add `flask jobs-run`, `flask jobs-status` and `flask jobs-retry` to the app's CLI"""
+
+    @app.cli.command('jobs-run')
+    def jobs_run_command():
+        """Run the job workers in the foreground (Ctrl+C to stop)"""
+        runner = JobRunner(current_app._get_current_object())
+        click.echo(f'Running {runner.workers} job workers')
+        runner.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            runner.stop()
+
+    @app.cli.command('jobs-status')
+    def jobs_status_command():
+        """Show how many jobs of each kind are pending, running or failed"""
+        counts = queue_status()
+        if not counts:
+            click.echo('Job queue is empty')
+        for (kind, status), count in sorted(counts.items()):
+            click.echo(f'{kind:<30} {status:<8} {count:>8}')
+
+    @app.cli.command('jobs-retry')
+    def jobs_retry_command():
+        """Give failed jobs another round of attempts"""
+        newer = aliased(Job)
+        # Keep one failed job per dedup_key, and none where a pending one covers it
+        covered = exists().where(newer.dedup_key == Job.dedup_key,
+                                 or_(newer.status == PENDING, and_(newer.status == FAILED, newer.id > Job.id)))
+        dropped = db.session.execute(delete(Job).where(Job.status == FAILED, covered)).rowcount
+        retried = db.session.execute(
+            update(Job).where(Job.status == FAILED)
+            .values(status=PENDING, attempts=0, run_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        click.echo(f'Requeued {retried} failed jobs ({dropped} already covered by newer ones dropped)')
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import click
+from sqlalchemy import (MetaData, Table, Column, Index, ForeignKey, Integer, String, Text, Date, DateTime,
+                        Float, JSON, select, insert, inspect, text)
+from sqlalchemy.schema import CreateTable
+from backend.models import db
+
+# Bookkeeping table - one row per migration that has been applied.
+# Kept on its own MetaData so it never shows up in the app models.
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Arbitrary key for the PostgreSQL advisory lock that stops two workers
+# from migrating the same database at the same time
+MIGRATION_LOCK_KEY = 7301
+
+# Registered migrations as (version, description, function)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Decorator to register a schema migration
+    The function receives an open Connection; versions must only ever grow
+    """
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return decorator
+
+
+def create_tables(conn, *tables):
+    """Create tables (and their indexes) if they don't exist yet"""
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+
+def create_indexes(conn, *indexes):
+    """Create the indexes the database is missing"""
+    for index in indexes:
+        existing = {ix['name'] for ix in inspect(conn).get_indexes(index.table.name)}
+        if index.name not in existing:
+            index.create(conn)
+
+
+def add_columns(conn, table_name, *columns):
+    """Add columns that the database table doesn't have yet (nullable columns only)"""
+    existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+    for column in columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'))
+
+
+def index(name, table_name, *column_names, **kwargs):
+    """An index on the named columns of a table an earlier migration created"""
+    table = Table(table_name, MetaData(), *(Column(column_name) for column_name in column_names))
+    return Index(name, *(table.c[column_name] for column_name in column_names), **kwargs)
+
+
+def referenced_tables(metadata, *table_names):
+    """Add stand-ins for the tables a frozen table's foreign keys point at"""
+    for name in table_names:
+        Table(name, metadata, Column('id', Integer, primary_key=True))
+    return metadata
+
+
+def applied_versions(conn):
+    """Return the set of migration versions already applied to this database"""
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def upgrade_database(engine=None):
+    """
+    Bring the database schema up to date
+    Applies every registered migration that hasn't run yet, in version order,
+    each in its own transaction. Safe to call on every startup.
+    Returns the list of versions that were applied.
+    """
+    engine = engine or db.engine
+    applied_now = []
+
+    with engine.connect() as conn:
+        is_postgres = conn.dialect.name == 'postgresql'
+        if is_postgres:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            conn.commit()
+
+        try:
+            done = applied_versions(conn)
+            conn.commit()
+
+            for version, description, f in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if version in done:
+                    continue
+                f(conn)
+                conn.execute(insert(schema_migrations).values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow()
+                ))
+                conn.commit()
+                applied_now.append(version)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if is_postgres:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                conn.commit()
+
+    return applied_now
+
+
+def register_commands(app):
+    """Add `flask db-upgrade` and `flask db-status` to the app's CLI"""
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Apply any pending schema migrations"""
+        applied = upgrade_database()
+        if applied:
+            click.echo(f'Applied migrations: {", ".join(str(v) for v in applied)}')
+        else:
+            click.echo('Database is up to date')
+
+    @app.cli.command('db-status')
+    def db_status_command():
+        """List migrations and whether each has been applied"""
+        with db.engine.connect() as conn:
+            done = applied_versions(conn)
+            conn.commit()
+        for version, description, _ in sorted(MIGRATIONS, key=lambda m: m[0]):
+            mark = 'x' if version in done else ' '
+            click.echo(f'[{mark}] {version:04d} {description}')
+
+
+# ---------------------------------------------------------------------------
+# Migrations
+# Never edit a migration once it has shipped - add a new one instead.
+# Each one spells out the schema as it was at its version rather than
+# reading the models, which keep changing under it.
+# ---------------------------------------------------------------------------
+
+@migration(1, 'Initial schema: users, tickets, activity_logs')
+def _initial_schema(conn):
+    metadata = MetaData()
+    users = Table(
+        'users', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('username', String(80), unique=True, nullable=False),
+        Column('email', String(120), unique=True, nullable=False),
+        Column('password_hash', String(200), nullable=False),
+        Column('role', String(20), nullable=False),
+        Column('created_at', DateTime),
+    )
+    tickets = Table(
+        'tickets', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('title', String(200), nullable=False),
+        Column('description', Text, nullable=False),
+        Column('category', String(50), nullable=False),
+        Column('priority', String(20), nullable=False),
+        Column('status', String(20), nullable=False),
+        Column('created_by', Integer, ForeignKey('users.id'), nullable=False),
+        Column('assigned_to', Integer, ForeignKey('users.id'), nullable=True),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('resolved_at', DateTime, nullable=True),
+    )
+    activity_logs = Table(
+        'activity_logs', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('ticket_id', Integer, ForeignKey('tickets.id'), nullable=False),
+        Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+        Column('action', String(100), nullable=False),
+        Column('description', Text, nullable=False),
+        Column('created_at', DateTime),
+    )
+    # Databases created by the old db.create_all() already have these tables,
+    # so this is a no-op for them and a full create for new databases
+    create_tables(conn, users, tickets, activity_logs)
+
+
+@migration(2, 'Composite indexes for ticket list, detail and stats queries')
+def _ticket_indexes(conn):
+    create_indexes(
+        conn,
+        index('ix_tickets_created_at_id', 'tickets', 'created_at', 'id'),
+        index('ix_tickets_created_by_created_at', 'tickets', 'created_by', 'created_at', 'id'),
+        index('ix_tickets_assigned_to_created_at', 'tickets', 'assigned_to', 'created_at', 'id'),
+        index('ix_tickets_assigned_to_status_created_at', 'tickets', 'assigned_to', 'status', 'created_at'),
+        index('ix_tickets_status_priority', 'tickets', 'status', 'priority'),
+        index('ix_tickets_priority_created_at', 'tickets', 'priority', 'created_at'),
+        index('ix_activity_logs_ticket_id_created_at', 'activity_logs', 'ticket_id', 'created_at', 'id'),
+    )
+
+
+@migration(3, 'Ticket stat counters for /api/tickets/stats')
+def _ticket_stat_counters(conn):
+    from backend.stats import rebuild_counters
+    create_tables(conn, Table(
+        'ticket_stat_counters', MetaData(),
+        Column('dimension', String(20), primary_key=True),
+        Column('key', String(50), primary_key=True),
+        Column('count', Integer, nullable=False),
+    ))
+    rebuild_counters(conn)
+
+
+@migration(4, 'Ticket tombstones and updated_at index for delta sync')
+def _ticket_tombstones(conn):
+    tombstones = Table(
+        'ticket_tombstones', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('ticket_id', Integer, nullable=False),
+        Column('created_by', Integer, nullable=False),
+        Column('assigned_to', Integer, nullable=True),
+        Column('reason', String(20), nullable=False),
+        Column('deleted_at', DateTime, nullable=False),
+    )
+    Index('ix_ticket_tombstones_deleted_at_id', tombstones.c.deleted_at, tombstones.c.id)
+    create_tables(conn, tombstones)
+    create_indexes(conn, index('ix_tickets_updated_at_id', 'tickets', 'updated_at', 'id'))
+
+
+@migration(5, 'Full-text search index over tickets and activity logs')
+def _search_index(conn):
+    from backend.search import reindex
+    # No-op on databases without full-text support; search then reports 501
+    reindex(conn)
+
+
+@migration(6, 'SLA breach timestamps on tickets')
+def _sla_breach_columns(conn):
+    add_columns(conn, 'tickets',
+                Column('sla_response_breached_at', DateTime, nullable=True),
+                Column('sla_resolution_breached_at', DateTime, nullable=True))
+
+
+@migration(7, 'Archive tables for old resolved tickets and their activity logs')
+def _ticket_archive(conn):
+    metadata = MetaData()
+    # No foreign keys: archived rows outlive the users and tickets they name
+    tickets_archive = Table(
+        'tickets_archive', metadata,
+        Column('id', Integer, primary_key=True, autoincrement=False),
+        Column('title', String(200), nullable=False),
+        Column('description', Text, nullable=False),
+        Column('category', String(50), nullable=False),
+        Column('priority', String(20), nullable=False),
+        Column('status', String(20), nullable=False),
+        Column('created_by', Integer, nullable=False),
+        Column('assigned_to', Integer, nullable=True),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('resolved_at', DateTime, nullable=True),
+        Column('sla_response_breached_at', DateTime, nullable=True),
+        Column('sla_resolution_breached_at', DateTime, nullable=True),
+        Column('archived_at', DateTime, nullable=False),
+    )
+    Index('ix_tickets_archive_created_by', tickets_archive.c.created_by, tickets_archive.c.id)
+    Index('ix_tickets_archive_assigned_to', tickets_archive.c.assigned_to, tickets_archive.c.id)
+    activity_logs_archive = Table(
+        'activity_logs_archive', metadata,
+        Column('id', Integer, primary_key=True, autoincrement=False),
+        Column('ticket_id', Integer, nullable=False),
+        Column('user_id', Integer, nullable=False),
+        Column('action', String(100), nullable=False),
+        Column('description', Text, nullable=False),
+        Column('created_at', DateTime),
+        Column('archived_at', DateTime, nullable=False),
+    )
+    Index('ix_activity_logs_archive_ticket_id_created_at', activity_logs_archive.c.ticket_id,
+          activity_logs_archive.c.created_at, activity_logs_archive.c.id)
+    create_tables(conn, tickets_archive, activity_logs_archive)
+    create_indexes(conn, index('ix_tickets_status_resolved_at', 'tickets', 'status', 'resolved_at'))
+
+
+@migration(8, 'Change counters for HTTP conditional requests')
+def _change_counters(conn):
+    create_tables(conn, Table(
+        'change_counters', MetaData(),
+        Column('scope', String(40), primary_key=True),
+        Column('version', Integer, nullable=False),
+        Column('changed_at', DateTime, nullable=False),
+    ))
+
+
+@migration(9, 'Spool batch ids for the buffered audit writer')
+def _audit_spool_batches(conn):
+    create_tables(conn, Table(
+        'audit_spool_batches', MetaData(),
+        Column('id', String(32), primary_key=True),
+        Column('flushed_at', DateTime, nullable=False, index=True),
+    ))
+
+
+@migration(10, 'Rollup tables for resolution-time analytics')
+def _analytics_rollups(conn):
+    metadata = MetaData()
+    create_tables(
+        conn,
+        Table(
+            'analytics_ticket_ledger', metadata,
+            Column('ticket_id', Integer, primary_key=True, autoincrement=False),
+            Column('category', String(50), nullable=False),
+            Column('priority', String(20), nullable=False),
+            Column('assigned_to', Integer, nullable=True),
+            Column('created_day', Date, nullable=False),
+            Column('resolved_day', Date, nullable=True),
+            Column('resolve_seconds', Float, nullable=True),
+        ),
+        Table(
+            'analytics_volume_daily', metadata,
+            Column('dimension', String(20), primary_key=True),
+            Column('day', Date, primary_key=True),
+            Column('key', String(50), primary_key=True),
+            Column('opened', Integer, nullable=False),
+            Column('closed', Integer, nullable=False),
+        ),
+        Table(
+            'analytics_resolution_daily', metadata,
+            Column('dimension', String(20), primary_key=True),
+            Column('day', Date, primary_key=True),
+            Column('key', String(50), primary_key=True),
+            Column('bucket', Integer, primary_key=True, autoincrement=False),
+            Column('tickets', Integer, nullable=False),
+            Column('seconds', Float, nullable=False),
+        ),
+        Table(
+            'analytics_watermarks', metadata,
+            Column('name', String(20), primary_key=True),
+            Column('mark_at', DateTime, nullable=False),
+            Column('mark_id', Integer, nullable=False),
+            Column('refreshed_at', DateTime, nullable=False),
+        ),
+    )
+
+
+@migration(11, 'Background job queue')
+def _job_queue(conn):
+    jobs = Table(
+        'jobs', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('kind', String(50), nullable=False),
+        Column('payload', JSON, nullable=False),
+        Column('dedup_key', String(200), nullable=True),
+        Column('status', String(20), nullable=False),
+        Column('run_at', DateTime, nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('locked_by', String(32), nullable=True),
+        Column('locked_until', DateTime, nullable=True),
+        Column('last_error', Text, nullable=True),
+        Column('created_at', DateTime, nullable=False),
+    )
+    Index('ix_jobs_status_run_at', jobs.c.status, jobs.c.run_at)
+    Index('uq_jobs_pending_dedup_key', jobs.c.dedup_key, unique=True,
+          sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'"))
+    create_tables(conn, jobs)
+
+
+@migration(12, 'Never reuse archived ticket or activity log ids on SQLite')
+def _sqlite_autoincrement(conn):
+    # SQLite hands out max(id) + 1, so archiving the newest rows freed their
+    # ids for new ones, which then clashed in the archive. PostgreSQL
+    # sequences never reuse ids.
+    if conn.dialect.name != 'sqlite':
+        return
+    metadata = referenced_tables(MetaData(), 'users', 'tickets')
+    rebuilt = {
+        'tickets': Table(
+            'tickets_rebuilt', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('title', String(200), nullable=False),
+            Column('description', Text, nullable=False),
+            Column('category', String(50), nullable=False),
+            Column('priority', String(20), nullable=False),
+            Column('status', String(20), nullable=False),
+            Column('created_by', Integer, ForeignKey('users.id'), nullable=False),
+            Column('assigned_to', Integer, ForeignKey('users.id'), nullable=True),
+            Column('created_at', DateTime),
+            Column('updated_at', DateTime),
+            Column('resolved_at', DateTime, nullable=True),
+            Column('sla_response_breached_at', DateTime, nullable=True),
+            Column('sla_resolution_breached_at', DateTime, nullable=True),
+            sqlite_autoincrement=True,
+        ),
+        'activity_logs': Table(
+            'activity_logs_rebuilt', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('ticket_id', Integer, ForeignKey('tickets.id'), nullable=False),
+            Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+            Column('action', String(100), nullable=False),
+            Column('description', Text, nullable=False),
+            Column('created_at', DateTime),
+            sqlite_autoincrement=True,
+        ),
+    }
+    # Dropping a table drops its indexes, so they're rebuilt from migrations 2, 4 and 7
+    indexes = {
+        'tickets': [
+            index('ix_tickets_created_at_id', 'tickets', 'created_at', 'id'),
+            index('ix_tickets_created_by_created_at', 'tickets', 'created_by', 'created_at', 'id'),
+            index('ix_tickets_assigned_to_created_at', 'tickets', 'assigned_to', 'created_at', 'id'),
+            index('ix_tickets_assigned_to_status_created_at', 'tickets', 'assigned_to', 'status', 'created_at'),
+            index('ix_tickets_status_priority', 'tickets', 'status', 'priority'),
+            index('ix_tickets_priority_created_at', 'tickets', 'priority', 'created_at'),
+            index('ix_tickets_updated_at_id', 'tickets', 'updated_at', 'id'),
+            index('ix_tickets_status_resolved_at', 'tickets', 'status', 'resolved_at'),
+        ],
+        'activity_logs': [
+            index('ix_activity_logs_ticket_id_created_at', 'activity_logs', 'ticket_id', 'created_at', 'id'),
+        ],
+    }
+    for table_name, archive_name in (('tickets', 'tickets_archive'), ('activity_logs', 'activity_logs_archive')):
+        table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                 {'name': table_name}).scalar()
+        if 'AUTOINCREMENT' not in table_sql.upper():
+            # Rebuild the table the way SQLite documents for schema changes
+            columns = ', '.join(column.name for column in rebuilt[table_name].columns)
+            conn.execute(CreateTable(rebuilt[table_name]))
+            conn.execute(text(f'INSERT INTO {table_name}_rebuilt ({columns}) SELECT {columns} FROM {table_name}'))
+            conn.execute(text(f'DROP TABLE {table_name}'))
+            conn.execute(text(f'ALTER TABLE {table_name}_rebuilt RENAME TO {table_name}'))
+            create_indexes(conn, *indexes[table_name])
+
+        # Start new ids above every id already handed out, archived or not
+        highest = conn.execute(text(
+            f'SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM {table_name} '
+            f'UNION ALL SELECT MAX(id) FROM {archive_name})'
+        )).scalar()
+        if highest:
+            conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table_name})
+            conn.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                         {'name': table_name, 'seq': highest})
@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from backend.replicas import RoutingSession
+from backend import passwords
 
 # Initialize SQLAlchemy (this connects your Python code to the database)
-db = SQLAlchemy()
+# The session class can send read-only requests to a replica (see replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     """
@@ -31,12 +33,15 @@ class User(db.Model):
     assigned_tickets = db.relationship('Ticket', backref='assigned_technician', lazy=True, foreign_keys='Ticket.assigned_to')
     
     def set_password(self, password):
-        """Hash the password before storing (security best practice)"""
-        self.password_hash = generate_password_hash(password)
+        """
+        Hash the password before storing (security best practice)
+        Runs on the hashing pool; raises passwords.HashingBusy when it is full
+        """
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        """Verify a password against the stored hash"""
-        return check_password_hash(self.password_hash, password)
+        """Verify a password against the stored hash (also on the hashing pool)"""
+        return passwords.verify_password(self.password_hash, password)
     
     def to_dict(self):
         """Convert user object to dictionary for JSON responses"""
@@ -55,6 +60,22 @@ class Ticket(db.Model):
     """
     __tablename__ = 'tickets'
     
+    # Indexes matching the list/detail/stats access patterns.
+    # Each list index ends in (created_at, id) so the newest-first keyset
+    # pagination in get_tickets can walk the index without sorting.
+    __table_args__ = (
+        db.Index('ix_tickets_created_at_id', 'created_at', 'id'),
+        db.Index('ix_tickets_created_by_created_at', 'created_by', 'created_at', 'id'),
+        db.Index('ix_tickets_assigned_to_created_at', 'assigned_to', 'created_at', 'id'),
+        db.Index('ix_tickets_assigned_to_status_created_at', 'assigned_to', 'status', 'created_at'),
+        db.Index('ix_tickets_status_priority', 'status', 'priority'),
+        db.Index('ix_tickets_priority_created_at', 'priority', 'created_at'),
+        db.Index('ix_tickets_updated_at_id', 'updated_at', 'id'),
+        db.Index('ix_tickets_status_resolved_at', 'status', 'resolved_at'),
+        # Archived tickets keep their ids, so SQLite must never hand one out again
+        {'sqlite_autoincrement': True},
+    )
+    
     # Primary key
     id = db.Column(db.Integer, primary_key=True)
     
@@ -74,12 +95,22 @@ class Ticket(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     resolved_at = db.Column(db.DateTime, nullable=True)
     
+    # Set when the SLA scheduler escalated the ticket for missing its first
+    # response / resolution target (each happens at most once, see sla.py)
+    sla_response_breached_at = db.Column(db.DateTime, nullable=True)
+    sla_resolution_breached_at = db.Column(db.DateTime, nullable=True)
+    
     # Relationship to activity logs
     activities = db.relationship('ActivityLog', backref='ticket', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """Convert ticket object to dictionary for JSON responses"""
-        return {
+    def to_dict(self, include_users=False):
+        """
+        Convert ticket object to dictionary for JSON responses
+        include_users adds the creator's and assignee's usernames - load the
+        ticket with joinedload(Ticket.creator, Ticket.assigned_technician)
+        first, or each ticket costs two extra queries
+        """
+        data = {
             'id': self.id,
             'title': self.title,
             'description': self.description,
@@ -90,8 +121,16 @@ class Ticket(db.Model):
             'assigned_to': self.assigned_to,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
+            'sla_response_breached_at': (self.sla_response_breached_at.isoformat()
+                                         if self.sla_response_breached_at else None),
+            'sla_resolution_breached_at': (self.sla_resolution_breached_at.isoformat()
+                                           if self.sla_resolution_breached_at else None)
         }
+        if include_users:
+            data['created_by_username'] = self.creator.username if self.creator else None
+            data['assigned_to_username'] = self.assigned_technician.username if self.assigned_technician else None
+        return data
 
 
 class ActivityLog(db.Model):
@@ -101,6 +140,13 @@ class ActivityLog(db.Model):
     """
     __tablename__ = 'activity_logs'
     
+    # Activity history is always read per ticket, newest first
+    __table_args__ = (
+        db.Index('ix_activity_logs_ticket_id_created_at', 'ticket_id', 'created_at', 'id'),
+        # Archived activity keeps its ids too (see Ticket)
+        {'sqlite_autoincrement': True},
+    )
+    
     # Primary key
     id = db.Column(db.Integer, primary_key=True)
     
@@ -120,13 +166,256 @@ class ActivityLog(db.Model):
     # Relationship to user
     user = db.relationship('User', backref='activities')
     
-    def to_dict(self):
-        """Convert activity log to dictionary for JSON responses"""
-        return {
+    def to_dict(self, include_user=False):
+        """
+        Convert activity log to dictionary for JSON responses
+        include_user adds the username - load with joinedload(ActivityLog.user)
+        """
+        data = {
             'id': self.id,
             'ticket_id': self.ticket_id,
             'user_id': self.user_id,
             'action': self.action,
             'description': self.description,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+        if include_user:
+            data['username'] = self.user.username if self.user else None
+        return data
+
+class TicketTombstone(db.Model):
+    """
+    Ticket Tombstone model - remembers tickets that left someone's view
+    Written when a ticket is deleted, or when it is reassigned away from a
+    technician, so delta-sync clients know to drop it from their list
+    """
+    __tablename__ = 'ticket_tombstones'
+    
+    __table_args__ = (
+        db.Index('ix_ticket_tombstones_deleted_at_id', 'deleted_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # No foreign key - the ticket row may be gone
+    ticket_id = db.Column(db.Integer, nullable=False)
+    
+    # Who could see the ticket, so tombstones follow the same role rules as tickets
+    created_by = db.Column(db.Integer, nullable=False)
+    assigned_to = db.Column(db.Integer, nullable=True)
+    
+    reason = db.Column(db.String(20), nullable=False, default='deleted')  # deleted, unassigned, archived
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TicketStatCounter(db.Model):
+    """
+    Ticket Stat Counter model - pre-computed ticket counts for the stats endpoint
+    One row per (dimension, key), e.g. ('status', 'open') or ('day', '2025-10-20')
+    Updated in the same transaction as every ticket change, so reading stats
+    never has to scan the tickets table
+    """
+    __tablename__ = 'ticket_stat_counters'
+    
+    # What is being counted (total, status, priority, category, technician, day)
+    dimension = db.Column(db.String(20), primary_key=True)
+    
+    # The value within that dimension, e.g. 'open' or a technician's user id
+    key = db.Column(db.String(50), primary_key=True)
+    
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeCounter(db.Model):
+    """
+    Change Counter model - a version number per scope of ticket data
+    'all' moves on every ticket change and 'user:<id>' on changes to tickets
+    that user created or is assigned to. Bumped in the same transaction as
+    the change, and used to build ETags for the list and stats endpoints
+    (see http_cache.py)
+    """
+    __tablename__ = 'change_counters'
+    
+    scope = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AuditSpoolBatch(db.Model):
+    """
+    Audit Spool Batch model - one row per spool file the buffered audit
+    writer has inserted, written in the same transaction as its activity
+    rows. A spool file found after a crash is only replayed when its id is
+    missing here, so no entry is written twice (see audit.py)
+    """
+    __tablename__ = 'audit_spool_batches'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    flushed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class Job(db.Model):
+    """
+    Job model - one unit of background work (see jobs.py)
+    Enqueued in the same transaction as the change that needs it. While a
+    job is pending, enqueueing another with the same dedup_key updates its
+    payload instead of adding a row. Finished jobs are deleted; jobs out of
+    attempts stay behind as 'failed'.
+    """
+    __tablename__ = 'jobs'
+    
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('uq_jobs_pending_dedup_key', 'dedup_key', unique=True,
+                 sqlite_where=db.text("status = 'pending'"), postgresql_where=db.text("status = 'pending'")),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    dedup_key = db.Column(db.String(200), nullable=True)
+    
+    # pending -> running (claimed by a worker until locked_until) -> deleted,
+    # or back to pending with a later run_at, or failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(32), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AnalyticsLedgerEntry(db.Model):
+    """
+    Analytics Ledger model - what each ticket currently contributes to the
+    analytics rollups (its dimensions, creation day and, once resolved, its
+    resolution day and time). When a ticket changes, its old contribution is
+    subtracted and the new one added (see analytics.py)
+    """
+    __tablename__ = 'analytics_ticket_ledger'
+    
+    # No foreign key - archived tickets keep their entry
+    ticket_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    category = db.Column(db.String(50), nullable=False)
+    priority = db.Column(db.String(20), nullable=False)
+    assigned_to = db.Column(db.Integer, nullable=True)
+    created_day = db.Column(db.Date, nullable=False)
+    resolved_day = db.Column(db.Date, nullable=True)
+    resolve_seconds = db.Column(db.Float, nullable=True)
+
+
+class AnalyticsVolumeDaily(db.Model):
+    """
+    Analytics Volume rollup - tickets opened and resolved per day, for each
+    (dimension, key) such as ('category', 'Hardware') or ('total', 'all')
+    """
+    __tablename__ = 'analytics_volume_daily'
+    
+    dimension = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    key = db.Column(db.String(50), primary_key=True)
+    opened = db.Column(db.Integer, nullable=False, default=0)
+    closed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AnalyticsResolutionDaily(db.Model):
+    """
+    Analytics Resolution rollup - tickets resolved per day and (dimension,
+    key), split into log-scale buckets of time-to-resolve so percentiles can
+    be read across any range of days. seconds is the exact total for the mean
+    """
+    __tablename__ = 'analytics_resolution_daily'
+    
+    dimension = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    key = db.Column(db.String(50), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tickets = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Float, nullable=False, default=0)
+
+
+class AnalyticsWatermark(db.Model):
+    """
+    Analytics Watermark model - how far the rollup job has read
+    One row per source ('tickets' by updated_at, 'tombstones' by deleted_at)
+    """
+    __tablename__ = 'analytics_watermarks'
+    
+    name = db.Column(db.String(20), primary_key=True)
+    mark_at = db.Column(db.DateTime, nullable=False)
+    mark_id = db.Column(db.Integer, nullable=False)
+    refreshed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ArchivedTicket(db.Model):
+    """
+    Archived Ticket model - resolved tickets moved out of the hot table
+    Same columns as Ticket plus archived_at (see archive.py). Read-only:
+    still served by GET /api/tickets/<id> and the exports, but not listed,
+    searched or editable.
+    """
+    __tablename__ = 'tickets_archive'
+    
+    __table_args__ = (
+        db.Index('ix_tickets_archive_created_by', 'created_by', 'id'),
+        db.Index('ix_tickets_archive_assigned_to', 'assigned_to', 'id'),
+    )
+    
+    # Same id the ticket had in the hot table
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    priority = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    
+    # No foreign keys - archived rows outlive the users they mention
+    created_by = db.Column(db.Integer, nullable=False)
+    assigned_to = db.Column(db.Integer, nullable=True)
+    
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+    sla_response_breached_at = db.Column(db.DateTime, nullable=True)
+    sla_resolution_breached_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Same names as on Ticket so Ticket.to_dict works on archived rows
+    creator = db.relationship('User', primaryjoin='foreign(ArchivedTicket.created_by) == User.id', viewonly=True)
+    assigned_technician = db.relationship('User', primaryjoin='foreign(ArchivedTicket.assigned_to) == User.id',
+                                          viewonly=True)
+    
+    def to_dict(self, include_users=False):
+        """Same shape as Ticket.to_dict, plus archived/archived_at"""
+        data = Ticket.to_dict(self, include_users)
+        data['archived'] = True
+        data['archived_at'] = self.archived_at.isoformat()
+        return data
+
+
+class ArchivedActivityLog(db.Model):
+    """
+    Archived Activity Log model - the activity of archived tickets
+    Same columns as ActivityLog plus archived_at
+    """
+    __tablename__ = 'activity_logs_archive'
+    
+    __table_args__ = (
+        db.Index('ix_activity_logs_archive_ticket_id_created_at', 'ticket_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ticket_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    user = db.relationship('User', primaryjoin='foreign(ArchivedActivityLog.user_id) == User.id', viewonly=True)
+    
+    def to_dict(self, include_user=False):
+        """Same shape as ActivityLog.to_dict"""
+        return ActivityLog.to_dict(self, include_user)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import smtplib
+from email.message import EmailMessage
+from flask import current_app
+from sqlalchemy import select
+from backend.models import db, User, Ticket
+from backend import jobs
+
+logger = logging.getLogger(__name__)
+
+TICKET_NOTIFICATION = 'ticket.notify'
+
+# Why a user is being told about a ticket
+ASSIGNED = 'assigned'
+STATUS_CHANGED = 'status'
+
+
+class SmtpMailer:
+    """
+    Sends mail through an SMTP server, one connection per batch
+    A connection or login failure raises, failing the whole batch; a
+    message the server refuses fails only that message
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=False, use_ssl=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+
+    def send_messages(self, messages):
+        """Send EmailMessages; returns {index: error} for those that weren't accepted"""
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        errors = {}
+        with smtp_class(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for index, message in enumerate(messages):
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as e:
+                    errors[index] = f'{type(e).__name__}: {e}'
+        return errors
+
+
+class MemoryMailer:
+    """Keeps sent messages in outbox instead of sending them (tests and local runs)"""
+
+    def __init__(self):
+        self.outbox = []
+
+    def send_messages(self, messages):
+        self.outbox.extend(messages)
+        return {}
+
+
+class LogMailer:
+    """Writes a line per message to the log instead of sending it (development)"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            logger.info('Mail to %s: %s', message['To'], message['Subject'])
+        return {}
+
+
+def create_mailer(config):
+    """The mailer for MAIL_BACKEND ('smtp', 'memory' or 'log')"""
+    backend = config['MAIL_BACKEND']
+    if backend == 'smtp':
+        return SmtpMailer(config['MAIL_SERVER'], config['MAIL_PORT'],
+                          username=config['MAIL_USERNAME'], password=config['MAIL_PASSWORD'],
+                          use_tls=config['MAIL_USE_TLS'], use_ssl=config['MAIL_USE_SSL'],
+                          timeout=config['MAIL_TIMEOUT'])
+    if backend == 'memory':
+        return MemoryMailer()
+    if backend == 'log':
+        return LogMailer()
+    raise RuntimeError("MAIL_BACKEND must be 'smtp', 'memory' or 'log'")
+
+
+def get_mailer():
+    return current_app.extensions['mailer']
+
+
+def notify_ticket_changes(changes, actor_id):
+    """
+    Queue emails about ticket changes, in the caller's transaction
+    changes are (ticket, previous) pairs: ticket a mapping with id,
+    created_by, assigned_to and status after the change, previous the same
+    fields before it (None for a new ticket). A new assignee hears that the
+    ticket is theirs and the creator hears about status changes, unless
+    they made the change themselves. Further changes to the same ticket
+    within NOTIFY_DEDUP_SECONDS fold into the email already queued.
+    """
+    if not current_app.config['NOTIFICATIONS_ENABLED']:
+        return
+
+    queued = {}
+
+    def notify(ticket_id, user_id, reason):
+        if not user_id or user_id == actor_id:
+            return
+        dedup_key = f'{TICKET_NOTIFICATION}:{ticket_id}:{user_id}'
+        # A creator who is also the new assignee gets the one email, about the assignment
+        if dedup_key in queued and queued[dedup_key]['payload']['reason'] == ASSIGNED:
+            return
+        queued[dedup_key] = {
+            'kind': TICKET_NOTIFICATION,
+            'payload': {'ticket_id': ticket_id, 'user_id': user_id, 'reason': reason},
+            'dedup_key': dedup_key,
+        }
+
+    for ticket, previous in changes:
+        if ticket['assigned_to'] != (previous or {}).get('assigned_to'):
+            notify(ticket['id'], ticket['assigned_to'], ASSIGNED)
+        if previous is not None and ticket['status'] != previous['status']:
+            notify(ticket['id'], ticket['created_by'], STATUS_CHANGED)
+
+    jobs.enqueue(list(queued.values()), delay=current_app.config['NOTIFY_DEDUP_SECONDS'])
+
+
+def ticket_message(ticket, user, reason, sender):
+    """The email telling user about ticket, written from its current state"""
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = user.email
+    if reason == ASSIGNED:
+        message['Subject'] = f'[Ticket #{ticket.id}] Assigned to you: {ticket.title}'
+        intro = f'Ticket #{ticket.id} has been assigned to you.'
+    else:
+        message['Subject'] = f'[Ticket #{ticket.id}] Now {ticket.status}: {ticket.title}'
+        intro = f'Your ticket #{ticket.id} is now {ticket.status}.'
+    message.set_content(
+        f'Hi {user.username},\n\n'
+        f'{intro}\n\n'
+        f'Title:    {ticket.title}\n'
+        f'Status:   {ticket.status}\n'
+        f'Priority: {ticket.priority}\n'
+        f'Category: {ticket.category}\n'
+    )
+    return message
+
+
+@jobs.handler(TICKET_NOTIFICATION)
+def send_ticket_notifications(batch):
+    """
+    Send a batch of ticket emails over one mailer connection
+    Tickets and users are loaded in one query each. Nothing is sent for
+    tickets that are gone, users without an address, or an assignment the
+    ticket no longer has.
+    """
+    ticket_ids = {job.payload['ticket_id'] for job in batch}
+    user_ids = {job.payload['user_id'] for job in batch}
+    tickets = {ticket.id: ticket for ticket in db.session.scalars(select(Ticket).where(Ticket.id.in_(ticket_ids)))}
+    users = {user.id: user for user in db.session.scalars(select(User).where(User.id.in_(user_ids)))}
+    db.session.commit()
+
+    sender = current_app.config['MAIL_FROM']
+    sending, messages = [], []
+    for job in batch:
+        ticket = tickets.get(job.payload['ticket_id'])
+        user = users.get(job.payload['user_id'])
+        reason = job.payload['reason']
+        if ticket is None or user is None or not user.email:
+            continue
+        if reason == ASSIGNED and ticket.assigned_to != user.id:
+            continue
+        sending.append(job)
+        messages.append(ticket_message(ticket, user, reason, sender))
+
+    if not messages:
+        return {}
+    errors = get_mailer().send_messages(messages)
+    return {sending[index].id: error for index, error in errors.items()}
+
+
+def init_app(app):
+    """Set up the mailer ticket notifications are sent with"""
+    app.extensions['mailer'] = create_mailer(app.config)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we cannot decode"""
+
+
+def parse_limit(value, default, maximum):
+    """
+    Turn the ?limit= query parameter into a safe page size
+    Falls back to the default and never goes above the maximum
+    """
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    return min(limit, maximum)
+
+
+def parse_page(value):
+    """Turn the ?page= query parameter (1-based, for offset-paged results) into an int"""
+    if value in (None, ''):
+        return 1
+    try:
+        page = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('page must be an integer')
+    if page < 1:
+        raise ValueError('page must be at least 1')
+    return page
+
+
+def encode_token(data):
+    """Pack JSON-serializable data into an opaque, URL-safe token"""
+    payload = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """Reverse of encode_token"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def encode_cursor(created_at, row_id):
+    """
+    Build an opaque cursor from the (created_at, id) of the last row on a page
+    The client just echoes it back to get the next page
+    """
+    return encode_token([created_at.isoformat() if created_at else None, row_id])
+
+
+def decode_cursor(cursor):
+    """Reverse of encode_cursor - returns (created_at, id)"""
+    try:
+        created_at, row_id = decode_token(cursor)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def keyset_condition(created_col, id_col, cursor):
+    """WHERE clause for the rows strictly after a cursor (newest first), or None"""
+    if not cursor:
+        return None
+    created_at, row_id = decode_cursor(cursor)
+    return or_(
+        created_col < created_at,
+        and_(created_col == created_at, id_col < row_id)
+    )
+
+
+def trim_page(rows, limit, created_col, id_col):
+    """Cut the extra look-ahead row off a page; returns (rows, next_cursor)"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
+
+
+def keyset_page(query, created_col, id_col, cursor, limit):
+    """
+    Apply newest-first keyset pagination on (created_at, id) to a query
+    Instead of OFFSET we continue strictly after the last row the client saw,
+    so every page costs the same no matter how deep the client has scrolled
+
+    Returns (rows, next_cursor); next_cursor is None on the last page
+    """
+    condition = keyset_condition(created_col, id_col, cursor)
+    if condition is not None:
+        query = query.filter(condition)
+
+    # Fetch one extra row so we know whether another page exists
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+    return trim_page(rows, limit, created_col, id_col)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context, jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+from backend.metrics import get_registry
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full"""
+
+    def __init__(self, retry_after):
+        super().__init__('Too many password checks in progress')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords on a small worker pool
+    At most `workers` hashes run at once (hashlib's scrypt/pbkdf2 release
+    the GIL, so they use other cores while request threads keep serving),
+    and at most `queue_size` more wait. A caller that can't get a slot within
+    `wait_seconds` gets HashingBusy instead of piling up behind the queue.
+    """
+
+    def __init__(self, method, salt_length, workers, queue_size, wait_seconds, retry_after, on_reject=None):
+        self.method = method
+        self.salt_length = salt_length
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(self._capacity)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._stored_method = None
+        self._on_reject = on_reject
+
+    @property
+    def pending(self):
+        """Hashes running or queued right now"""
+        return self._pending
+
+    def _done(self, future):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _reject(self):
+        if self._on_reject:
+            self._on_reject()
+        return HashingBusy(self.retry_after)
+
+    def _submit(self, function, *args):
+        """Start a job on a slot the caller already holds"""
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            raise self._reject()
+        return self._submit(function, *args).result()
+
+    async def _run_async(self, function, *args):
+        # Poll for a slot rather than block the event loop on the semaphore
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_seconds
+        while not self._slots.acquire(blocking=False):
+            if loop.time() >= deadline:
+                raise self._reject()
+            await asyncio.sleep(0.01)
+        return await asyncio.wrap_future(self._submit(function, *args))
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    async def hash_async(self, password):
+        return await self._run_async(generate_password_hash, password, self.method, self.salt_length)
+
+    async def verify_async(self, password_hash, password):
+        return await self._run_async(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when a stored hash was made with other parameters than the configured ones"""
+        if self._stored_method is None:
+            # werkzeug fills in default parameters ('scrypt' -> 'scrypt:32768:8:1'),
+            # so hash once to see the exact prefix it writes
+            self._stored_method = generate_password_hash('', self.method, 1).split('$', 1)[0]
+        method, _, rest = password_hash.partition('$')
+        salt = rest.partition('$')[0]
+        return method != self._stored_method or len(salt) != self.salt_length
+
+
+def get_hasher():
+    """The app's PasswordHasher, or None outside an app with one"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('password_hasher')
+
+
+def hash_password(password):
+    """Hash with the configured parameters (synchronously outside an app)"""
+    hasher = get_hasher()
+    if hasher is None:
+        return generate_password_hash(password)
+    return hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    hasher = get_hasher()
+    if hasher is None:
+        return check_password_hash(password_hash, password)
+    return hasher.verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    hasher = get_hasher()
+    return hasher is not None and hasher.needs_rehash(password_hash)
+
+
+def busy_response(error):
+    """503 telling the client when to retry"""
+    response = jsonify({'error': 'Too many logins in progress, please retry shortly'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+
+def init_app(app):
+    """Create the hashing pool and report its queue in /api/metrics"""
+    config = app.config
+    registry = get_registry(app)
+    rejected = registry.counter('password_hash_rejected_total', 'Password hashes turned away with a 503')
+    hasher = PasswordHasher(
+        config['PASSWORD_HASH_METHOD'],
+        config['PASSWORD_SALT_LENGTH'],
+        workers=config['PASSWORD_HASH_WORKERS'],
+        queue_size=config['PASSWORD_HASH_QUEUE_SIZE'],
+        wait_seconds=config['PASSWORD_HASH_WAIT_SECONDS'],
+        retry_after=config['PASSWORD_HASH_RETRY_AFTER'],
+        on_reject=rejected.inc,
+    )
+    app.extensions['password_hasher'] = hasher
+    registry.gauge('password_hash_pending', 'Password hashes running or queued').set_function(
+        lambda: hasher.pending)
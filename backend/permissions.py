@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import false
+from backend.models import Ticket
+
+
+def visible_tickets(query, user):
+    """
+    Limit a Ticket query to what this user is allowed to see
+    Regular users see their own tickets, technicians see tickets
+    assigned to them, managers see everything. Any other role (such as
+    'system', the account automatic changes are logged under) sees nothing.
+    """
+    if user.role == 'manager':
+        return query
+    if user.role == 'user':
+        return query.filter(Ticket.created_by == user.id)
+    if user.role == 'technician':
+        return query.filter(Ticket.assigned_to == user.id)
+    return query.filter(false())
+
+
+def can_view_ticket(user, created_by, assigned_to):
+    """Same rules as visible_tickets, for a single ticket we already have"""
+    if user.role == 'manager':
+        return True
+    if user.role == 'user':
+        return created_by == user.id
+    if user.role == 'technician':
+        return assigned_to == user.id
+    return False
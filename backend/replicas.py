@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+
+# Binds named replica_0, replica_1, ... are read replicas of the primary
+REPLICA_BIND_PREFIX = 'replica_'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Key in the (cookie) session holding the time of the client's last write
+LAST_WRITE_KEY = 'last_write_at'
+
+
+def primary_only(view):
+    """Mark a GET endpoint that must always read from the primary"""
+    view.primary_only = True
+    return view
+
+
+class RoutingSession(Session):
+    """
+    Session that sends SELECTs to a read replica while the current request
+    allows it (see init_app). Flushes, INSERT/UPDATE/DELETE and anything
+    outside a request always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() \
+                and g.get('use_replica') and getattr(clause, 'is_select', False):
+            engines = current_app.extensions['replica_engines']
+            if engines:
+                return random.choice(engines)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _recently_wrote(sticky_seconds):
+    last_write = session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < sticky_seconds
+
+
+def init_app(app):
+    """
+    Route read-only blueprint requests to the read replicas, if any
+    A request reads from a replica when it is a GET/HEAD to a blueprint
+    endpoint not marked @primary_only, and the client hasn't written
+    anything in the last REPLICA_STICKY_SECONDS (read-your-writes).
+    """
+    with app.app_context():
+        engines = [engine for key, engine in app.extensions['sqlalchemy'].engines.items()
+                   if key and key.startswith(REPLICA_BIND_PREFIX)]
+    app.extensions['replica_engines'] = engines
+    if not engines:
+        return
+
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.before_request
+    def choose_database():
+        view = current_app.view_functions.get(request.endpoint)
+        g.use_replica = (
+            request.method in SAFE_METHODS
+            and request.blueprint is not None
+            and not getattr(view, 'primary_only', False)
+            and not _recently_wrote(sticky_seconds)
+        )
+
+    @app.after_request
+    def remember_write(response):
+        # Keep this client on the primary until replicas have caught up
+        if request.method not in SAFE_METHODS and response.status_code < 400 and 'user_id' in session:
+            session[LAST_WRITE_KEY] = time.time()
+        return response
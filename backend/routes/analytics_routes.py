@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, date, timedelta
+from flask import Blueprint, request, jsonify, current_app
+from .. import analytics, http_cache
+from .auth_routes import role_required
+
+# Create blueprint for analytics routes
+analytics_bp = Blueprint('analytics', __name__)
+
+
+def _parse_range():
+    """
+    (group_by, since, until) from the query string
+    Defaults to the last ANALYTICS_DEFAULT_DAYS days; raises ValueError
+    """
+    group_by = request.args.get('group_by', 'total')
+    if group_by not in analytics.DIMENSIONS:
+        raise ValueError(f"group_by must be one of: {', '.join(analytics.DIMENSIONS)}")
+
+    try:
+        until = date.fromisoformat(request.args['until']) if request.args.get('until') \
+            else datetime.utcnow().date()
+        since = date.fromisoformat(request.args['since']) if request.args.get('since') \
+            else until - timedelta(days=current_app.config['ANALYTICS_DEFAULT_DAYS'] - 1)
+    except ValueError:
+        raise ValueError('since and until must be dates (YYYY-MM-DD)')
+
+    if since > until:
+        raise ValueError('since must not be after until')
+    if (until - since).days + 1 > current_app.config['ANALYTICS_MAX_DAYS']:
+        raise ValueError(f"At most {current_app.config['ANALYTICS_MAX_DAYS']} days per request")
+    return group_by, since, until
+
+
+def _analytics_response(name, read):
+    """Shared body of the analytics endpoints: parse, 304 or read the rollups"""
+    try:
+        try:
+            group_by, since, until = _parse_range()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # The refresh job bumps the analytics counter whenever it writes rollups
+        etag, last_modified = http_cache.scope_validators(
+            http_cache.ANALYTICS_SCOPE, 'analytics', name, group_by, since, until
+        )
+        cached = http_cache.not_modified(etag, last_modified)
+        if cached:
+            return cached
+
+        ticket_mark = analytics.watermarks().get(analytics.TICKETS_MARK)
+        response = jsonify({
+            'group_by': group_by,
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            # Rollups include ticket changes up to this time
+            'as_of': ticket_mark[0].isoformat() if ticket_mark and ticket_mark[1] else None,
+            name: read(group_by, since, until)
+        })
+        return http_cache.set_validators(response, etag, last_modified), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@analytics_bp.route('/resolution', methods=['GET'])
+@role_required('manager')
+def get_resolution_times():
+    """
+    Time-to-resolve per category, priority or technician (manager only)
+    GET /api/analytics/resolution
+    Query parameters: group_by (total, category, priority, technician),
+                      since, until (YYYY-MM-DD, by resolution day)
+    Returns tickets, mean_seconds, median_seconds and p90_seconds per key,
+    from rollups kept up to date by `flask analytics-refresh`
+    """
+    return _analytics_response('resolution', analytics.read_resolution)
+
+
+@analytics_bp.route('/volume', methods=['GET'])
+@role_required('manager')
+def get_ticket_volume():
+    """
+    Tickets opened and resolved per day (manager only)
+    GET /api/analytics/volume
+    Query parameters: group_by (total, category, priority, technician),
+                      since, until (YYYY-MM-DD)
+    Returns by_day: {day: {key: {opened, closed}}}
+    """
+    return _analytics_response('by_day', analytics.read_volume)
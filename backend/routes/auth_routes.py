@@ -2,6 +2,8 @@
 
 from flask import Blueprint, request, jsonify, session
 from ..models import db, User, ActivityLog
+from .. import passwords, assignment
+from ..current_user import load_current_user
 from functools import wraps
 
 # Create blueprint for authentication routes
@@ -32,7 +34,7 @@ def role_required(required_role):
             if 'user_id' not in session:
                 return jsonify({'error': 'Authentication required'}), 401
             
-            user = User.query.get(session['user_id'])
+            user = load_current_user()
             if not user:
                 return jsonify({'error': 'User not found'}), 404
             
@@ -80,11 +82,17 @@ def register():
         db.session.add(user)
         db.session.commit()
         
+        # New technicians can be auto-assigned tickets straight away
+        assignment.technician_changed(user.id, user.role)
+        
         return jsonify({
             'message': 'User registered successfully',
             'user': user.to_dict()
         }), 201
         
+    except passwords.HashingBusy as e:
+        db.session.rollback()
+        return passwords.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -111,6 +119,11 @@ def login():
         if not user or not user.check_password(data['password']):
             return jsonify({'error': 'Invalid username or password'}), 401
         
+        # Hashed with older PASSWORD_HASH_* settings - upgrade while we have the password
+        if passwords.needs_rehash(user.password_hash):
+            user.set_password(data['password'])
+            db.session.commit()
+        
         # Create session (logs user in)
         session['user_id'] = user.id
         session['username'] = user.username
@@ -121,6 +134,9 @@ def login():
             'user': user.to_dict()
         }), 200
         
+    except passwords.HashingBusy as e:
+        db.session.rollback()
+        return passwords.busy_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -147,7 +163,7 @@ def get_current_user():
     GET /api/auth/me
     """
     try:
-        user = User.query.get(session['user_id'])
+        user = load_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from sqlalchemy import select
+from ..models import db, Ticket, ActivityLog, ArchivedTicket, ArchivedActivityLog
+from ..ticket_filters import apply_ticket_filters, parse_datetime
+from .auth_routes import role_required
+
+# Create blueprint for export routes
+export_bp = Blueprint('export', __name__)
+
+TICKET_COLUMNS = [
+    Ticket.id, Ticket.title, Ticket.description, Ticket.category, Ticket.priority,
+    Ticket.status, Ticket.created_by, Ticket.assigned_to,
+    Ticket.created_at, Ticket.updated_at, Ticket.resolved_at
+]
+
+ACTIVITY_COLUMNS = [
+    ActivityLog.id, ActivityLog.ticket_id, ActivityLog.user_id,
+    ActivityLog.action, ActivityLog.description, ActivityLog.created_at
+]
+
+# The same columns, read from the archive tables
+ARCHIVED_TICKET_COLUMNS = [getattr(ArchivedTicket, column.key) for column in TICKET_COLUMNS]
+ARCHIVED_ACTIVITY_COLUMNS = [getattr(ArchivedActivityLog, column.key) for column in ACTIVITY_COLUMNS]
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _cell(value):
+    """Datetimes as ISO strings, like the JSON API"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _stream_rows(statements, names, fmt):
+    """
+    Yield an export chunk by chunk straight from a server-side cursor
+    Statements are read one after the other (live rows, then archived ones)
+    Only one batch of rows (EXPORT_BATCH_SIZE) is in memory at a time
+    """
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(names)
+
+    for statement in statements:
+        result = db.session.execute(statement.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            for row in partition:
+                if writer:
+                    writer.writerow([_cell(value) for value in row])
+                else:
+                    buffer.write(json.dumps({name: _cell(value) for name, value in zip(names, row)}))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    # Header-only CSV (or nothing) when no rows matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _export_response(statements, columns, name, fmt):
+    names = [column.key for column in columns]
+    filename = f'{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}'
+    return Response(
+        stream_with_context(_stream_rows(statements, names, fmt)),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def _include_archived():
+    return request.args.get('include_archived', 'false').lower() == 'true'
+
+
+def _get_format():
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+    return fmt
+
+
+@export_bp.route('/tickets', methods=['GET'])
+@role_required('manager')
+def export_tickets():
+    """
+    Stream every matching ticket as CSV or NDJSON (manager only)
+    GET /api/export/tickets
+    Query parameters: format (csv | ndjson), status, priority, assigned_to,
+                      category, created_after, created_before,
+                      include_archived (true to add archived tickets after the live ones)
+    """
+    try:
+        sources = [(Ticket, TICKET_COLUMNS)]
+        if _include_archived():
+            sources.append((ArchivedTicket, ARCHIVED_TICKET_COLUMNS))
+
+        statements = []
+        try:
+            fmt = _get_format()
+            for model, columns in sources:
+                query = apply_ticket_filters(db.session.query(*columns), request.args, model)
+                statements.append(query.order_by(model.id).statement)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return _export_response(statements, TICKET_COLUMNS, 'tickets', fmt)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@export_bp.route('/activity_logs', methods=['GET'])
+@role_required('manager')
+def export_activity_logs():
+    """
+    Stream the audit trail as CSV or NDJSON (manager only)
+    GET /api/export/activity_logs
+    Query parameters: format (csv | ndjson), ticket_id, user_id, action,
+                      created_after, created_before,
+                      include_archived (true to add archived activity after the live rows)
+    """
+    try:
+        sources = [(ActivityLog, ACTIVITY_COLUMNS)]
+        if _include_archived():
+            sources.append((ArchivedActivityLog, ARCHIVED_ACTIVITY_COLUMNS))
+
+        statements = []
+        try:
+            fmt = _get_format()
+
+            for model, columns in sources:
+                statement = select(*columns)
+
+                for param, column in (('ticket_id', model.ticket_id),
+                                      ('user_id', model.user_id),
+                                      ('action', model.action)):
+                    value = request.args.get(param)
+                    if value:
+                        statement = statement.where(column == value)
+
+                created_after = request.args.get('created_after')
+                if created_after:
+                    statement = statement.where(model.created_at >= parse_datetime(created_after, 'created_after'))
+
+                created_before = request.args.get('created_before')
+                if created_before:
+                    statement = statement.where(model.created_at < parse_datetime(created_before, 'created_before'))
+
+                statements.append(statement.order_by(model.id))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return _export_response(statements, ACTIVITY_COLUMNS, 'activity_logs', fmt)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, request, jsonify, session
-from ..models import db, Ticket, User, ActivityLog
+from flask import Blueprint, Response, request, jsonify, session, current_app
+from ..models import db, Ticket, User, ActivityLog, ArchivedTicket, ArchivedActivityLog
+from ..pagination import parse_limit, parse_page, keyset_page
+from ..permissions import visible_tickets, can_view_ticket
+from ..ticket_filters import apply_ticket_filters
+from .. import stats, sync, events, bulk, search, assignment, http_cache, audit, notifications
+from ..serialization import ticket_rows_query, activity_rows_query, rows_to_dicts
 from .auth_routes import login_required, role_required
+from ..current_user import load_current_user, system_user_id
+from ..replicas import primary_only
 from functools import wraps
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 
 # Create blueprint for ticket routes
 ticket_bp = Blueprint('tickets', __name__)
@@ -14,80 +22,263 @@ ticket_bp = Blueprint('tickets', __name__)
 @login_required
 def get_tickets():
     """
-    Get all tickets (filtered by user role)
+    Get tickets (filtered by user role), newest first, one page at a time
     GET /api/tickets
-    Query parameters: status, priority, assigned_to
+    Query parameters: status, priority, assigned_to, category,
+                      created_after, created_before,
+                      limit, cursor, include_total, include_users
+    Pass the returned next_cursor back as ?cursor= to get the next page
+    Send If-None-Match with the last ETag to get 304 when nothing changed
     """
     try:
-        user = User.query.get(session['user_id'])
+        user = load_current_user()
         
-        # Start with base query
-        query = Ticket.query
+        # Usernames are joined into the same query rather than loaded per ticket
+        include_users = request.args.get('include_users', '').lower() in ('1', 'true', 'yes')
         
-        # Filter based on user role
-        if user.role == 'user':
-            # Regular users only see their own tickets
-            query = query.filter_by(created_by=user.id)
-        elif user.role == 'technician':
-            # Technicians see tickets assigned to them
-            query = query.filter_by(assigned_to=user.id)
-        # Managers see all tickets (no filter)
+        # 304 straight away if no ticket this user can see (nor, with
+        # include_users, any username) has changed
+        etag, last_modified = http_cache.scopes_validators(http_cache.list_scopes(user, include_users))
+        cached = http_cache.not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        # Start with the tickets this user's role is allowed to see. Plain
+        # column rows, not Ticket objects - much cheaper for long pages
+        query = visible_tickets(ticket_rows_query(include_users), user)
         
         # Apply additional filters from query parameters
-        status = request.args.get('status')
-        if status:
-            query = query.filter_by(status=status)
+        try:
+            query = apply_ticket_filters(query, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            limit = parse_limit(
+                request.args.get('limit'),
+                current_app.config['TICKETS_PAGE_SIZE'],
+                current_app.config['TICKETS_MAX_PAGE_SIZE']
+            )
+            tickets, next_cursor = keyset_page(
+                query, Ticket.created_at, Ticket.id,
+                request.args.get('cursor'), limit
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        priority = request.args.get('priority')
-        if priority:
-            query = query.filter_by(priority=priority)
+        tickets_data = rows_to_dicts(tickets)
         
-        assigned_to = request.args.get('assigned_to')
-        if assigned_to:
-            query = query.filter_by(assigned_to=assigned_to)
+        response = {
+            'tickets': tickets_data,
+            'count': len(tickets_data),
+            'next_cursor': next_cursor
+        }
         
-        # Execute query and convert to list of dictionaries
-        tickets = query.order_by(Ticket.created_at.desc()).all()
-        tickets_data = [ticket.to_dict() for ticket in tickets]
+        # Counting every matching row is expensive, so only do it on request
+        if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+            response['total'] = query.order_by(None).count()
         
-        return jsonify({
-            'tickets': tickets_data,
-            'count': len(tickets_data)
-        }), 200
+        return http_cache.set_validators(jsonify(response), etag, last_modified), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@ticket_bp.route('/changes', methods=['GET'])
+@primary_only
+@login_required
+def get_ticket_changes():
+    """
+    Get only the tickets created, updated or deleted since the last sync
+    GET /api/tickets/changes
+    Query parameters: since (watermark from the previous response,
+                      or 'now' to start tracking from this moment), limit
+    Leave out since for a full initial load. Keep calling with the new
+    watermark while has_more is true. If reset is true the watermark is
+    too old and the client should reload its whole list.
+    Always read from the primary - replica lag could skip changes.
+    """
+    try:
+        user = load_current_user()
+        
+        try:
+            limit = parse_limit(
+                request.args.get('limit'),
+                current_app.config['TICKETS_PAGE_SIZE'],
+                current_app.config['TICKETS_MAX_PAGE_SIZE']
+            )
+            changes = sync.changes_since(user, request.args.get('since'), limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(changes), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@ticket_bp.route('/events', methods=['GET'])
+@login_required
+def stream_ticket_events():
+    """
+    Push ticket changes to the client as Server-Sent Events
+    GET /api/tickets/events
+    Sends ticket.created, ticket.updated, ticket.assigned and ticket.deleted,
+    filtered by role the same way as GET /api/tickets. A 'resync' event means
+    events were dropped; after that or a reconnect, catch up with
+    GET /api/tickets/changes.
+    """
+    user = load_current_user()
+    user_id, role = user.id, user.role
+    
+    bus = events.get_bus()
+    subscription = bus.subscribe(lambda event: events.can_receive(user_id, role, event))
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                elif event is events.OVERFLOW:
+                    yield 'event: resync\ndata: {}\n\n'
+                else:
+                    yield events.format_sse(event)
+        finally:
+            bus.unsubscribe(subscription)
+    
+    # No stream_with_context on purpose: the app context (and its database
+    # connection) is released as soon as this function returns
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def _activity_page(ticket_id, cursor, limit, model=ActivityLog):
+    """One newest-first page of a ticket's activity log, with usernames joined in"""
+    query = activity_rows_query(model, include_user=True).filter(model.ticket_id == ticket_id)
+    activities, next_cursor = keyset_page(query, model.created_at, model.id, cursor, limit)
+    return rows_to_dicts(activities), next_cursor
+
+
+def _activity_limit():
+    return parse_limit(
+        request.args.get('limit'),
+        current_app.config['ACTIVITY_PAGE_SIZE'],
+        current_app.config['ACTIVITY_MAX_PAGE_SIZE']
+    )
+
+
 @ticket_bp.route('/<int:ticket_id>', methods=['GET'])
 @login_required
 def get_ticket(ticket_id):
     """
     Get a specific ticket by ID
     GET /api/tickets/<ticket_id>
+    Query parameters: limit (size of the first activity page)
+    The ticket comes back with creator/assignee usernames and the most
+    recent activity; fetch older activity from activities_next_cursor via
+    GET /api/tickets/<ticket_id>/activities
+    Archived tickets are returned too, with archived: true
+    Conditional requests (If-None-Match / If-Modified-Since) get 304 while
+    the ticket's updated_at hasn't moved
     """
     try:
-        ticket = Ticket.query.get(ticket_id)
+        # Just the permission and validator columns first, so a client with
+        # a current copy gets its 304 without loading the ticket
+        for ticket_model, changed_column in ((Ticket, Ticket.updated_at),
+                                             (ArchivedTicket, ArchivedTicket.archived_at)):
+            head = (
+                db.session.query(ticket_model.created_by, ticket_model.assigned_to,
+                                 changed_column.label('changed_at'))
+                .filter_by(id=ticket_id)
+                .first()
+            )
+            if head:
+                break
         
-        if not ticket:
+        if not head:
             return jsonify({'error': 'Ticket not found'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = load_current_user()
         
         # Check permissions
-        if user.role == 'user' and ticket.created_by != user.id:
+        if not can_view_ticket(user, head.created_by, head.assigned_to):
             return jsonify({'error': 'Access denied'}), 403
         
-        if user.role == 'technician' and ticket.assigned_to != user.id:
+        last_modified = head.changed_at
+        etag = http_cache.make_etag(ticket_model.__tablename__, ticket_id, last_modified.isoformat())
+        cached = http_cache.not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        # Ticket, creator and assignee in a single query
+        ticket = (
+            ticket_model.query
+            .options(joinedload(ticket_model.creator), joinedload(ticket_model.assigned_technician))
+            .filter_by(id=ticket_id)
+            .first()
+        )
+        if not ticket:
+            return jsonify({'error': 'Ticket not found'}), 404
+        
+        try:
+            activity_model = ArchivedActivityLog if isinstance(ticket, ArchivedTicket) else ActivityLog
+            activities_data, next_cursor = _activity_page(ticket_id, None, _activity_limit(), activity_model)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        response = jsonify({
+            'ticket': ticket.to_dict(include_users=True),
+            'activities': activities_data,
+            'activities_next_cursor': next_cursor
+        })
+        return http_cache.set_validators(response, etag, last_modified), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@ticket_bp.route('/<int:ticket_id>/activities', methods=['GET'])
+@login_required
+def get_ticket_activities(ticket_id):
+    """
+    Get a ticket's activity history, newest first, one page at a time
+    GET /api/tickets/<ticket_id>/activities
+    Query parameters: limit, cursor
+    """
+    try:
+        # Only the columns the permission check needs
+        activity_model = ActivityLog
+        owner = db.session.query(Ticket.created_by, Ticket.assigned_to).filter_by(id=ticket_id).first()
+        if not owner:
+            activity_model = ArchivedActivityLog
+            owner = (
+                db.session.query(ArchivedTicket.created_by, ArchivedTicket.assigned_to)
+                .filter_by(id=ticket_id)
+                .first()
+            )
+        
+        if not owner:
+            return jsonify({'error': 'Ticket not found'}), 404
+        
+        if not can_view_ticket(load_current_user(), owner.created_by, owner.assigned_to):
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get activity logs for this ticket
-        activities = ActivityLog.query.filter_by(ticket_id=ticket_id).order_by(ActivityLog.created_at.desc()).all()
-        activities_data = [activity.to_dict() for activity in activities]
+        try:
+            activities_data, next_cursor = _activity_page(
+                ticket_id, request.args.get('cursor'), _activity_limit(), activity_model
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'ticket': ticket.to_dict(),
-            'activities': activities_data
+            'activities': activities_data,
+            'count': len(activities_data),
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -101,6 +292,7 @@ def create_ticket():
     Create a new ticket
     POST /api/tickets
     Expected JSON: {title, description, category, priority}
+    The ticket is assigned to a technician when AUTO_ASSIGN_ENABLED is on
     """
     try:
         data = request.get_json()
@@ -120,23 +312,46 @@ def create_ticket():
             created_by=session['user_id']
         )
         
+        # Pick a technician (no-op when auto-assignment is off). The
+        # assignment is logged under the system account, not the creator
+        assigned_to = assignment.auto_assign(ticket)
+        assigner_id = system_user_id() if assigned_to else None
+        
         db.session.add(ticket)
         db.session.flush()  # Get ticket ID before committing
         
         # Create activity log
-        activity = ActivityLog(
-            ticket_id=ticket.id,
-            user_id=session['user_id'],
-            action='created',
-            description=f'Ticket created: {ticket.title}'
-        )
-        db.session.add(activity)
+        activities = [{
+            'ticket_id': ticket.id,
+            'user_id': session['user_id'],
+            'action': 'created',
+            'description': f'Ticket created: {ticket.title}'
+        }]
+        if assigned_to:
+            activities.append({
+                'ticket_id': ticket.id,
+                'user_id': assigner_id,
+                'action': 'updated',
+                'description': f'Automatically assigned to user {assigned_to}'
+            })
+        audit.log_activities(activities)
+        
+        # Keep the stats counters and search index in step with this ticket
+        stats.record_created(ticket)
+        http_cache.touch(ticket.created_by, ticket.assigned_to)
+        search.index_tickets([ticket])
+        
+        # Tell the technician it was assigned to (sent by the job workers)
+        ticket_data = ticket.to_dict()
+        notifications.notify_ticket_changes([(ticket_data, None)], session['user_id'])
         
         db.session.commit()
         
+        events.publish(events.TICKET_CREATED, ticket_data)
+        
         return jsonify({
             'message': 'Ticket created successfully',
-            'ticket': ticket.to_dict()
+            'ticket': ticket_data
         }), 201
         
     except Exception as e:
@@ -153,14 +368,22 @@ def update_ticket(ticket_id):
     Expected JSON: {status, priority, assigned_to, etc.}
     """
     try:
-        ticket = Ticket.query.get(ticket_id)
+        ticket = db.session.get(Ticket, ticket_id)
         
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = load_current_user()
         data = request.get_json()
         
+        # Remember which stats counters the ticket was in before the update
+        stat_keys_before = stats.ticket_stat_keys(ticket)
+        previous = {
+            'status': ticket.status,
+            'priority': ticket.priority,
+            'assigned_to': ticket.assigned_to
+        }
+        
         # Track changes for activity log
         changes = []
         
@@ -191,6 +414,10 @@ def update_ticket(ticket_id):
             old_assigned = ticket.assigned_to
             ticket.assigned_to = data['assigned_to']
             
+            # Tell the previous technician's dashboard to drop this ticket
+            if old_assigned and old_assigned != ticket.assigned_to:
+                sync.record_unassigned(ticket, old_assigned)
+            
             if old_assigned:
                 changes.append(f'Reassigned from user {old_assigned} to user {data["assigned_to"]}')
             else:
@@ -199,20 +426,32 @@ def update_ticket(ticket_id):
         ticket.updated_at = datetime.utcnow()
         
         # Create activity log for each change
-        for change in changes:
-            activity = ActivityLog(
-                ticket_id=ticket.id,
-                user_id=session['user_id'],
-                action='updated',
-                description=change
-            )
-            db.session.add(activity)
+        db.session.flush()
+        audit.log_activities([{
+            'ticket_id': ticket.id,
+            'user_id': session['user_id'],
+            'action': 'updated',
+            'description': change
+        } for change in changes])
+        
+        stats.record_changed(stat_keys_before, ticket)
+        http_cache.touch(ticket.created_by, previous['assigned_to'], ticket.assigned_to)
+        if 'title' in data or 'description' in data:
+            search.index_tickets([ticket])
+        
+        # Queue emails to a new assignee and, on status changes, the creator
+        ticket_data = ticket.to_dict()
+        notifications.notify_ticket_changes([(ticket_data, previous)], session['user_id'])
         
         db.session.commit()
         
+        events.publish(events.TICKET_UPDATED, ticket_data, previous)
+        if ticket.assigned_to != previous['assigned_to']:
+            events.publish(events.TICKET_ASSIGNED, ticket_data, previous)
+        
         return jsonify({
             'message': 'Ticket updated successfully',
-            'ticket': ticket.to_dict()
+            'ticket': ticket_data
         }), 200
         
     except Exception as e:
@@ -228,14 +467,21 @@ def delete_ticket(ticket_id):
     DELETE /api/tickets/<ticket_id>
     """
     try:
-        ticket = Ticket.query.get(ticket_id)
+        ticket = db.session.get(Ticket, ticket_id)
         
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
+        stats.record_deleted(ticket)
+        sync.record_deleted(ticket)
+        http_cache.touch(ticket.created_by, ticket.assigned_to)
+        search.remove_tickets([ticket.id])
+        ticket_data = ticket.to_dict()
         db.session.delete(ticket)
         db.session.commit()
         
+        events.publish(events.TICKET_DELETED, ticket_data)
+        
         return jsonify({'message': 'Ticket deleted successfully'}), 200
         
     except Exception as e:
@@ -243,34 +489,129 @@ def delete_ticket(ticket_id):
         return jsonify({'error': str(e)}), 500
 
 
+@ticket_bp.route('/search', methods=['GET'])
+@login_required
+def search_tickets():
+    """
+    Full-text search over ticket titles, descriptions and activity history
+    GET /api/tickets/search
+    Query parameters: q, limit, page
+    Results are ranked best match first and follow the same role rules
+    as GET /api/tickets
+    """
+    try:
+        q = request.args.get('q', '').strip()
+        if not q:
+            return jsonify({'error': 'q is required'}), 400
+        
+        if not search.is_enabled():
+            return jsonify({'error': 'Search is not available on this database'}), 501
+        
+        try:
+            limit = parse_limit(
+                request.args.get('limit'),
+                current_app.config['TICKETS_PAGE_SIZE'],
+                current_app.config['TICKETS_MAX_PAGE_SIZE']
+            )
+            page = parse_page(request.args.get('page'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Ranked results are paged by offset, so cap how deep a client can go
+        offset = (page - 1) * limit
+        if offset >= current_app.config['SEARCH_MAX_RESULTS']:
+            return jsonify({'error': 'Refine your search to see more results'}), 400
+        
+        hits = search.search_tickets(load_current_user(), q, limit + 1, offset)
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        
+        # Load the matching tickets in one query and keep the ranking order.
+        # A ticket deleted or archived since the ranking query is left out
+        tickets = {t.id: t for t in Ticket.query.filter(Ticket.id.in_([hit[0] for hit in hits]))}
+        results = []
+        for ticket_id, score in hits:
+            if ticket_id not in tickets:
+                continue
+            ticket_data = tickets[ticket_id].to_dict()
+            ticket_data['score'] = score
+            results.append(ticket_data)
+        
+        return jsonify({
+            'tickets': results,
+            'count': len(results),
+            'page': page,
+            'has_more': has_more
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@ticket_bp.route('/bulk', methods=['POST'])
+@login_required
+def bulk_tickets():
+    """
+    Update or delete many tickets at once
+    POST /api/tickets/bulk
+    Expected JSON: {action: 'update' | 'delete',
+                    ticket_ids: [...] or filter: {status, priority, ...},
+                    changes: {status, priority, assigned_to}}  (update only)
+    The same role rules as single-ticket updates and deletes apply to every
+    ticket; the response reports what happened to each one
+    """
+    try:
+        data = request.get_json() or {}
+        user = load_current_user()
+        
+        action = data.get('action')
+        if action not in ('update', 'delete'):
+            return jsonify({'error': "action must be 'update' or 'delete'"}), 400
+        
+        try:
+            ticket_ids = bulk.resolve_ticket_ids(user, data)
+            if action == 'update':
+                result = bulk.bulk_update(user, ticket_ids, data.get('changes'))
+            else:
+                result = bulk.bulk_delete(user, ticket_ids)
+        except bulk.BulkError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), e.status_code
+        
+        result['action'] = action
+        return jsonify(result), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @ticket_bp.route('/stats', methods=['GET'])
 @role_required('manager')
 def get_ticket_stats():
     """
     Get ticket statistics (manager only)
     GET /api/tickets/stats
+    Query parameters: days (how far back the per-day breakdown goes, default 30)
+    Served from counters kept up to date on every ticket change,
+    so this never scans the tickets table; supports If-None-Match
     """
     try:
-        total_tickets = Ticket.query.count()
-        open_tickets = Ticket.query.filter_by(status='open').count()
-        in_progress_tickets = Ticket.query.filter_by(status='in_progress').count()
-        resolved_tickets = Ticket.query.filter_by(status='resolved').count()
-        closed_tickets = Ticket.query.filter_by(status='closed').count()
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            return jsonify({'error': 'days must be an integer'}), 400
+        days = max(1, min(days, 366))
+        
+        # The per-day window also moves at midnight, not just on ticket changes
+        etag, last_modified = http_cache.scope_validators(
+            http_cache.ALL_SCOPE, 'stats', days, datetime.utcnow().date()
+        )
+        cached = http_cache.not_modified(etag, last_modified)
+        if cached:
+            return cached
         
-        high_priority = Ticket.query.filter_by(priority='high').count()
-        critical_priority = Ticket.query.filter_by(priority='critical').count()
-        
-        return jsonify({
-            'total_tickets': total_tickets,
-            'by_status': {
-                'open': open_tickets,
-                'in_progress': in_progress_tickets,
-                'resolved': resolved_tickets,
-                'closed': closed_tickets
-            },
-            'high_priority_tickets': high_priority,
-            'critical_tickets': critical_priority
-        }), 200
+        return http_cache.set_validators(jsonify(stats.read_stats(days)), etag, last_modified), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
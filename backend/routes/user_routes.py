@@ -1,58 +1,36 @@
 # -*- coding: utf-8 -*-
 
+from datetime import datetime
 from flask import Blueprint, request, jsonify, session
 from ..models import db, User
+from .. import assignment, http_cache, passwords, stats, sync, events, audit
+from ..serialization import user_rows_query, rows_to_dicts
 from .auth_routes import login_required, role_required
+from ..current_user import load_current_user
 from functools import wraps
 
 # Create blueprint for authentication users
 user_bp = Blueprint('users', __name__)
 
-def login_required(f):
+@user_bp.route('/<int:user_id>', methods=['PUT'])
+@login_required
+def update_user(user_id):
     """
-    Decorator to protect routes that require authentication
-    Checks if user is logged in before allowing access
-    """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': 'Authentication required'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
-
-
-def role_required(required_role):
-    """
-    Decorator to protect routes that require specific roles
-    Checks if user has the necessary permissions
-    """
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                return jsonify({'error': 'Authentication required'}), 401
-            
-            user = User.query.get(session['user_id'])
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
-            
-            if user.role != required_role and user.role != 'manager':
-                return jsonify({'error': 'Insufficient permissions'}), 403
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
-
-@user_bp.route('/register', methods=['POST'])
-def register():
-    """
-    Register a new user
-    POST /api/auth/register
-    Expected JSON: {username, email, password, role}
+    Update a user (your own account, or any account as a manager)
+    PUT /api/users/<user_id>
+    Expected JSON: {email, role, password} (all optional, role for managers only)
     """
     try:
         data = request.get_json()
+        current_user = load_current_user()
+        
+        if current_user is None or (current_user.id != user_id and current_user.role != 'manager'):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        user = db.session.get(User, user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
         # Update email if provided
         if 'email' in data:
@@ -63,7 +41,9 @@ def register():
             user.email = data['email']
         
         # Only managers can change roles
+        role_changed = False
         if 'role' in data and current_user.role == 'manager':
+            role_changed = data['role'] != user.role
             user.role = data['role']
         
         # Update password if provided
@@ -72,11 +52,18 @@ def register():
         
         db.session.commit()
         
+        # Add a new technician to the auto-assignment pool, or drop a former one
+        if role_changed:
+            assignment.technician_changed(user.id, user.role)
+        
         return jsonify({
             'message': 'User updated successfully',
             'user': user.to_dict()
         }), 200
         
+    except passwords.HashingBusy as e:
+        db.session.rollback()
+        return passwords.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -88,9 +75,11 @@ def delete_user(user_id):
     """
     Delete a user (manager only)
     DELETE /api/users/<user_id>
+    Tickets assigned to the user go back to unassigned, the same way a
+    manager unassigning them would
     """
     try:
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -99,9 +88,39 @@ def delete_user(user_id):
         if user.id == session['user_id']:
             return jsonify({'error': 'Cannot delete your own account'}), 400
         
+        # Unassign their tickets through the counters and tombstones rather
+        # than letting the ORM null assigned_to behind their backs
+        now = datetime.utcnow()
+        unassigned = []
+        for ticket in user.assigned_tickets:
+            stat_keys_before = stats.ticket_stat_keys(ticket)
+            previous = {'status': ticket.status, 'priority': ticket.priority, 'assigned_to': user.id}
+            ticket.assigned_to = None
+            ticket.updated_at = now
+            sync.record_unassigned(ticket, user.id)
+            stats.record_changed(stat_keys_before, ticket)
+            http_cache.touch(ticket.created_by)
+            unassigned.append((ticket, previous))
+        db.session.flush()
+        audit.log_activities([{
+            'ticket_id': ticket.id,
+            'user_id': session['user_id'],
+            'action': 'updated',
+            'description': f'Unassigned: user {user_id} was deleted'
+        } for ticket, _ in unassigned])
+        
         db.session.delete(user)
+        # Their username disappears from ticket lists
+        http_cache.touch(user_id)
+        http_cache.touch_users()
         db.session.commit()
         
+        for ticket, previous in unassigned:
+            events.publish(events.TICKET_UPDATED, ticket.to_dict(), previous)
+        
+        # Stop auto-assigning tickets to a deleted technician
+        assignment.technician_changed(user_id, None)
+        
         return jsonify({'message': 'User deleted successfully'}), 200
         
     except Exception as e:
@@ -117,8 +136,8 @@ def get_technicians():
     GET /api/users/technicians
     """
     try:
-        technicians = User.query.filter_by(role='technician').all()
-        technicians_data = [user.to_dict() for user in technicians]
+        technicians = user_rows_query().filter(User.role == 'technician').all()
+        technicians_data = rows_to_dicts(technicians)
         
         return jsonify({
             'technicians': technicians_data,
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import re
+import click
+from flask import current_app
+from sqlalchemy import text, inspect, bindparam
+from sqlalchemy.exc import OperationalError
+from backend.models import db, Ticket
+
+# Full-text search over ticket titles/descriptions and activity log text.
+#
+# SQLite (development) uses two FTS5 tables whose rowids are the ticket and
+# activity ids. PostgreSQL (production) uses plain tables holding a tsvector
+# per ticket/activity with GIN indexes. Both are kept in sync by the routes
+# in the same transaction as the change itself.
+
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search USING fts5("
+    "title, description, tokenize='porter unicode61')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS activity_search USING fts5("
+    "description, ticket_id UNINDEXED, tokenize='porter unicode61')",
+]
+
+POSTGRES_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS ticket_search ("
+    "ticket_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_ticket_search_document ON ticket_search USING GIN (document)",
+    "CREATE TABLE IF NOT EXISTS activity_search ("
+    "activity_id INTEGER PRIMARY KEY, ticket_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_activity_search_document ON activity_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_activity_search_ticket_id ON activity_search (ticket_id)",
+]
+
+
+def _postgres_ticket_document(title, description):
+    """tsvector expression for a ticket; title matches count for more than description"""
+    return (f"setweight(to_tsvector('english', coalesce({title}, '')), 'A') || "
+            f"setweight(to_tsvector('english', coalesce({description}, '')), 'B')")
+
+
+def _dialect(bind=None):
+    bind = bind or db.session.get_bind(mapper=Ticket)
+    return bind.dialect.name
+
+
+def is_enabled():
+    """True when the search tables exist on this database (checked once per app)"""
+    enabled = current_app.extensions.get('search_enabled')
+    if enabled is None:
+        conn = db.session.connection()
+        enabled = _dialect(conn) in ('sqlite', 'postgresql') and inspect(conn).has_table('ticket_search')
+        current_app.extensions['search_enabled'] = enabled
+    return enabled
+
+
+def create_schema(conn):
+    """
+    Create the search tables for this database, if the engine supports it
+    Returns False (and creates nothing) on databases without full-text support
+    """
+    dialect = _dialect(conn)
+    if dialect == 'sqlite':
+        statements = SQLITE_SCHEMA
+    elif dialect == 'postgresql':
+        statements = POSTGRES_SCHEMA
+    else:
+        return False
+    try:
+        for statement in statements:
+            conn.execute(text(statement))
+    except OperationalError:
+        # SQLite built without the FTS5 extension
+        if dialect != 'sqlite':
+            raise
+        return False
+    return True
+
+
+# -- keeping the index in sync ---------------------------------------------
+
+def index_tickets(tickets):
+    """(Re)index ticket title/description; tickets are objects or dicts with id/title/description"""
+    rows = [
+        {'id': t['id'], 'title': t['title'], 'description': t['description']} if isinstance(t, dict)
+        else {'id': t.id, 'title': t.title, 'description': t.description}
+        for t in tickets
+    ]
+    if not rows or not is_enabled():
+        return
+    if _dialect() == 'sqlite':
+        db.session.execute(text('DELETE FROM ticket_search WHERE rowid = :id'), rows)
+        db.session.execute(text(
+            'INSERT INTO ticket_search (rowid, title, description) VALUES (:id, :title, :description)'
+        ), rows)
+    else:
+        db.session.execute(text(
+            'INSERT INTO ticket_search (ticket_id, document) '
+            f"VALUES (:id, {_postgres_ticket_document(':title', ':description')}) "
+            'ON CONFLICT (ticket_id) DO UPDATE SET document = EXCLUDED.document'
+        ), rows)
+
+
+def index_activities(activities):
+    """Index new activity log entries; objects or dicts with id/ticket_id/description"""
+    rows = [
+        {'id': a['id'], 'ticket_id': a['ticket_id'], 'description': a['description']} if isinstance(a, dict)
+        else {'id': a.id, 'ticket_id': a.ticket_id, 'description': a.description}
+        for a in activities
+    ]
+    if not rows or not is_enabled():
+        return
+    if _dialect() == 'sqlite':
+        db.session.execute(text(
+            'INSERT INTO activity_search (rowid, description, ticket_id) VALUES (:id, :description, :ticket_id)'
+        ), rows)
+    else:
+        db.session.execute(text(
+            'INSERT INTO activity_search (activity_id, ticket_id, document) '
+            "VALUES (:id, :ticket_id, to_tsvector('english', :description)) "
+            'ON CONFLICT (activity_id) DO NOTHING'
+        ), rows)
+
+
+def remove_tickets(ticket_ids):
+    """
+    Drop tickets and their activity entries from the index
+    Call before the activity_logs rows are deleted
+    """
+    if not ticket_ids or not is_enabled():
+        return
+    params = {'ids': list(ticket_ids)}
+    if _dialect() == 'sqlite':
+        db.session.execute(text(
+            'DELETE FROM activity_search WHERE rowid IN '
+            '(SELECT id FROM activity_logs WHERE ticket_id IN :ids)'
+        ).bindparams(bindparam('ids', expanding=True)), params)
+        db.session.execute(text(
+            'DELETE FROM ticket_search WHERE rowid IN :ids'
+        ).bindparams(bindparam('ids', expanding=True)), params)
+    else:
+        db.session.execute(text(
+            'DELETE FROM activity_search WHERE ticket_id IN :ids'
+        ).bindparams(bindparam('ids', expanding=True)), params)
+        db.session.execute(text(
+            'DELETE FROM ticket_search WHERE ticket_id IN :ids'
+        ).bindparams(bindparam('ids', expanding=True)), params)
+
+
+def reindex(conn):
+    """Rebuild the whole index from tickets and activity_logs with set-based inserts"""
+    if not create_schema(conn):
+        return False
+    conn.execute(text('DELETE FROM ticket_search'))
+    conn.execute(text('DELETE FROM activity_search'))
+    if _dialect(conn) == 'sqlite':
+        conn.execute(text(
+            'INSERT INTO ticket_search (rowid, title, description) '
+            'SELECT id, title, description FROM tickets'
+        ))
+        conn.execute(text(
+            'INSERT INTO activity_search (rowid, description, ticket_id) '
+            'SELECT id, description, ticket_id FROM activity_logs'
+        ))
+    else:
+        conn.execute(text(
+            'INSERT INTO ticket_search (ticket_id, document) '
+            f"SELECT id, {_postgres_ticket_document('title', 'description')} FROM tickets"
+        ))
+        conn.execute(text(
+            'INSERT INTO activity_search (activity_id, ticket_id, document) '
+            "SELECT id, ticket_id, to_tsvector('english', description) FROM activity_logs"
+        ))
+    return True
+
+
+# -- querying ----------------------------------------------------------------
+
+def _visibility_clause(user):
+    """SQL fragment with the same role rules as permissions.visible_tickets"""
+    if user.role == 'manager':
+        return ''
+    if user.role == 'user':
+        return 'AND t.created_by = :user_id'
+    if user.role == 'technician':
+        return 'AND t.assigned_to = :user_id'
+    return 'AND 1 = 0'
+
+
+def _sqlite_match(query):
+    """
+    Turn free text into a safe FTS5 query: every word must appear,
+    the last one as a prefix so results show up while typing
+    """
+    terms = TERM_PATTERN.findall(query)
+    if not terms:
+        return None
+    quoted = ['"{}"'.format(term) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_tickets(user, query, limit, offset):
+    """
+    Ranked ticket ids matching the query in title, description or activity,
+    restricted to tickets the user can see. Returns [(ticket_id, score)],
+    best match first; higher scores are better.
+    """
+    params = {'user_id': user.id, 'limit': limit, 'offset': offset}
+    visibility = _visibility_clause(user)
+
+    if _dialect() == 'sqlite':
+        match = _sqlite_match(query)
+        if match is None:
+            return []
+        params['match'] = match
+        # bm25() is lower-is-better; a ticket's best hit in any source wins
+        sql = f'''
+            SELECT t.id AS ticket_id, -MIN(h.score) AS score
+            FROM (
+                SELECT rowid AS ticket_id, bm25(ticket_search, 10.0, 1.0) AS score
+                FROM ticket_search WHERE ticket_search MATCH :match
+                UNION ALL
+                SELECT CAST(ticket_id AS INTEGER), bm25(activity_search) * 0.5
+                FROM activity_search WHERE activity_search MATCH :match
+            ) AS h
+            JOIN tickets AS t ON t.id = h.ticket_id
+            WHERE 1 = 1 {visibility}
+            GROUP BY t.id
+            ORDER BY score DESC, t.id DESC
+            LIMIT :limit OFFSET :offset
+        '''
+    else:
+        params['query'] = query
+        sql = f'''
+            WITH q AS (SELECT websearch_to_tsquery('english', :query) AS query)
+            SELECT t.id AS ticket_id, MAX(h.score) AS score
+            FROM (
+                SELECT s.ticket_id, ts_rank(s.document, q.query) AS score
+                FROM ticket_search AS s, q WHERE s.document @@ q.query
+                UNION ALL
+                SELECT a.ticket_id, ts_rank(a.document, q.query) * 0.5
+                FROM activity_search AS a, q WHERE a.document @@ q.query
+            ) AS h
+            JOIN tickets AS t ON t.id = h.ticket_id
+            WHERE 1 = 1 {visibility}
+            GROUP BY t.id
+            ORDER BY score DESC, t.id DESC
+            LIMIT :limit OFFSET :offset
+        '''
+
+    return [(row.ticket_id, row.score) for row in db.session.execute(text(sql), params)]
+
+
+def register_commands(app):
+    """Add `flask search-reindex` to the app's CLI"""
+
+    @app.cli.command('search-reindex')
+    def search_reindex_command():
+        """Rebuild the full-text search index from scratch"""
+        with db.engine.begin() as conn:
+            if reindex(conn):
+                click.echo('Search index rebuilt')
+            else:
+                click.echo('This database has no full-text search support')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from backend.models import db, User, Ticket, ActivityLog
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns behind Ticket/ActivityLog/User.to_dict(), in the same order and
+# under the same names, for list endpoints that skip building ORM objects
+TICKET_FIELDS = (
+    Ticket.id, Ticket.title, Ticket.description, Ticket.category, Ticket.priority,
+    Ticket.status, Ticket.created_by, Ticket.assigned_to,
+    Ticket.created_at, Ticket.updated_at, Ticket.resolved_at,
+    Ticket.sla_response_breached_at, Ticket.sla_resolution_breached_at
+)
+
+ACTIVITY_FIELDS = ('id', 'ticket_id', 'user_id', 'action', 'description', 'created_at')
+
+USER_FIELDS = (User.id, User.username, User.email, User.role, User.created_at)
+
+
+def _default(o):
+    """Dates as ISO 8601 (what to_dict() produces), anything else as Flask does"""
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's json-module provider, but datetimes come out as ISO 8601"""
+
+    default = staticmethod(_default)
+
+
+class OrjsonJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson (pip install orjson)
+    Output matches StdlibJSONProvider: sorted keys, naive datetimes in
+    isoformat(). Calls with extra json.dumps arguments go to the stdlib.
+    """
+
+    def _options(self, pretty=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=_default, option=self._options(pretty))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+# Providers selectable with JSON_PROVIDER ('auto' picks orjson when installed)
+PROVIDERS = {
+    'stdlib': StdlibJSONProvider,
+    'orjson': OrjsonJSONProvider,
+}
+
+
+def init_app(app):
+    """Install the JSON provider chosen by JSON_PROVIDER"""
+    name = app.config['JSON_PROVIDER']
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name not in PROVIDERS:
+        raise ValueError(f'Unknown JSON_PROVIDER {name!r}, expected auto or one of {", ".join(PROVIDERS)}')
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER=orjson needs the orjson package (pip install orjson)')
+    app.json = PROVIDERS[name](app)
+
+
+def _with_usernames(query):
+    """Join in created_by_username/assigned_to_username (a Query or a select())"""
+    creator, assignee = aliased(User), aliased(User)
+    return (
+        query.add_columns(creator.username.label('created_by_username'),
+                          assignee.username.label('assigned_to_username'))
+        .outerjoin(creator, creator.id == Ticket.created_by)
+        .outerjoin(assignee, assignee.id == Ticket.assigned_to)
+    )
+
+
+def _with_username(query, model):
+    return query.add_columns(User.username).outerjoin(User, User.id == model.user_id)
+
+
+def ticket_rows_query(include_users=False):
+    """
+    Query for list endpoints returning plain rows with the to_dict() columns
+    Rows skip ORM object loading; turn them into dicts with rows_to_dicts.
+    include_users joins in created_by_username/assigned_to_username.
+    """
+    query = db.session.query(*TICKET_FIELDS)
+    return _with_usernames(query) if include_users else query
+
+
+def ticket_rows_select(include_users=False):
+    """ticket_rows_query as a select(), for the async database engine"""
+    statement = select(*TICKET_FIELDS)
+    return _with_usernames(statement) if include_users else statement
+
+
+def activity_rows_query(model=ActivityLog, include_user=False):
+    """Like ticket_rows_query for activity logs (model can be ArchivedActivityLog)"""
+    query = db.session.query(*[getattr(model, name) for name in ACTIVITY_FIELDS])
+    return _with_username(query, model) if include_user else query
+
+
+def activity_rows_select(model=ActivityLog, include_user=False):
+    statement = select(*[getattr(model, name) for name in ACTIVITY_FIELDS])
+    return _with_username(statement, model) if include_user else statement
+
+
+def user_rows_query():
+    return db.session.query(*USER_FIELDS)
+
+
+def rows_to_dicts(rows):
+    """
+    Rows from the *_rows_query helpers as dicts shaped like to_dict()
+    Datetimes are left for the JSON provider to format
+    """
+    if not rows:
+        return []
+    # Row._asdict() works out the keys again for every row
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
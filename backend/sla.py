@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, update, insert, or_, and_
+from backend.models import db, Ticket, TicketTombstone
+from backend import stats, events, assignment, http_cache, notifications, audit
+from backend.current_user import system_user_id
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ORDER = ('low', 'medium', 'high', 'critical')
+
+# Tickets still on the clock; the response target only applies while 'open'
+OPEN_STATUSES = ('open', 'in_progress')
+
+RESPONSE = 'response'
+RESOLUTION = 'resolution'
+
+# What the scheduler needs to know about a ticket to compute its due times
+_TRACKED_COLUMNS = (
+    Ticket.id, Ticket.priority, Ticket.status, Ticket.created_at,
+    Ticket.sla_response_breached_at, Ticket.sla_resolution_breached_at,
+)
+
+
+def next_priority(priority):
+    """One step up, staying at critical"""
+    if priority not in PRIORITY_ORDER:
+        return priority
+    return PRIORITY_ORDER[min(PRIORITY_ORDER.index(priority) + 1, len(PRIORITY_ORDER) - 1)]
+
+
+def due_times(targets, priority, status, created_at, response_breached=False, resolution_breached=False):
+    """(kind, due_at) for each SLA target a ticket can still miss"""
+    target = targets.get(priority)
+    if not target or status not in OPEN_STATUSES or created_at is None:
+        return []
+    due = []
+    if status == 'open' and not response_breached:
+        due.append((RESPONSE, created_at + timedelta(minutes=target['response'])))
+    if not resolution_breached:
+        due.append((RESOLUTION, created_at + timedelta(minutes=target['resolution'])))
+    return due
+
+
+def _after(mark):
+    """Tickets changed strictly after an (updated_at, id) mark"""
+    timestamp, ticket_id = mark
+    return or_(Ticket.updated_at > timestamp, and_(Ticket.updated_at == timestamp, Ticket.id > ticket_id))
+
+
+class SlaScheduler:
+    """
+    Escalates tickets that miss their response or resolution target
+
+    Due times live in a min-heap of (due_at, ticket_id, kind), filled once
+    from the open tickets and then from ticket changes read in batches off
+    the (updated_at, id) index. Each tick pops at most SLA_BATCH_SIZE due
+    entries, so the work per tick doesn't grow with the number of open
+    tickets. Heap entries for tickets that have changed since are skipped
+    when popped, and every escalation is a conditional UPDATE, so running
+    more than one scheduler (or replaying a tick) never escalates twice.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.targets = config['SLA_TARGETS']
+        self.resolution_action = config['SLA_RESOLUTION_ACTION']
+        self.batch_size = config['SLA_BATCH_SIZE']
+        self.tick_seconds = config['SLA_TICK_SECONDS']
+        self.overlap = timedelta(seconds=config['SYNC_OVERLAP_SECONDS'])
+        self._heap = []
+        self._tracked = {}
+        self._mark = None
+        self._stop = threading.Event()
+
+    # -- Keeping the heap in step with the tickets table ---------------------
+
+    def _track(self, row):
+        state = (row.priority, row.status, row.created_at,
+                 row.sla_response_breached_at is not None, row.sla_resolution_breached_at is not None)
+        if self._tracked.get(row.id) == state:
+            return
+        due = due_times(self.targets, *state)
+        if not due:
+            self._tracked.pop(row.id, None)
+            return
+        self._tracked[row.id] = state
+        for kind, due_at in due:
+            heapq.heappush(self._heap, (due_at, row.id, kind))
+
+    def load(self):
+        """Track every open ticket that can still breach (once, at startup)"""
+        started = datetime.utcnow()
+        result = db.session.execute(
+            select(*_TRACKED_COLUMNS)
+            .where(Ticket.status.in_(OPEN_STATUSES),
+                   or_(Ticket.sla_response_breached_at.is_(None), Ticket.sla_resolution_breached_at.is_(None)))
+            .execution_options(yield_per=10000)
+        )
+        for row in result:
+            self._track(row)
+        db.session.commit()
+        self._mark = (started - self.overlap, 0)
+
+    def poll_changes(self, now):
+        """Re-track up to one batch of tickets created or changed since the last poll"""
+        rows = db.session.execute(
+            select(*_TRACKED_COLUMNS, Ticket.updated_at)
+            .where(_after(self._mark))
+            .order_by(Ticket.updated_at, Ticket.id)
+            .limit(self.batch_size)
+        ).all()
+        for row in rows:
+            self._track(row)
+        if rows:
+            self._mark = (rows[-1].updated_at, rows[-1].id)
+        if len(rows) < self.batch_size:
+            # Caught up: next time re-read a short window so commits that
+            # landed with an older updated_at aren't missed
+            self._mark = min(self._mark, (now - self.overlap, 0))
+
+    def pop_due(self, now):
+        """Up to one batch of (ticket_id, kind, state) whose due time has passed"""
+        due, popped = [], 0
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size \
+                and popped < 4 * self.batch_size:
+            due_at, ticket_id, kind = heapq.heappop(self._heap)
+            popped += 1
+            state = self._tracked.get(ticket_id)
+            # Skip entries left behind by a priority/status change
+            if state is None or (kind, due_at) not in due_times(self.targets, *state):
+                continue
+            due.append((ticket_id, kind, state))
+        return due
+
+    def requeue(self, due):
+        """Put popped entries back on the heap (their escalation didn't commit)"""
+        for ticket_id, kind, state in due:
+            for due_kind, due_at in due_times(self.targets, *state):
+                if due_kind == kind:
+                    heapq.heappush(self._heap, (due_at, ticket_id, kind))
+
+    # -- Escalation -----------------------------------------------------------
+
+    def _conditional_update(self, ids, breached_column, now, values, extra=()):
+        """UPDATE the still-unescalated tickets among ids; returns the rows changed"""
+        return db.session.execute(
+            update(Ticket)
+            .where(Ticket.id.in_(ids), breached_column.is_(None), Ticket.status.in_(OPEN_STATUSES), *extra)
+            .values(updated_at=now, **{breached_column.key: now}, **values)
+            .returning(Ticket.id, Ticket.status, Ticket.priority, Ticket.category,
+                       Ticket.created_by, Ticket.assigned_to, Ticket.created_at),
+            execution_options={'synchronize_session': False}
+        ).all()
+
+    def escalate(self, due, now):
+        """Escalate a batch of due tickets in one transaction; returns how many changed"""
+        user_id = system_user_id()
+        activity_rows, tombstone_rows, deltas = [], [], Counter()
+        previous = {}
+        touched = set()
+        notify = []
+
+        def changed(row, old_priority, old_assigned_to, description):
+            previous[row.id] = {'status': row.status, 'priority': old_priority, 'assigned_to': old_assigned_to}
+            notify.append((row._mapping, previous[row.id]))
+            touched.update((row.created_by, old_assigned_to, row.assigned_to))
+            activity_rows.append({'ticket_id': row.id, 'user_id': user_id, 'action': 'escalated',
+                                  'description': description})
+            deltas.update(stats.diff_keys(
+                stats.stat_keys(row.status, old_priority, row.category, old_assigned_to, row.created_at),
+                stats.stat_keys(row.status, row.priority, row.category, row.assigned_to, row.created_at)
+            ))
+            if old_assigned_to and old_assigned_to != row.assigned_to:
+                tombstone_rows.append({'ticket_id': row.id, 'created_by': row.created_by,
+                                       'assigned_to': old_assigned_to, 'reason': 'unassigned',
+                                       'deleted_at': now})
+
+        bumps = defaultdict(lambda: defaultdict(list))  # kind -> priority -> ids
+        reassign = []
+        for ticket_id, kind, (priority, status, created_at, _, _) in due:
+            if kind == RESOLUTION and self.resolution_action == 'reassign':
+                reassign.append(ticket_id)
+            else:
+                bumps[kind][priority].append(ticket_id)
+
+        # Reassignment needs the current assignee, which the heap doesn't keep
+        if reassign:
+            engine = assignment.get_engine()
+            current = db.session.execute(
+                select(Ticket.id, Ticket.category, Ticket.assigned_to).where(Ticket.id.in_(reassign))
+            ).all()
+            chosen = engine.choose_reassignments(current) if engine else {}
+            groups = defaultdict(list)
+            for row in current:
+                if chosen.get(row.id) is None:
+                    # Nobody else to hand it to - raise the priority instead
+                    bumps[RESOLUTION][self._tracked[row.id][0]].append(row.id)
+                else:
+                    groups[(row.assigned_to, chosen[row.id])].append(row.id)
+            for (old, new), ids in groups.items():
+                condition = Ticket.assigned_to.is_(None) if old is None else Ticket.assigned_to == old
+                for row in self._conditional_update(ids, Ticket.sla_resolution_breached_at, now,
+                                                    {'assigned_to': new}, (condition,)):
+                    target = self.targets[row.priority]['resolution']
+                    action = f'reassigned from user {old} to user {new}' if old else f'assigned to user {new}'
+                    changed(row, row.priority, old,
+                            f'SLA resolution target missed ({target} min for {row.priority}): {action}')
+
+        for kind, by_priority in bumps.items():
+            column = Ticket.sla_response_breached_at if kind == RESPONSE else Ticket.sla_resolution_breached_at
+            for old_priority, ids in by_priority.items():
+                new_priority = next_priority(old_priority)
+                target = self.targets[old_priority][kind]
+                conditions = [Ticket.priority == old_priority]
+                if kind == RESPONSE:
+                    # Someone may have picked the ticket up since it was queued
+                    conditions.append(Ticket.status == 'open')
+                for row in self._conditional_update(ids, column, now, {'priority': new_priority}, conditions):
+                    if new_priority != old_priority:
+                        action = f'priority raised from {old_priority} to {new_priority}'
+                    else:
+                        action = 'already at the highest priority'
+                    changed(row, old_priority, row.assigned_to,
+                            f'SLA {kind} target missed ({target} min for {old_priority}): {action}')
+
+        if activity_rows:
+            audit.log_activities(activity_rows)
+            if tombstone_rows:
+                db.session.execute(insert(TicketTombstone), tombstone_rows)
+            stats.apply_deltas(deltas)
+            http_cache.touch(*touched)
+            notifications.notify_ticket_changes(notify, user_id)
+        db.session.commit()
+
+        if previous:
+            for ticket in Ticket.query.filter(Ticket.id.in_(list(previous))):
+                ticket_data = ticket.to_dict()
+                events.publish(events.TICKET_UPDATED, ticket_data, previous[ticket.id])
+                if ticket.assigned_to != previous[ticket.id]['assigned_to']:
+                    events.publish(events.TICKET_ASSIGNED, ticket_data, previous[ticket.id])
+            db.session.commit()
+        return len(previous)
+
+    # -- Running ----------------------------------------------------------------
+
+    def tick(self, now=None):
+        """One scheduler pass; returns the number of tickets escalated"""
+        now = now or datetime.utcnow()
+        if self._mark is None:
+            self.load()
+        self.poll_changes(now)
+        due = self.pop_due(now)
+        if not due:
+            db.session.commit()
+            return 0
+        try:
+            escalated = self.escalate(due, now)
+        except Exception:
+            # The tracked state hasn't changed, so polling won't push these
+            # again; retry them next tick (the conditional UPDATEs skip any
+            # that did commit)
+            db.session.rollback()
+            self.requeue(due)
+            raise
+        # Escalated tickets are re-read by the next poll with their new state
+        return escalated
+
+    def run(self):
+        """Tick every SLA_TICK_SECONDS until stop() is called"""
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    escalated = self.tick()
+                    if escalated:
+                        logger.info('Escalated %d tickets', escalated)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('SLA tick failed')
+                finally:
+                    db.session.remove()
+                self._stop.wait(self.tick_seconds)
+
+    def stop(self):
+        self._stop.set()
+
+
+def init_app(app):
+    """Start the scheduler in a background thread when SLA_SCHEDULER_IN_PROCESS is on"""
+    if not app.config['SLA_SCHEDULER_IN_PROCESS']:
+        return
+    scheduler = SlaScheduler(app)
+    app.extensions['sla_scheduler'] = scheduler
+    threading.Thread(target=scheduler.run, name='sla-scheduler', daemon=True).start()
+
+
+def register_commands(app):
+    """Add `flask sla-run` to the app's CLI"""
+
+    @app.cli.command('sla-run')
+    def sla_run_command():
+        """Run the SLA scheduler in the foreground (Ctrl+C to stop)"""
+        scheduler = SlaScheduler(current_app._get_current_object())
+        click.echo(f'SLA scheduler running, ticking every {scheduler.tick_seconds}s')
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import select, delete, func, insert, inspect
+from backend.models import db, Ticket, ArchivedTicket, TicketStatCounter, User
+
+# Every ticket contributes exactly one count to each of these dimensions
+DIMENSIONS = ('total', 'status', 'priority', 'category', 'technician', 'day')
+
+UNASSIGNED = 'unassigned'
+
+
+def stat_keys(status, priority, category, assigned_to, created_at):
+    """Return the (dimension, key) counters a ticket with these values belongs to"""
+    return [
+        ('total', 'all'),
+        ('status', status),
+        ('priority', priority),
+        ('category', category),
+        ('technician', str(assigned_to) if assigned_to else UNASSIGNED),
+        ('day', created_at.date().isoformat()),
+    ]
+
+
+def ticket_stat_keys(ticket):
+    """Counters for a Ticket object (must be flushed so created_at is set)"""
+    return stat_keys(ticket.status, ticket.priority, ticket.category,
+                     ticket.assigned_to, ticket.created_at)
+
+
+def diff_keys(before, after):
+    """Counter deltas for a ticket whose counters moved from before to after"""
+    deltas = Counter()
+    for key in before:
+        deltas[key] -= 1
+    for key in after:
+        deltas[key] += 1
+    return deltas
+
+
+def _upsert_statement(dialect_name):
+    """INSERT ... ON CONFLICT that adds to an existing counter row"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    table = TicketStatCounter.__table__
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.dimension, table.c.key],
+        set_={'count': table.c.count + stmt.excluded['count']}
+    )
+
+
+def apply_deltas(deltas):
+    """
+    Add the given {(dimension, key): delta} changes to the counters
+    Runs in the caller's session, so it commits or rolls back with the ticket change
+    """
+    params = [
+        {'dimension': dimension, 'key': key, 'count': delta}
+        for (dimension, key), delta in deltas.items() if delta
+    ]
+    if not params:
+        return
+    dialect_name = db.session.get_bind(mapper=TicketStatCounter).dialect.name
+    db.session.execute(_upsert_statement(dialect_name), params)
+
+
+def record_created(ticket):
+    """Count a newly created ticket"""
+    apply_deltas(Counter(ticket_stat_keys(ticket)))
+
+
+def record_changed(before_keys, ticket):
+    """Move a ticket's counts after its status/priority/assignee changed"""
+    apply_deltas(diff_keys(before_keys, ticket_stat_keys(ticket)))
+
+
+def record_deleted(ticket):
+    """Remove a deleted ticket from the counts"""
+    deltas = Counter()
+    for key in ticket_stat_keys(ticket):
+        deltas[key] -= 1
+    apply_deltas(deltas)
+
+
+def compute_counts(conn):
+    """
+    Compute every counter from scratch with a single GROUP BY over tickets
+    (and one over archived tickets, which still count)
+    Used to backfill and to repair counters; the stats endpoint never calls this
+    """
+    tables = [Ticket.__table__]
+    if inspect(conn).has_table(ArchivedTicket.__tablename__):
+        tables.append(ArchivedTicket.__table__)
+
+    counts = Counter()
+    for tickets in tables:
+        day = func.date(tickets.c.created_at)
+        query = select(
+            tickets.c.status, tickets.c.priority, tickets.c.category,
+            tickets.c.assigned_to, day.label('day'), func.count().label('n')
+        ).group_by(
+            tickets.c.status, tickets.c.priority, tickets.c.category,
+            tickets.c.assigned_to, day
+        )
+
+        for row in conn.execute(query):
+            created_day = row.day if isinstance(row.day, str) else row.day.isoformat()
+            keys = stat_keys(row.status, row.priority, row.category, row.assigned_to,
+                             datetime.fromisoformat(created_day))
+            for key in keys:
+                counts[key] += row.n
+    return counts
+
+
+def rebuild_counters(conn):
+    """Replace the stored counters with freshly computed ones"""
+    counts = compute_counts(conn)
+    conn.execute(delete(TicketStatCounter.__table__))
+    if counts:
+        conn.execute(insert(TicketStatCounter.__table__), [
+            {'dimension': dimension, 'key': key, 'count': n}
+            for (dimension, key), n in counts.items()
+        ])
+
+
+def read_stats(days=30):
+    """
+    Build the stats response from the counters table
+    One small indexed read regardless of how many tickets exist;
+    the per-day breakdown covers the last `days` days
+    """
+    since = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
+    rows = db.session.execute(
+        select(TicketStatCounter.dimension, TicketStatCounter.key, TicketStatCounter.count)
+        .where((TicketStatCounter.dimension != 'day') | (TicketStatCounter.key >= since))
+    ).all()
+
+    breakdowns = {dimension: {} for dimension in DIMENSIONS}
+    for dimension, key, count in rows:
+        if count:
+            breakdowns.setdefault(dimension, {})[key] = count
+
+    by_status = {'open': 0, 'in_progress': 0, 'resolved': 0, 'closed': 0}
+    by_status.update(breakdowns['status'])
+
+    # Attach usernames to the technician breakdown (one lookup on a small set)
+    technician_ids = [int(key) for key in breakdowns['technician'] if key != UNASSIGNED]
+    usernames = {}
+    if technician_ids:
+        usernames = dict(db.session.execute(
+            select(User.id, User.username).where(User.id.in_(technician_ids))
+        ).all())
+    by_technician = [
+        {
+            'technician_id': None if key == UNASSIGNED else int(key),
+            'username': None if key == UNASSIGNED else usernames.get(int(key)),
+            'count': count
+        }
+        for key, count in sorted(breakdowns['technician'].items(), key=lambda item: -item[1])
+    ]
+
+    return {
+        'total_tickets': breakdowns['total'].get('all', 0),
+        'by_status': by_status,
+        'high_priority_tickets': breakdowns['priority'].get('high', 0),
+        'critical_tickets': breakdowns['priority'].get('critical', 0),
+        'by_priority': breakdowns['priority'],
+        'by_category': breakdowns['category'],
+        'by_technician': by_technician,
+        'by_day': dict(sorted(breakdowns['day'].items()))
+    }
+
+
+def register_commands(app):
+    """Add `flask stats-rebuild` to the app's CLI"""
+
+    @app.cli.command('stats-rebuild')
+    def stats_rebuild_command():
+        """Recompute the ticket stat counters from the tickets table"""
+        with db.engine.begin() as conn:
+            rebuild_counters(conn)
+        click.echo('Ticket stat counters rebuilt')
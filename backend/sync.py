@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import and_, or_, delete, false
+from backend.models import db, Ticket, TicketTombstone
+from backend.pagination import encode_token, decode_token, InvalidCursor
+from backend.permissions import visible_tickets
+from backend.serialization import ticket_rows_query, rows_to_dicts
+
+
+def record_deleted(ticket):
+    """Leave a tombstone so synced clients drop a deleted ticket"""
+    db.session.add(TicketTombstone(
+        ticket_id=ticket.id,
+        created_by=ticket.created_by,
+        assigned_to=ticket.assigned_to,
+        reason='deleted'
+    ))
+
+
+def record_unassigned(ticket, old_assigned_to):
+    """Leave a tombstone so the previous technician drops a reassigned ticket"""
+    db.session.add(TicketTombstone(
+        ticket_id=ticket.id,
+        created_by=ticket.created_by,
+        assigned_to=old_assigned_to,
+        reason='unassigned'
+    ))
+
+
+def visible_tombstones(query, user):
+    """
+    Limit a TicketTombstone query to what this user should hear about
+    Only technicians care about 'unassigned' - for everyone else the ticket still exists
+    """
+    gone = TicketTombstone.reason.in_(('deleted', 'archived'))
+    if user.role == 'manager':
+        return query.filter(gone)
+    if user.role == 'user':
+        return query.filter(TicketTombstone.created_by == user.id, gone)
+    if user.role == 'technician':
+        return query.filter(TicketTombstone.assigned_to == user.id)
+    return query.filter(false())
+
+
+def _after(time_col, id_col, mark):
+    """Rows strictly after a (timestamp, id) mark"""
+    timestamp, row_id = mark
+    return or_(time_col > timestamp, and_(time_col == timestamp, id_col > row_id))
+
+
+def _decode_watermark(token):
+    """Turn a watermark token into (ticket mark, tombstone mark, caught_up, synced_at)"""
+    try:
+        data = decode_token(token)
+        ticket_mark = (datetime.fromisoformat(data['t'][0]), int(data['t'][1]))
+        tombstone_mark = (datetime.fromisoformat(data['d'][0]), int(data['d'][1]))
+        return ticket_mark, tombstone_mark, bool(data['c']), datetime.fromisoformat(data['s'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise InvalidCursor('Invalid watermark')
+
+
+def _encode_watermark(ticket_mark, tombstone_mark, caught_up, synced_at):
+    return encode_token({
+        't': [ticket_mark[0].isoformat(), ticket_mark[1]],
+        'd': [tombstone_mark[0].isoformat(), tombstone_mark[1]],
+        'c': caught_up,
+        's': synced_at.isoformat()
+    })
+
+
+def changes_since(user, token, limit):
+    """
+    Work out what changed for this user since the given watermark
+
+    token None means "from the beginning" (a full load, page by page);
+    'now' means "start from here" for a client that already has a list.
+    Returns a dict with the changed tickets, deleted ticket ids, the next
+    watermark and whether more changes are waiting. Clients apply
+    'deleted' before 'tickets' and upsert tickets by id.
+
+    A commit can land with an updated_at slightly older than rows we have
+    already sent, so once a client is caught up the next sync also re-reads
+    anything stamped within a short overlap window before the last sync.
+    Clients may see the same ticket twice; upserting by id makes that harmless.
+    """
+    now = datetime.utcnow()
+    beginning = (datetime.min, 0)
+
+    if token is None:
+        ticket_mark, tombstone_mark, caught_up, synced_at = beginning, beginning, False, now
+    elif token == 'now':
+        start = (now, 0)
+        return {
+            'tickets': [],
+            'deleted': [],
+            'watermark': _encode_watermark(start, start, True, now),
+            'has_more': False,
+            'reset': False
+        }
+    else:
+        ticket_mark, tombstone_mark, caught_up, synced_at = _decode_watermark(token)
+
+    # Tombstones older than the retention window may already be pruned, so a
+    # client that has been away that long has to reload from scratch
+    retention = timedelta(days=current_app.config['TOMBSTONE_RETENTION_DAYS'])
+    if token is not None and synced_at < now - retention:
+        return {'tickets': [], 'deleted': [], 'watermark': None, 'has_more': False, 'reset': True}
+
+    if caught_up:
+        overlap_start = (synced_at - timedelta(seconds=current_app.config['SYNC_OVERLAP_SECONDS']), 0)
+        ticket_mark = min(ticket_mark, overlap_start)
+        tombstone_mark = min(tombstone_mark, overlap_start)
+
+    tickets = (
+        visible_tickets(ticket_rows_query(), user)
+        .filter(_after(Ticket.updated_at, Ticket.id, ticket_mark))
+        .order_by(Ticket.updated_at, Ticket.id)
+        .limit(limit + 1)
+        .all()
+    )
+    tombstones = (
+        visible_tombstones(TicketTombstone.query, user)
+        .filter(_after(TicketTombstone.deleted_at, TicketTombstone.id, tombstone_mark))
+        .order_by(TicketTombstone.deleted_at, TicketTombstone.id)
+        .limit(limit + 1)
+        .all()
+    )
+
+    has_more = len(tickets) > limit or len(tombstones) > limit
+    tickets = tickets[:limit]
+    tombstones = tombstones[:limit]
+
+    if tickets:
+        ticket_mark = (tickets[-1].updated_at, tickets[-1].id)
+    if tombstones:
+        tombstone_mark = (tombstones[-1].deleted_at, tombstones[-1].id)
+
+    return {
+        'tickets': rows_to_dicts(tickets),
+        'deleted': [tombstone.ticket_id for tombstone in tombstones],
+        'watermark': _encode_watermark(ticket_mark, tombstone_mark, not has_more, now),
+        'has_more': has_more,
+        'reset': False
+    }
+
+
+def prune_tombstones(older_than_days):
+    """Delete tombstones past the retention window; returns how many were removed"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    result = db.session.execute(delete(TicketTombstone).where(TicketTombstone.deleted_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def register_commands(app):
+    """Add `flask tombstones-prune` to the app's CLI"""
+
+    @app.cli.command('tombstones-prune')
+    def tombstones_prune_command():
+        """Delete ticket tombstones older than TOMBSTONE_RETENTION_DAYS"""
+        removed = prune_tombstones(app.config['TOMBSTONE_RETENTION_DAYS'])
+        click.echo(f'Removed {removed} tombstones')
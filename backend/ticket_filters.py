@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from backend.models import Ticket
+
+# Values the API accepts for the enumerated ticket fields
+STATUSES = ('open', 'in_progress', 'resolved', 'closed')
+PRIORITIES = ('low', 'medium', 'high', 'critical')
+
+
+def parse_datetime(value, name):
+    """Parse an ISO date/datetime parameter, with a readable error"""
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an ISO date or datetime')
+
+
+def apply_ticket_filters(query, params, model=Ticket):
+    """
+    Narrow a Ticket query by the filter parameters shared across the API
+    params can be request.args or a JSON dict:
+    status, priority, assigned_to, category, created_after, created_before
+    model is Ticket, or ArchivedTicket to filter the archive the same way
+    Raises ValueError for malformed values
+    """
+    status = params.get('status')
+    if status:
+        query = query.filter(model.status == status)
+    
+    priority = params.get('priority')
+    if priority:
+        query = query.filter(model.priority == priority)
+    
+    assigned_to = params.get('assigned_to')
+    if assigned_to:
+        query = query.filter(model.assigned_to == assigned_to)
+    
+    category = params.get('category')
+    if category:
+        query = query.filter(model.category == category)
+    
+    created_after = params.get('created_after')
+    if created_after:
+        query = query.filter(model.created_at >= parse_datetime(created_after, 'created_after'))
+    
+    created_before = params.get('created_before')
+    if created_before:
+        query = query.filter(model.created_at < parse_datetime(created_before, 'created_before'))
+    
+    return query
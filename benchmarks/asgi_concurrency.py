@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Sync (threaded WSGI) vs async (ASGI) serving under many open connections
+
+Seeds a temporary SQLite database, then for each server mode starts the
+app in its own process, opens --streams idle event streams
+(GET /api/tickets/events, as dashboards keep them) and replays ticket list
+requests from --concurrency clients alongside them. Prints throughput,
+latency, the server's peak memory and its thread count for each mode.
+
+The threaded server spends one thread per open stream, so memory grows
+with the number of dashboards; the ASGI server holds each stream in a
+coroutine. Raise --streams to find where the sync server stops keeping up.
+
+    python -m benchmarks.asgi_concurrency --streams 500 --requests 2000
+The asgi mode needs uvicorn, asgiref, sqlalchemy[asyncio] and aiosqlite.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+
+MODES = ('wsgi', 'asgi')
+
+
+def serve(mode, port):
+    """Run the app in this process until killed (the child side of run_mode)"""
+    if mode == 'asgi':
+        import uvicorn
+        uvicorn.run('backend.asgi:create_asgi_app', factory=True, host='127.0.0.1', port=port,
+                    log_level='warning', backlog=4096)
+    else:
+        from werkzeug.serving import make_server, WSGIRequestHandler
+        from backend.app import create_app
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', port, create_app('testing'), threaded=True,
+                             request_handler=QuietHandler)
+        server.request_queue_size = 4096
+        server.serve_forever()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_status(pid):
+    """Peak resident memory (MiB) and thread count from /proc (Linux only)"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                name, _, value = line.partition(':')
+                fields[name] = value.split()[0] if value.split() else ''
+    except OSError:
+        return None, None
+    return round(int(fields.get('VmHWM', 0)) / 1024, 1), int(fields.get('Threads', 0))
+
+
+def _login(port, username, password):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('POST', '/api/auth/login', body=json.dumps({'username': username, 'password': password}),
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f'login failed with {response.status}')
+    cookies = SimpleCookie()
+    for header in response.headers.get_all('Set-Cookie') or []:
+        cookies.load(header)
+    connection.close()
+    return '; '.join(f'{key}={value.value}' for key, value in cookies.items())
+
+
+def _wait_ready(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/health')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def _open_streams(port, cookie, count):
+    """Open idle event streams; returns (sockets, how many got a 200)"""
+    sockets, accepted = [], 0
+    request = (f'GET /api/tickets/events HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+               f'Cookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n').encode('latin-1')
+    for _ in range(count):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+            sock.sendall(request)
+            if sock.recv(4096).startswith(b'HTTP/1.1 200'):
+                accepted += 1
+            sockets.append(sock)
+        except OSError:
+            break
+    return sockets, accepted
+
+
+def _replay(port, cookie, requests, concurrency):
+    """GET /api/tickets from concurrent keep-alive clients; returns (latencies, errors, seconds)"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', '/api/tickets?limit=50', headers={'Cookie': cookie})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0], time.perf_counter() - started
+
+
+def run_mode(mode, database_url, args):
+    port = _free_port()
+    env = dict(os.environ, FLASK_ENV='testing', TEST_DATABASE_URL=database_url,
+               INSTRUMENTATION_ENABLED='false', SLA_SCHEDULER_IN_PROCESS='false')
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.asgi_concurrency', '--serve', mode,
+                                '--port', str(port)], env=env)
+    sockets = []
+    try:
+        _wait_ready(port, process)
+        cookie = _login(port, 'manager0', args.password)
+        sockets, accepted = _open_streams(port, cookie, args.streams)
+        latencies, errors, seconds = _replay(port, cookie, args.requests, args.concurrency)
+        peak_mib, threads = _process_status(process.pid)
+    finally:
+        for sock in sockets:
+            sock.close()
+        process.terminate()
+        process.wait(timeout=30)
+
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0
+    row = {
+        'mode': mode,
+        'streams': accepted,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / seconds, 1) if seconds else 0,
+        'p50_ms': round(p50, 1),
+        'p95_ms': round(p95, 1),
+        'peak_rss_mib': peak_mib,
+        'threads': threads,
+    }
+    print(f"{mode:<6} {row['streams']:>8} {row['requests']:>8} {row['errors']:>6} {row['throughput_rps']:>9} "
+          f"{row['p50_ms']:>9} {row['p95_ms']:>9} {str(row['peak_rss_mib']):>9} {str(row['threads']):>8}")
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=10000, help='tickets to seed')
+    parser.add_argument('--streams', type=int, default=200, help='idle event streams held open')
+    parser.add_argument('--requests', type=int, default=2000, help='list requests to replay')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel list clients')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+
+    from backend.app import create_app
+    from backend.config import config
+    from backend.models import db
+    from benchmarks.seed import seed, PASSWORD
+
+    directory = tempfile.mkdtemp(prefix='ticketing-asgi-')
+    database_url = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    config['testing'].SQLALCHEMY_DATABASE_URI = database_url
+    app = create_app('testing')
+    with app.app_context():
+        seed(db.engine, tickets=args.tickets, log=lambda message: None)
+        db.engine.dispose()
+    args.password = PASSWORD
+
+    print(f"{'mode':<6} {'streams':>8} {'requests':>8} {'errors':>6} {'rps':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'peak MiB':>9} {'threads':>8}")
+    for mode in args.modes:
+        run_mode(mode, database_url, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Load-test benchmark for the ticketing API
+
+Seeds a fresh database with synthetic data, replays a mixed workload
+(list, detail, create, update, stats, login) and reports p50/p95/p99
+latency, throughput and SQL queries per request for each operation.
+
+    python -m benchmarks.run --tickets 10000 --requests 2000 --concurrency 8
+    python -m benchmarks.run --driver wsgi --save-baseline sqlite-10k
+    python -m benchmarks.run --compare sqlite-10k
+
+--compare exits with status 1 when an operation's p95 latency grew by more
+than --tolerance, or it started issuing more queries per request.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of human-readable regressions of report against baseline"""
+    regressions = []
+    for operation, old in baseline.items():
+        new = report.get(operation)
+        if operation.startswith('_') or not new:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{operation}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if new['queries_per_request'] > old['queries_per_request'] + 0.5:
+            regressions.append(
+                f"{operation}: queries/request {old['queries_per_request']} -> {new['queries_per_request']}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'operation':<10} {'requests':>8} {'errors':>6} {'rps':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}")
+    for operation, row in report.items():
+        if operation.startswith('_'):
+            continue
+        print(f"{operation:<10} {row['requests']:>8} {row['errors']:>6} {row['throughput_rps']:>9} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['queries_per_request']:>8}")
+    total = report['_total']
+    print(f"total: {total['requests']} requests in {total['elapsed_s']}s ({total['throughput_rps']} req/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=10000, help='tickets to seed (10k - 10M)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests to replay')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel virtual users')
+    parser.add_argument('--driver', choices=['testclient', 'wsgi'], default='testclient')
+    parser.add_argument('--database', help='database URL (default: a temporary SQLite file)')
+    parser.add_argument('--save-baseline', metavar='NAME', help='store the results as a named baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown (0.25 = 25%%)')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args(argv)
+
+    database = args.database
+    if not database:
+        database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='ticketing-bench-'), 'bench.db')
+
+    # TestingConfig reads this when backend.config is first imported
+    os.environ['TEST_DATABASE_URL'] = database
+
+    from backend.app import create_app
+    from backend.models import db
+    from benchmarks.seed import seed
+    from benchmarks.workload import instrument_queries, run_workload, TestClientDriver, WsgiServerDriver
+
+    app = create_app('testing')
+    instrument_queries(app)
+
+    with app.app_context():
+        counts = seed(db.engine, tickets=args.tickets)
+    print(f"Seeded {counts['users']} users, {counts['tickets']} tickets, "
+          f"{counts['activity_logs']} activity logs into {database}")
+
+    driver = WsgiServerDriver(app) if args.driver == 'wsgi' else TestClientDriver(app)
+    try:
+        report = run_workload(app, driver, requests=args.requests, concurrency=args.concurrency)
+    finally:
+        driver.close()
+
+    report['_total'].update({'tickets': args.tickets, 'driver': args.driver,
+                             'concurrency': args.concurrency})
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f'{args.save_baseline}.json')
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved baseline to {path}')
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json')) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print(f'No regressions against baseline {args.compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
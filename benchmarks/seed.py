@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert, func, select
+from backend.models import User, Ticket, ActivityLog
+from backend import stats, search, passwords
+
+# Every seeded account uses this password
+PASSWORD = 'benchmark'
+
+# Rough shape of a real help desk
+ROLE_WEIGHTS = {'user': 0.90, 'technician': 0.08, 'manager': 0.02}
+STATUS_WEIGHTS = {'open': 0.20, 'in_progress': 0.15, 'resolved': 0.25, 'closed': 0.40}
+PRIORITY_WEIGHTS = {'low': 0.30, 'medium': 0.45, 'high': 0.20, 'critical': 0.05}
+CATEGORIES = ['Hardware', 'Software', 'Network', 'Account', 'Other']
+WORDS = ('printer laptop vpn email password reset monitor keyboard network outage '
+         'slow crash install license access wifi drive backup phone update error').split()
+
+BATCH_SIZE = 10000
+
+
+def _pick(weights, rng):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(engine, tickets=10000, tickets_per_user=20, days=365, seed_value=42, log=print):
+    """
+    Fill an empty database with synthetic users, tickets and activity logs
+    Rows go in with multi-row INSERTs in batches, then the stats counters and
+    search index are rebuilt once at the end. Returns the row counts.
+    """
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    # Same parameters as the app, so logins don't trigger a rehash
+    password_hash = passwords.hash_password(PASSWORD)
+
+    user_count = max(3, tickets // tickets_per_user)
+    users = []
+    for i in range(user_count):
+        # Always have at least one of each role
+        role = ('manager', 'technician', 'user')[i] if i < 3 else _pick(ROLE_WEIGHTS, rng)
+        users.append({
+            'username': f'{role}{i}', 'email': f'{role}{i}@example.com',
+            'password_hash': password_hash, 'role': role,
+            'created_at': now - timedelta(days=days)
+        })
+
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), users)
+        rows = conn.execute(select(User.id, User.role)).all()
+
+    requesters = [row.id for row in rows if row.role == 'user']
+    technicians = [row.id for row in rows if row.role == 'technician']
+    log(f'Seeded {len(rows)} users')
+
+    ticket_total = activity_total = 0
+    first_id = 1
+    with engine.connect() as conn:
+        first_id = (conn.execute(select(func.max(Ticket.id))).scalar() or 0) + 1
+
+    while ticket_total < tickets:
+        count = min(BATCH_SIZE, tickets - ticket_total)
+        ticket_rows, activity_rows = [], []
+        for offset in range(count):
+            ticket_id = first_id + ticket_total + offset
+            created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+            status = _pick(STATUS_WEIGHTS, rng)
+            assigned_to = rng.choice(technicians) if status != 'open' or rng.random() < 0.5 else None
+            resolved_at = None
+            if status in ('resolved', 'closed'):
+                resolved_at = created_at + timedelta(minutes=rng.expovariate(1 / 1440))
+            created_by = rng.choice(requesters)
+            ticket_rows.append({
+                'id': ticket_id,
+                'title': _sentence(rng, 4),
+                'description': _sentence(rng, 20),
+                'category': rng.choice(CATEGORIES),
+                'priority': _pick(PRIORITY_WEIGHTS, rng),
+                'status': status,
+                'created_by': created_by,
+                'assigned_to': assigned_to,
+                'created_at': created_at,
+                'updated_at': resolved_at or created_at,
+                'resolved_at': resolved_at,
+            })
+            activity_rows.append({
+                'ticket_id': ticket_id, 'user_id': created_by, 'action': 'created',
+                'description': 'Ticket created', 'created_at': created_at
+            })
+            for step in range(rng.randint(0, 4)):
+                activity_rows.append({
+                    'ticket_id': ticket_id, 'user_id': assigned_to or created_by, 'action': 'updated',
+                    'description': _sentence(rng, 6),
+                    'created_at': created_at + timedelta(minutes=10 * (step + 1))
+                })
+
+        with engine.begin() as conn:
+            conn.execute(insert(Ticket.__table__), ticket_rows)
+            conn.execute(insert(ActivityLog.__table__), activity_rows)
+
+        ticket_total += count
+        activity_total += len(activity_rows)
+        log(f'Seeded {ticket_total}/{tickets} tickets')
+
+    with engine.begin() as conn:
+        stats.rebuild_counters(conn)
+        search.reindex(conn)
+
+    return {'users': len(rows), 'tickets': ticket_total, 'activity_logs': activity_total}
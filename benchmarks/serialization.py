@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization benchmark for ticket list responses
+
+Seeds a fresh SQLite database, then builds a ticket list response of each
+size two ways and prints the time spent loading rows, turning them into
+dicts and encoding JSON:
+
+    orm      Ticket objects + to_dict() + the json module (the old path)
+    rows     column-tuple rows + the json module
+    rows+fast column-tuple rows + the fast JSON provider (orjson if installed)
+
+The encoded bodies of the first two are compared byte for byte.
+
+    python -m benchmarks.serialization --sizes 10000 100000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def _timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_path(label, size, provider, use_rows):
+    from sqlalchemy.orm import joinedload
+    from backend.models import db, Ticket
+    from backend.serialization import ticket_rows_query, rows_to_dicts
+
+    # Fresh session so ORM objects are built again every run
+    db.session.remove()
+    if use_rows:
+        query = ticket_rows_query(include_users=True)
+    else:
+        query = Ticket.query.options(joinedload(Ticket.creator), joinedload(Ticket.assigned_technician))
+    query = query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(size)
+
+    rows, load_ms = _timed(query.all)
+    if use_rows:
+        data, dict_ms = _timed(lambda: rows_to_dicts(rows))
+    else:
+        data, dict_ms = _timed(lambda: [ticket.to_dict(include_users=True) for ticket in rows])
+    body, encode_ms = _timed(lambda: provider.response({'tickets': data, 'count': len(data)}).get_data())
+
+    total = load_ms + dict_ms + encode_ms
+    print(f"{size:>8} {label:<10} {load_ms:>9.1f} {dict_ms:>9.1f} {encode_ms:>9.1f} {total:>9.1f}")
+    return body, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='tickets per response')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per path; the fastest is kept')
+    args = parser.parse_args(argv)
+
+    from backend.app import create_app
+    from backend.config import config
+    from backend.models import db
+    from backend.serialization import PROVIDERS, StdlibJSONProvider, orjson
+    from benchmarks.seed import seed
+
+    testing = config['testing']
+    saved = testing.SQLALCHEMY_DATABASE_URI
+    directory = tempfile.mkdtemp(prefix='ticketing-serialization-')
+    try:
+        testing.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        app = create_app('testing')
+    finally:
+        testing.SQLALCHEMY_DATABASE_URI = saved
+
+    stdlib = StdlibJSONProvider(app)
+    fast = PROVIDERS['orjson'](app) if orjson is not None else stdlib
+    if orjson is None:
+        print('orjson is not installed - rows+fast uses the json module too')
+
+    with app.app_context():
+        seed(db.engine, tickets=max(args.sizes), log=lambda message: None)
+
+        print(f"{'tickets':>8} {'path':<10} {'load ms':>9} {'dict ms':>9} {'encode ms':>9} {'total ms':>9}")
+        for size in args.sizes:
+            best = {}
+            for _ in range(args.repeat):
+                for label, provider, use_rows in (('orm', stdlib, False), ('rows', stdlib, True),
+                                                  ('rows+fast', fast, True)):
+                    body, total = run_path(label, size, provider, use_rows)
+                    best.setdefault(label, []).append((total, body))
+            old_total, old_body = min(best['orm'])
+            _, rows_body = min(best['rows'])
+            new_total, _ = min(best['rows+fast'])
+            same = 'identical' if old_body == rows_body else 'DIFFERENT'
+            print(f"{size:>8} best: orm {old_total:.1f}ms -> rows+fast {new_total:.1f}ms "
+                  f"(x{old_total / new_total:.2f}), output {same}")
+        db.engine.dispose()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
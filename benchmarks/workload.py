@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from flask import g, has_request_context
+from sqlalchemy import event, select
+from werkzeug.serving import make_server, WSGIRequestHandler
+from backend.models import db, User
+from benchmarks.seed import PASSWORD, CATEGORIES, PRIORITY_WEIGHTS
+
+# Share of each operation in the replayed traffic
+DEFAULT_MIX = {
+    'list': 0.40,
+    'detail': 0.20,
+    'create': 0.10,
+    'update': 0.10,
+    'stats': 0.10,
+    'login': 0.10,
+}
+
+QUERY_COUNT_HEADER = 'X-Benchmark-Queries'
+
+
+def instrument_queries(app):
+    """
+    Count SQL statements per request and report them in a response header
+    Works the same under the test client and a real server thread
+    """
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.benchmark_queries = g.get('benchmark_queries', 0) + 1
+
+    @app.after_request
+    def _report(response):
+        response.headers[QUERY_COUNT_HEADER] = str(g.get('benchmark_queries', 0))
+        return response
+
+
+class TestClientDriver:
+    """Sends requests in-process through Flask's test client (no network)"""
+
+    def __init__(self, app):
+        self._app = app
+
+    def session(self):
+        return _TestClientSession(self._app.test_client())
+
+    def close(self):
+        pass
+
+
+class _TestClientSession:
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method, path, body=None):
+        response = self._client.open(path, method=method, json=body)
+        return response.status_code, int(response.headers.get(QUERY_COUNT_HEADER, 0)), response.get_json(silent=True)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class WsgiServerDriver:
+    """Runs the app in a real threaded WSGI server and talks HTTP to it"""
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self._server = make_server(host, port, app, threaded=True, request_handler=_QuietHandler)
+        self.host, self.port = host, self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def session(self):
+        return _HttpSession(self.host, self.port)
+
+    def close(self):
+        self._server.shutdown()
+
+
+class _HttpSession:
+    """One keep-alive HTTP connection with its own session cookie"""
+
+    def __init__(self, host, port):
+        self._connection = http.client.HTTPConnection(host, port, timeout=60)
+        self._cookies = SimpleCookie()
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self._cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v.value}' for k, v in self._cookies.items())
+        payload = json.dumps(body) if body is not None else None
+        self._connection.request(method, path, body=payload, headers=headers)
+        response = self._connection.getresponse()
+        data = response.read()
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            self._cookies.load(cookie)
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        return response.status, int(response.getheader(QUERY_COUNT_HEADER, 0)), parsed
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Thread-safe collector of (operation, latency, status, query count) samples"""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, operation, seconds, status, queries):
+        with self._lock:
+            self._samples[operation].append((seconds, status, queries))
+
+    def report(self, elapsed):
+        report = {}
+        for operation, samples in sorted(self._samples.items()):
+            latencies = sorted(s[0] * 1000 for s in samples)
+            report[operation] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[1] >= 400),
+                'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': round(_percentile(latencies, 0.50), 3),
+                'p95_ms': round(_percentile(latencies, 0.95), 3),
+                'p99_ms': round(_percentile(latencies, 0.99), 3),
+                'queries_per_request': round(sum(s[2] for s in samples) / len(samples), 2),
+            }
+        total = sum(r['requests'] for r in report.values())
+        report['_total'] = {
+            'requests': total,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+        }
+        return report
+
+
+def _accounts(app):
+    """Seeded usernames grouped by role"""
+    with app.app_context():
+        users = db.session.execute(select(User.username, User.role)).all()
+    by_role = defaultdict(list)
+    for username, role in users:
+        by_role[role].append(username)
+    return by_role
+
+
+def _virtual_user(driver, by_role, mix, requests, recorder, rng):
+    """
+    One simulated client: logs in as a random user, loads its ticket list
+    like the dashboard does, then replays the mix against tickets it can see
+    """
+    role = rng.choices(['user', 'technician', 'manager'], weights=[0.7, 0.25, 0.05])[0]
+    if not by_role[role]:
+        role = 'manager'
+    username = rng.choice(by_role[role])
+    session = driver.session()
+    session.request('POST', '/api/auth/login', {'username': username, 'password': PASSWORD})
+    _, _, listing = session.request('GET', '/api/tickets')
+    ticket_ids = [t['id'] for t in (listing or {}).get('tickets', [])]
+
+    operations, weights = list(mix), list(mix.values())
+    for _ in range(requests):
+        operation = rng.choices(operations, weights=weights)[0]
+        # Only managers may read stats; with nothing visible there's nothing to open
+        if (operation == 'stats' and role != 'manager') or \
+                (operation in ('detail', 'update') and not ticket_ids):
+            operation = 'list'
+        if operation == 'list':
+            method, path, body = 'GET', '/api/tickets', None
+        elif operation == 'detail':
+            method, path, body = 'GET', f'/api/tickets/{rng.choice(ticket_ids)}', None
+        elif operation == 'create':
+            method, path, body = 'POST', '/api/tickets', {
+                'title': 'Benchmark ticket', 'description': 'Created by the load test',
+                'category': rng.choice(CATEGORIES), 'priority': rng.choice(list(PRIORITY_WEIGHTS))
+            }
+        elif operation == 'update':
+            method, path, body = 'PUT', f'/api/tickets/{rng.choice(ticket_ids)}', {
+                'priority': rng.choice(list(PRIORITY_WEIGHTS))
+            }
+        elif operation == 'stats':
+            method, path, body = 'GET', '/api/tickets/stats', None
+        else:
+            method, path, body = 'POST', '/api/auth/login', {'username': username, 'password': PASSWORD}
+
+        started = time.perf_counter()
+        status, queries, data = session.request(method, path, body)
+        recorder.add(operation, time.perf_counter() - started, status, queries)
+
+        if operation == 'create' and status == 201 and role == 'user':
+            ticket_ids.append(data['ticket']['id'])
+
+
+def run_workload(app, driver, requests=1000, concurrency=4, mix=None, seed_value=7):
+    """
+    Replay a mixed workload with `concurrency` virtual users in parallel
+    Returns the per-operation latency/throughput/query-count report
+    """
+    mix = mix or DEFAULT_MIX
+    by_role = _accounts(app)
+    recorder = Recorder()
+    per_user = max(1, requests // concurrency)
+
+    threads = [
+        threading.Thread(target=_virtual_user, args=(
+            driver, by_role, mix, per_user, recorder, random.Random(seed_value + i)))
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
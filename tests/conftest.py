@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from backend.app import create_app
+from backend.config import config
+from backend.models import db, User
+
+PASSWORD = 'password123'
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """
+    Factory for apps on a fresh SQLite database in tmp_path
+    Keyword arguments override TestingConfig settings for that app
+    """
+    apps = []
+
+    def factory(**settings):
+        settings.setdefault('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'test.db'}")
+        # Cheap hashes keep logins fast
+        settings.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+        for name, value in settings.items():
+            monkeypatch.setattr(config['testing'], name, value, raising=False)
+        app = create_app('testing')
+        apps.append(app)
+        return app
+
+    yield factory
+
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'app_settings(**settings): config overrides for the app fixture')
+
+
+def app_settings(request):
+    """Settings from the test's app_settings marker"""
+    marker = request.node.get_closest_marker('app_settings')
+    return marker.kwargs if marker else {}
+
+
+@pytest.fixture
+def app(make_app, request):
+    return make_app(**app_settings(request))
+
+
+@pytest.fixture
+def add_user(app):
+    """add_user(username, role) -> id of a new user with PASSWORD"""
+    def factory(username, role='user'):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com', role=role)
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return factory
+
+
+@pytest.fixture
+def login(app):
+    """login(username) -> test client with a logged-in session"""
+    def factory(username):
+        client = app.test_client()
+        response = client.post('/api/auth/login', json={'username': username, 'password': PASSWORD})
+        assert response.status_code == 200, response.get_json()
+        response.close()
+        return client
+    return factory
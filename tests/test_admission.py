@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from tests.conftest import PASSWORD, app_settings
+
+LIMITS = {
+    'ADMISSION_ENABLED': True,
+    'ADMISSION_USER_LIMITS': {'default': {'default': (0.001, 3)}},
+    'ADMISSION_ROLE_LIMITS': {'default': {'default': None}},
+    'ADMISSION_MAX_IN_FLIGHT': 10,
+    'ADMISSION_GROUP_MAX_IN_FLIGHT': {'export': 1},
+}
+
+
+@pytest.fixture
+def app(make_app, request):
+    return make_app(**dict(LIMITS, **app_settings(request)))
+
+
+def test_user_over_its_bucket_gets_429_with_retry_after(app, add_user, login):
+    add_user('alice')
+    add_user('bob')
+    alice = login('alice')
+
+    codes = [alice.get('/api/tickets').status_code for _ in range(4)]
+    assert codes == [200, 200, 200, 429]
+    response = alice.get('/api/tickets')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert 'error' in response.get_json()
+
+    # Buckets are per user and per group
+    assert login('bob').get('/api/tickets').status_code == 200
+    assert alice.get('/api/tickets/stats').status_code != 429
+
+
+@pytest.mark.app_settings(ADMISSION_ROLE_LIMITS={'default': {'default': None, 'list': (0.001, 1)}})
+def test_rejection_further_on_refunds_the_user_token(app, add_user, login):
+    alice_id = add_user('alice')
+    add_user('bob')
+    bob, alice = login('bob'), login('alice')
+
+    # bob spends the role's only list token; alice is turned away by the role bucket
+    assert bob.get('/api/tickets').status_code == 200
+    assert [alice.get('/api/tickets').status_code for _ in range(5)] == [429] * 5
+
+    buckets = app.extensions['admission'].buckets
+    for _ in range(3):
+        assert buckets.take(f'user:{alice_id}:list', 0.001, 3) == 0
+    assert buckets.take(f'user:{alice_id}:list', 0.001, 3) > 0
+
+
+@pytest.mark.app_settings(ADMISSION_ROLE_LIMITS={'default': {'default': None},
+                                                  'technician': {'default': None, 'list': (0.001, 1)}})
+def test_role_change_applies_without_logging_in_again(app, add_user, login):
+    alice_id = add_user('alice')
+    add_user('boss', 'manager')
+    alice = login('alice')
+    assert alice.get('/api/tickets').status_code == 200
+
+    assert login('boss').put(f'/api/users/{alice_id}', json={'role': 'technician'}).status_code == 200
+    # alice's session still says 'user'; the technician role bucket applies anyway
+    assert [alice.get('/api/tickets').status_code for _ in range(2)] == [200, 429]
+
+
+def test_concurrency_cap_rejects_and_releases(app, add_user, login):
+    add_user('boss', 'manager')
+    boss = login('boss')
+    admission = app.extensions['admission']
+
+    streaming = boss.get('/api/export/tickets', buffered=False)
+    assert streaming.status_code == 200
+    assert admission.limiter.in_flight('export') == 1
+
+    busy = boss.get('/api/export/tickets')
+    assert busy.status_code == 429
+    assert busy.headers['Retry-After'] == '1'
+
+    streaming.close()
+    assert admission.limiter.in_flight('export') == 0
+    done = boss.get('/api/export/tickets', buffered=True)
+    assert done.status_code == 200
+    assert admission.limiter.in_flight() == 0
+
+
+def test_event_stream_is_exempt(app, add_user, login):
+    add_user('alice')
+    alice = login('alice')
+    for _ in range(5):
+        response = alice.get('/api/tickets/events', buffered=False)
+        assert response.status_code == 200
+        response.close()
+
+
+def test_async_list_route_is_limited_too(app, add_user):
+    pytest.importorskip('aiosqlite')
+    pytest.importorskip('greenlet')
+    httpx = pytest.importorskip('httpx')
+    WsgiToAsgi = pytest.importorskip('asgiref.wsgi').WsgiToAsgi
+    from backend.asgi import AsyncTicketApp, create_async_engine_for
+
+    add_user('alice')
+    asgi_app = AsyncTicketApp(app, create_async_engine_for(app), WsgiToAsgi(app))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            login = await client.post('/api/auth/login', json={'username': 'alice', 'password': PASSWORD})
+            assert login.status_code == 200
+            responses = [await client.get('/api/tickets') for _ in range(4)]
+        await asgi_app.engine.dispose()
+        return responses
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200, 200, 200, 429]
+    assert int(responses[-1].headers['Retry-After']) >= 1
+    assert app.extensions['admission'].limiter.in_flight() == 0
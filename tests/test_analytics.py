@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from backend import analytics
+from backend.archive import archive_batch
+from backend.models import db, Ticket, AnalyticsLedgerEntry
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(AUTO_ASSIGN_ENABLED=False, SYNC_OVERLAP_SECONDS=60)
+
+
+@pytest.fixture
+def users(add_user, login):
+    add_user('alice')
+    add_user('boss', 'manager')
+    return login('alice'), login('boss')
+
+
+def create(client, priority='medium'):
+    return client.post('/api/tickets', json={'title': 'VPN down', 'description': 'x', 'category': 'network',
+                                             'priority': priority}).get_json()['ticket']['id']
+
+
+def refresh(app):
+    with app.app_context():
+        return analytics.refresh()
+
+
+def opened_by_priority(app):
+    """{priority: tickets opened} over every day in the rollups"""
+    with app.app_context():
+        today = datetime.utcnow().date()
+        by_day = analytics.read_volume('priority', today - timedelta(days=365), today)
+    totals = {}
+    for keys in by_day.values():
+        for key, counts in keys.items():
+            totals[key] = totals.get(key, 0) + counts['opened']
+    return {key: count for key, count in totals.items() if count}
+
+
+def test_ledger_counts_each_ticket_once(app, users):
+    alice, boss = users
+    first, second = create(alice, 'low'), create(alice, 'high')
+    assert refresh(app) == 2
+    assert opened_by_priority(app) == {'low': 1, 'high': 1}
+
+    # Re-reading unchanged tickets (the overlap window) changes nothing
+    assert refresh(app) == 0
+    assert opened_by_priority(app) == {'low': 1, 'high': 1}
+
+    # A change moves the ticket's contribution; a deletion takes it back
+    boss.put(f'/api/tickets/{first}', json={'priority': 'critical', 'status': 'resolved'})
+    boss.delete(f'/api/tickets/{second}')
+    assert refresh(app) == 2
+    assert opened_by_priority(app) == {'critical': 1}
+    with app.app_context():
+        assert [entry.ticket_id for entry in AnalyticsLedgerEntry.query] == [first]
+        today = datetime.utcnow().date()
+        [result] = analytics.read_resolution('total', today, today)
+        assert result['tickets'] == 1
+
+
+def test_overlap_refresh_invalidates_cached_responses(app, users):
+    alice, boss = users
+    early, late = create(alice, 'low'), create(alice, 'low')
+    refresh(app)
+    url = '/api/analytics/volume?group_by=priority'
+    cached = boss.get(url)
+    assert boss.get(url, headers={'If-None-Match': cached.headers['ETag']}).status_code == 304
+
+    # A commit that landed with an updated_at behind the watermark
+    with app.app_context():
+        marks = analytics.watermarks()
+        ticket = db.session.get(Ticket, early)
+        ticket.priority = 'critical'
+        ticket.updated_at = db.session.get(Ticket, late).updated_at - timedelta(seconds=1)
+        db.session.commit()
+    assert refresh(app) == 1
+    with app.app_context():
+        assert analytics.watermarks() == marks
+
+    response = boss.get(url, headers={'If-None-Match': cached.headers['ETag']})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != cached.headers['ETag']
+    assert opened_by_priority(app) == {'low': 1, 'critical': 1}
+
+
+def test_first_refresh_backfills_archived_tickets(app, users):
+    alice, boss = users
+    archived, kept = create(alice, 'low'), create(alice, 'high')
+    boss.put(f'/api/tickets/{archived}', json={'status': 'closed'})
+    create(alice, 'medium')
+    with app.app_context():
+        assert archive_batch(datetime.utcnow() + timedelta(days=1), ('closed',), 10) == 1
+
+    assert refresh(app) == 3
+    assert opened_by_priority(app) == {'low': 1, 'medium': 1, 'high': 1}
+
+    # Archiving after a refresh leaves the ticket counted
+    boss.put(f'/api/tickets/{kept}', json={'status': 'resolved'})
+    refresh(app)
+    with app.app_context():
+        assert archive_batch(datetime.utcnow() + timedelta(days=1), ('resolved',), 10) == 1
+    refresh(app)
+    assert opened_by_priority(app) == {'low': 1, 'medium': 1, 'high': 1}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from backend import stats
+from backend.archive import archive_batch
+from backend.models import db, Ticket, ActivityLog, ArchivedTicket, ArchivedActivityLog, TicketStatCounter
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(AUTO_ASSIGN_ENABLED=False)
+
+
+@pytest.fixture
+def users(add_user, login):
+    ids = {name: add_user(name, role) for name, role in
+           [('alice', 'user'), ('tech1', 'technician'), ('boss', 'manager')]}
+    return ids, {name: login(name) for name in ids}
+
+
+def create(client, title='Printer jammed'):
+    return client.post('/api/tickets', json={'title': title, 'description': 'x',
+                                             'category': 'hardware'}).get_json()['ticket']['id']
+
+
+def archive(app, statuses=('resolved', 'closed')):
+    with app.app_context():
+        return archive_batch(datetime.utcnow() + timedelta(days=1), statuses, 100)
+
+
+def test_tickets_move_with_their_activity(app, users):
+    ids, clients = users
+    boss = clients['boss']
+    archived, kept = create(clients['alice']), create(clients['alice'], 'Scanner jammed')
+    boss.put(f'/api/tickets/{archived}', json={'assigned_to': ids['tech1'], 'status': 'resolved'})
+    with app.app_context():
+        activity = [(a.id, a.description) for a in ActivityLog.query.filter_by(ticket_id=archived)]
+
+    assert archive(app) == 1
+    with app.app_context():
+        assert db.session.get(Ticket, archived) is None
+        assert db.session.get(Ticket, kept) is not None
+        assert db.session.get(ArchivedTicket, archived).status == 'resolved'
+        assert ActivityLog.query.filter_by(ticket_id=archived).count() == 0
+        assert [(a.id, a.description) for a in
+                ArchivedActivityLog.query.filter_by(ticket_id=archived).order_by(ArchivedActivityLog.id)] == activity
+
+    # Still readable by id, by the same people, with its history
+    for name in ('alice', 'tech1', 'boss'):
+        body = clients[name].get(f'/api/tickets/{archived}').get_json()
+        assert body['ticket']['archived'] is True
+        assert [a['description'] for a in body['activities']] == [d for _, d in reversed(activity)]
+    assert boss.get(f'/api/tickets/{archived}/activities').get_json()['count'] == len(activity)
+    assert [t['id'] for t in boss.get('/api/tickets').get_json()['tickets']] == [kept]
+
+
+def test_archived_tickets_leave_sync_and_search(app, users):
+    ids, clients = users
+    alice, tech1, boss = clients['alice'], clients['tech1'], clients['boss']
+    ticket_id = create(alice)
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': ids['tech1'], 'status': 'closed'})
+    marks = {name: client.get('/api/tickets/changes').get_json()['watermark']
+             for name, client in clients.items()}
+    assert [t['id'] for t in boss.get('/api/tickets/search?q=printer').get_json()['tickets']] == [ticket_id]
+
+    assert archive(app) == 1
+    for name, client in clients.items():
+        body = client.get('/api/tickets/changes', query_string={'since': marks[name]}).get_json()
+        assert body['deleted'] == [ticket_id], name
+    assert boss.get('/api/tickets/search?q=printer').get_json()['tickets'] == []
+    assert alice.get('/api/tickets/search?q=printer').get_json()['tickets'] == []
+
+
+def test_stats_still_count_archived_tickets(app, users):
+    _, clients = users
+    alice, boss = clients['alice'], clients['boss']
+    for title in ('Printer jammed', 'Scanner jammed', 'Monitor flickers'):
+        ticket_id = create(alice, title)
+    boss.put(f'/api/tickets/{ticket_id}', json={'status': 'closed'})
+    with app.app_context():
+        before = stats.read_stats()
+
+    assert archive(app) == 1
+    with app.app_context():
+        assert stats.read_stats() == before
+        stored = {(row.dimension, row.key): row.count for row in TicketStatCounter.query if row.count}
+        assert stored == dict(stats.compute_counts(db.session.connection()))
+
+
+def test_archived_ids_are_never_handed_out_again(app, users):
+    _, clients = users
+    alice, boss = clients['alice'], clients['boss']
+    first = create(alice)
+    newest = create(alice, 'Scanner jammed')
+    boss.put(f'/api/tickets/{newest}', json={'status': 'resolved'})
+    assert archive(app) == 1
+
+    # A new ticket (and its activity) must not take the archived ids
+    replacement = create(alice, 'Monitor flickers')
+    assert replacement > newest
+    boss.put(f'/api/tickets/{first}', json={'status': 'resolved'})
+    boss.put(f'/api/tickets/{replacement}', json={'status': 'resolved'})
+    assert archive(app) == 2
+    with app.app_context():
+        assert ArchivedTicket.query.count() == 3
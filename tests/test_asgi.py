@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from tests.conftest import PASSWORD
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+httpx = pytest.importorskip('httpx')
+WsgiToAsgi = pytest.importorskip('asgiref.wsgi').WsgiToAsgi
+
+from backend.asgi import AsyncTicketApp, create_async_engine_for  # noqa: E402
+
+# Headers both servers must agree on
+COMPARED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+@pytest.fixture
+def tickets(add_user, login):
+    """alice's tickets, one assigned to tech1 and commented on by the manager"""
+    add_user('alice')
+    tech_id = add_user('tech1', 'technician')
+    add_user('boss', 'manager')
+    alice, boss = login('alice'), login('boss')
+    ids = [alice.post('/api/tickets', json={'title': f'Ticket {i}', 'description': 'ünïcode ✓',
+                                            'category': 'hardware', 'priority': 'high'})
+           .get_json()['ticket']['id'] for i in range(3)]
+    boss.put(f'/api/tickets/{ids[0]}', json={'assigned_to': tech_id, 'status': 'in_progress'})
+    return ids
+
+
+def asgi_responses(app, requests):
+    """Send (username, method, path[, headers]) requests through AsyncTicketApp, logged in as username"""
+    asgi_app = AsyncTicketApp(app, create_async_engine_for(app), WsgiToAsgi(app))
+
+    async def scenario():
+        responses = []
+        transport = httpx.ASGITransport(app=asgi_app)
+        try:
+            for username, method, path, *headers in requests:
+                async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+                    if username:
+                        login = await client.post('/api/auth/login',
+                                                  json={'username': username, 'password': PASSWORD})
+                        assert login.status_code == 200
+                    responses.append(await client.request(method, path, headers=headers[0] if headers else None))
+        finally:
+            await asgi_app.engine.dispose()
+        return responses
+
+    return asyncio.run(scenario())
+
+
+def flask_response(app, login, username, method, path):
+    client = login(username) if username else app.test_client()
+    response = client.open(path, method=method)
+    response.close()
+    return response
+
+
+def assert_same(flask, asgi):
+    assert asgi.status_code == flask.status_code
+    assert asgi.content == flask.get_data()
+    for name in COMPARED_HEADERS:
+        assert asgi.headers.get(name) == flask.headers.get(name), name
+    assert set(asgi.headers.get('Cache-Control', '').split(', ')) == \
+        set(flask.headers.get('Cache-Control', '').split(', '))
+
+
+REQUESTS = [
+    ('alice', 'GET', '/api/tickets'),
+    ('alice', 'GET', '/api/tickets?include_users=1&limit=2'),
+    ('boss', 'GET', '/api/tickets?include_users=true&include_total=1&status=open'),
+    ('tech1', 'GET', '/api/tickets'),
+    ('alice', 'GET', '/api/tickets?limit=abc'),
+    (None, 'GET', '/api/tickets'),
+    ('alice', 'GET', '/api/auth/me'),
+]
+
+
+@pytest.mark.parametrize('username,method,path', REQUESTS)
+def test_native_routes_match_the_flask_views(app, login, tickets, username, method, path):
+    [asgi] = asgi_responses(app, [(username, method, path)])
+    assert_same(flask_response(app, login, username, method, path), asgi)
+
+
+@pytest.mark.parametrize('username', ['alice', 'tech1', 'boss'])
+def test_ticket_detail_matches_the_flask_view(app, login, tickets, username):
+    paths = [f'/api/tickets/{ticket_id}' for ticket_id in tickets] + ['/api/tickets/999999']
+    asgi = asgi_responses(app, [(username, 'GET', path) for path in paths])
+    for path, response in zip(paths, asgi):
+        assert_same(flask_response(app, login, username, 'GET', path), response)
+    assert asgi[0].headers['ETag']
+
+
+def test_validators_from_either_server_revalidate_on_the_other(app, login, tickets):
+    flask = flask_response(app, login, 'alice', 'GET', '/api/tickets?include_users=1')
+    detail = flask_response(app, login, 'alice', 'GET', f'/api/tickets/{tickets[1]}')
+    asgi = asgi_responses(app, [
+        ('alice', 'GET', '/api/tickets?include_users=1', {'If-None-Match': flask.headers['ETag']}),
+        ('alice', 'GET', f'/api/tickets/{tickets[1]}', {'If-None-Match': detail.headers['ETag']}),
+        ('alice', 'GET', '/api/tickets', {'If-None-Match': flask.headers['ETag']}),
+    ])
+    assert [response.status_code for response in asgi] == [304, 304, 200]
+    assert asgi[0].headers['ETag'] == flask.headers['ETag']
+
+
+def test_login_matches_the_flask_view_and_sessions_are_shared(app, login, tickets):
+    attempts = [{'username': 'alice', 'password': PASSWORD},
+                {'username': 'alice', 'password': 'wrong'},
+                {'username': 'nobody', 'password': PASSWORD},
+                {'username': 'alice'}]
+    asgi_app = AsyncTicketApp(app, create_async_engine_for(app), WsgiToAsgi(app))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=asgi_app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+                return [await client.post('/api/auth/login', json=attempt) for attempt in attempts]
+        finally:
+            await asgi_app.engine.dispose()
+
+    asgi = asyncio.run(scenario())
+    for attempt, response in zip(attempts, asgi):
+        flask = app.test_client().post('/api/auth/login', json=attempt)
+        assert response.status_code == flask.status_code
+        assert response.content == flask.get_data()
+        assert response.headers['Content-Type'] == flask.headers['Content-Type']
+        assert ('Set-Cookie' in response.headers) == ('Set-Cookie' in flask.headers)
+
+    # A session cookie from the ASGI login works in the Flask app
+    client = app.test_client()
+    client.set_cookie('session', asgi[0].cookies['session'], domain='localhost')
+    assert client.get('/api/tickets/stats').status_code == 403
+    assert client.get('/api/tickets').get_json()['count'] == 3
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from backend.models import User
+
+
+def create_ticket(client, title='Printer jam'):
+    response = client.post('/api/tickets', json={'title': title, 'description': 'x', 'category': 'hardware'})
+    assert response.status_code == 201
+    return response.get_json()['ticket']
+
+
+def test_automatic_assignment_is_logged_under_the_system_account(app, add_user, login):
+    tech_id = add_user('tech1', 'technician')
+    alice_id = add_user('alice')
+    alice = login('alice')
+
+    ticket = create_ticket(alice)
+    assert ticket['assigned_to'] == tech_id
+
+    activities = login('tech1').get(f"/api/tickets/{ticket['id']}").get_json()['activities']
+    by_action = {activity['description'].split(':')[0]: activity['user_id'] for activity in activities}
+    with app.app_context():
+        bot = User.query.filter_by(username=app.config['SLA_SYSTEM_USERNAME']).one()
+        assert bot.role == 'system'
+    assert by_action == {'Ticket created': alice_id, f'Automatically assigned to user {tech_id}': bot.id}
+
+    # The account is created once and reused
+    create_ticket(alice, 'Second')
+    with app.app_context():
+        assert User.query.filter_by(role='system').count() == 1
+
+
+def test_registered_technician_joins_the_pool(app, add_user, login):
+    add_user('tech1', 'technician')
+    add_user('alice')
+    alice = login('alice')
+    assert create_ticket(alice)['assigned_to'] is not None
+
+    response = app.test_client().post('/api/auth/register', json={
+        'username': 'tech2', 'email': 'tech2@example.com', 'password': 'password123', 'role': 'technician'
+    })
+    assert response.status_code == 201
+    # Without waiting for ASSIGNMENT_RESYNC_SECONDS
+    assert create_ticket(alice, 'Second')['assigned_to'] == response.get_json()['user']['id']
+
+
+def test_role_changes_update_the_pool(app, add_user, login):
+    tech_id = add_user('tech1', 'technician')
+    alice_id = add_user('alice')
+    add_user('boss', 'manager')
+    alice, boss = login('alice'), login('boss')
+    assert create_ticket(alice)['assigned_to'] == tech_id
+
+    assert boss.put(f'/api/users/{alice_id}', json={'role': 'technician'}).status_code == 200
+    assert create_ticket(boss, 'Promoted')['assigned_to'] == alice_id
+
+    assert boss.put(f'/api/users/{alice_id}', json={'role': 'user'}).status_code == 200
+    assert boss.put(f'/api/users/{tech_id}', json={'role': 'user'}).status_code == 200
+    assert create_ticket(boss, 'Nobody left')['assigned_to'] is None
+
+
+def test_users_can_only_update_themselves(app, add_user, login):
+    add_user('alice')
+    bob_id = add_user('bob')
+    alice = login('alice')
+    assert alice.put(f'/api/users/{bob_id}', json={'email': 'mine@example.com'}).status_code == 403
+    # Roles are for managers to change
+    response = login('bob').put(f'/api/users/{bob_id}', json={'email': 'bob2@example.com', 'role': 'manager'})
+    assert response.status_code == 200
+    assert response.get_json()['user']['email'] == 'bob2@example.com'
+    assert response.get_json()['user']['role'] == 'user'
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import os
+from datetime import datetime
+import pytest
+from backend import audit, metrics
+from backend.models import ActivityLog
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    # Flushes only happen when a test calls flush()
+    app = make_app(AUDIT_WRITE_MODE='buffered', AUDIT_SPOOL_DIR=str(tmp_path / 'spool'),
+                   AUDIT_FLUSH_SECONDS=3600, AUDIT_FLUSH_SIZE=10000, AUDIT_MAX_ATTEMPTS=2,
+                   AUDIT_DEAD_LETTER_FILE=str(tmp_path / 'dead-letter.jsonl'))
+    yield app
+    app.extensions['audit_writer'].stop()
+
+
+@pytest.fixture
+def writer(app):
+    return app.extensions['audit_writer']
+
+
+@pytest.fixture
+def alice(add_user, login):
+    add_user('alice')
+    return login('alice')
+
+
+def create(client, title='Printer jammed'):
+    return client.post('/api/tickets', json={'title': title, 'description': 'x',
+                                             'category': 'hardware'}).get_json()['ticket']['id']
+
+
+def activities(app, ticket_id):
+    with app.app_context():
+        return [activity.description for activity in
+                ActivityLog.query.filter_by(ticket_id=ticket_id).order_by(ActivityLog.id)]
+
+
+def counter_value(app, name):
+    return sum(value for _, _, value in metrics.get_registry(app).counter(name, '').samples())
+
+
+def spool_files(app):
+    return glob.glob(os.path.join(app.config['AUDIT_SPOOL_DIR'], '*.jsonl'))
+
+
+def crash(writer):
+    """Forget the writer's queue like a killed process would, leaving its spool files"""
+    with writer._lock:
+        segments = writer._sealed + ([writer._segment] if writer._segment else [])
+        writer._sealed, writer._segment = [], None
+    for segment in segments:
+        segment._file.close()
+
+
+def test_rows_are_written_on_flush(app, writer, alice):
+    ticket_id = create(alice)
+    assert activities(app, ticket_id) == []
+    assert writer.depth == 1
+    assert len(spool_files(app)) == 1
+
+    assert writer.flush() == 1
+    assert activities(app, ticket_id) == ['Ticket created: Printer jammed']
+    assert writer.depth == 0
+    assert spool_files(app) == []
+    assert counter_value(app, 'audit_rows_written_total') == 1
+
+
+def test_spooled_rows_are_replayed_after_a_crash(app, writer, alice):
+    first, second = create(alice), create(alice, 'Scanner jammed')
+    crash(writer)
+    assert writer.recover() == 2
+    assert writer.flush() == 2
+    assert activities(app, first) == ['Ticket created: Printer jammed']
+    assert activities(app, second) == ['Ticket created: Scanner jammed']
+    assert spool_files(app) == []
+
+
+def test_spool_file_written_before_a_crash_is_not_replayed(app, writer, alice, monkeypatch):
+    ticket_id = create(alice)
+    # The batch commits but the process dies before deleting the file
+    with monkeypatch.context() as patch:
+        patch.setattr(audit.SpoolSegment, 'discard', lambda segment: segment._file.close())
+        assert writer.flush() == 1
+    assert len(spool_files(app)) == 1
+
+    assert writer.recover() == 0
+    assert spool_files(app) == []
+    assert writer.flush() == 0
+    assert activities(app, ticket_id) == ['Ticket created: Printer jammed']
+
+
+def test_rows_written_one_at_a_time_are_not_replayed(app, writer, alice):
+    first, second = create(alice), create(alice, 'Scanner jammed')
+    crash(writer)
+    # A failing flush got as far as the first row before the crash
+    [path] = spool_files(app)
+    segment = audit.SpoolSegment(path)
+    segment.load()
+    segment._file.close()
+    with app.app_context():
+        audit.write_batch([audit.row_batch_id(segment.id, 0)], segment.rows[:1])
+
+    assert writer.recover() == 1
+    assert writer.flush() == 1
+    assert activities(app, first) == ['Ticket created: Printer jammed']
+    assert activities(app, second) == ['Ticket created: Scanner jammed']
+
+
+def test_rows_for_deleted_tickets_are_dropped(app, writer, alice, add_user, login):
+    add_user('boss', 'manager')
+    kept, deleted = create(alice), create(alice, 'Scanner jammed')
+    assert login('boss').delete(f'/api/tickets/{deleted}').status_code == 200
+
+    assert writer.flush() == 1
+    assert counter_value(app, 'audit_rows_dropped_total') == 1
+    assert activities(app, kept) == ['Ticket created: Printer jammed']
+    assert activities(app, deleted) == []
+
+
+def test_bad_row_is_isolated_then_dead_lettered(app, writer, alice, tmp_path):
+    ticket_id = create(alice)
+    bad = {'ticket_id': ticket_id, 'user_id': 1, 'action': 'updated', 'description': None,
+           'created_at': datetime.utcnow()}
+    writer.submit([bad])
+    second_id = create(alice, 'Scanner jammed')
+
+    # The rows around the bad one still go in
+    assert writer.flush() == 2
+    assert activities(app, ticket_id) == ['Ticket created: Printer jammed']
+    assert activities(app, second_id) == ['Ticket created: Scanner jammed']
+    assert writer.depth == 1
+    assert not os.path.exists(tmp_path / 'dead-letter.jsonl')
+
+    # Second failure: moved aside, and the spool is empty again
+    assert writer.flush() == 0
+    assert writer.depth == 0
+    assert spool_files(app) == []
+    with open(tmp_path / 'dead-letter.jsonl', encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert [(row['ticket_id'], row['description']) for row in dead] == [(ticket_id, None)]
+    assert 'error' in dead[0]
+    assert counter_value(app, 'audit_rows_dead_lettered_total') == 1
+
+    create(alice, 'Monitor flickers')
+    assert writer.flush() == 1
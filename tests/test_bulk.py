@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from backend import stats
+from backend.models import db, Ticket, TicketStatCounter, TicketTombstone
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(AUTO_ASSIGN_ENABLED=False, BULK_MAX_TICKETS=5)
+
+
+@pytest.fixture
+def users(add_user, login):
+    ids = {name: add_user(name, role) for name, role in
+           [('alice', 'user'), ('bob', 'user'), ('tech1', 'technician'), ('tech2', 'technician'),
+            ('boss', 'manager')]}
+    return ids, {name: login(name) for name in ids}
+
+
+def create(client, title='Printer jammed', priority='medium'):
+    return client.post('/api/tickets', json={'title': title, 'description': 'x', 'category': 'hardware',
+                                             'priority': priority}).get_json()['ticket']['id']
+
+
+def bulk(client, **body):
+    response = client.post('/api/tickets/bulk', json=body)
+    return response.status_code, response.get_json()
+
+
+def results(body):
+    return {row['id']: row['result'] for row in body['results']}
+
+
+@pytest.mark.parametrize('role,field,value,allowed', [
+    ('alice', 'status', 'closed', False),
+    ('alice', 'priority', 'high', False),
+    ('tech1', 'status', 'in_progress', True),
+    ('tech1', 'priority', 'high', True),
+    ('tech1', 'assigned_to', None, False),
+    ('boss', 'assigned_to', None, True),
+])
+def test_fields_each_role_may_change(users, role, field, value, allowed):
+    ids, clients = users
+    ticket_id = create(clients['alice'])
+    clients['boss'].put(f'/api/tickets/{ticket_id}', json={'assigned_to': ids['tech1']})
+
+    status, body = bulk(clients[role], action='update', ticket_ids=[ticket_id], changes={field: value})
+    if allowed:
+        assert (status, results(body)) == (200, {ticket_id: 'updated'})
+        assert clients['boss'].get(f'/api/tickets/{ticket_id}').get_json()['ticket'][field] == value
+    else:
+        assert (status, body) == (403, {'error': f'Insufficient permissions to change {field}'})
+
+
+def test_invalid_changes_are_rejected(users):
+    _, clients = users
+    ticket_id = create(clients['alice'])
+    boss = clients['boss']
+    for changes, message in [({'title': 'x'}, 'title cannot be changed in bulk'),
+                             ({}, 'changes must be a non-empty object'),
+                             ({'status': 'gone'}, 'status must be one of open, in_progress, resolved, closed')]:
+        assert bulk(boss, action='update', ticket_ids=[ticket_id], changes=changes) == (400, {'error': message})
+
+
+def test_only_managers_delete(users):
+    _, clients = users
+    ticket_id = create(clients['alice'])
+    for role in ('alice', 'tech1'):
+        assert bulk(clients[role], action='delete', ticket_ids=[ticket_id]) == \
+            (403, {'error': 'Insufficient permissions'})
+    status, body = bulk(clients['boss'], action='delete', ticket_ids=[ticket_id])
+    assert (status, results(body)) == (200, {ticket_id: 'deleted'})
+
+
+def test_tickets_by_id_list_report_each_one(users):
+    ids, clients = users
+    mine, theirs = create(clients['alice']), create(clients['bob'])
+    clients['boss'].put(f'/api/tickets/{mine}', json={'assigned_to': ids['tech1']})
+
+    # Duplicates count once; tickets the technician can't see are reported, not changed
+    status, body = bulk(clients['tech1'], action='update', ticket_ids=[mine, theirs, mine, 9999],
+                        changes={'status': 'in_progress'})
+    assert status == 200
+    assert results(body) == {mine: 'updated', theirs: 'forbidden', 9999: 'not_found'}
+    assert body['summary'] == {'updated': 1, 'forbidden': 1, 'not_found': 1}
+    assert clients['boss'].get(f'/api/tickets/{theirs}').get_json()['ticket']['status'] == 'open'
+
+
+def test_filters_only_match_visible_tickets(users):
+    _, clients = users
+    alice, bob = clients['alice'], clients['bob']
+    high = create(alice, priority='high')
+    create(alice, priority='low')
+    create(bob, priority='high')
+
+    status, body = bulk(clients['boss'], action='update', filter={'priority': 'high'},
+                        changes={'status': 'resolved'})
+    assert (status, body['summary']) == (200, {'updated': 2})
+    assert high in results(body)
+
+    status, body = bulk(clients['tech1'], action='update', filter={'priority': 'high'},
+                        changes={'status': 'closed'})
+    assert (status, body) == (400, {'error': 'No tickets matched'})
+
+
+def test_requests_are_capped(users):
+    _, clients = users
+    alice, boss = clients['alice'], clients['boss']
+    ticket_ids = [create(alice) for _ in range(6)]
+    message = {'error': 'A bulk request can touch at most 5 tickets'}
+    assert bulk(boss, action='update', ticket_ids=ticket_ids, changes={'priority': 'high'}) == (400, message)
+    assert bulk(boss, action='update', filter={'status': 'open'}, changes={'priority': 'high'}) == (400, message)
+    assert bulk(boss, action='update', ticket_ids=ticket_ids[:5], changes={'priority': 'high'})[0] == 200
+
+
+def test_side_effects_match_single_ticket_changes(app, users):
+    ids, clients = users
+    alice, boss = clients['alice'], clients['boss']
+    ticket_ids = [create(alice) for _ in range(3)]
+    bulk(boss, action='update', ticket_ids=ticket_ids, changes={'assigned_to': ids['tech1']})
+    listed = alice.get('/api/tickets')
+
+    status, _ = bulk(boss, action='update', ticket_ids=ticket_ids[:2],
+                     changes={'assigned_to': ids['tech2'], 'priority': 'high'})
+    assert status == 200
+    # The list changed under alice's cached copy
+    assert alice.get('/api/tickets', headers={'If-None-Match': listed.headers['ETag']}).status_code == 200
+
+    status, _ = bulk(boss, action='delete', ticket_ids=[ticket_ids[0]])
+    assert status == 200
+    with app.app_context():
+        tombstones = {(t.ticket_id, t.assigned_to, t.reason) for t in TicketTombstone.query}
+        assert tombstones == {(ticket_ids[0], ids['tech1'], 'unassigned'), (ticket_ids[1], ids['tech1'], 'unassigned'),
+                              (ticket_ids[0], ids['tech2'], 'deleted')}
+        assert db.session.get(Ticket, ticket_ids[0]) is None
+        counters = stats.read_stats()
+        assert counters['total_tickets'] == 2
+        assert counters['by_priority'] == {'high': 1, 'medium': 1}
+        assert {row['technician_id']: row['count'] for row in counters['by_technician']} == \
+            {ids['tech1']: 1, ids['tech2']: 1}
+        stored = {(row.dimension, row.key): row.count for row in TicketStatCounter.query if row.count}
+        assert stored == dict(stats.compute_counts(db.session.connection()))
+
+    search = [t['id'] for t in boss.get('/api/tickets/search?q=printer').get_json()['tickets']]
+    assert sorted(search) == ticket_ids[1:]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import pytest
+from backend import events
+
+
+def received_ids(bus, publish_count):
+    subscription = bus.subscribe()
+    for _ in range(publish_count):
+        bus.publish(events.TICKET_UPDATED, {'id': 1, 'created_by': 1, 'assigned_to': None})
+    return [subscription.get(timeout=5)['id'] for _ in range(publish_count)]
+
+
+def test_memory_bus_numbers_events():
+    assert received_ids(events.EventBus(events.MemoryBackend()), 3) == [1, 2, 3]
+
+
+def test_redis_event_ids_are_unique_across_processes():
+    redis = pytest.importorskip('redis')
+    url = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+    try:
+        redis.Redis.from_url(url).ping()
+    except redis.RedisError:
+        pytest.skip(f'no Redis at {url}')
+
+    # Two buses on one channel stand in for two worker processes
+    channel = f'test-events-{uuid.uuid4().hex}'
+    first = events.EventBus(events.RedisBackend(url, channel))
+    second = events.EventBus(events.RedisBackend(url, channel))
+    ids = received_ids(first, 2) + received_ids(second, 2)
+    assert len(set(ids)) == 4
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+from backend.archive import archive_batch
+
+
+@pytest.fixture
+def app(make_app):
+    # Small batches so an export spans several chunks
+    return make_app(AUTO_ASSIGN_ENABLED=False, EXPORT_BATCH_SIZE=2)
+
+
+@pytest.fixture
+def users(add_user, login):
+    for name, role in [('alice', 'user'), ('tech1', 'technician'), ('boss', 'manager')]:
+        add_user(name, role)
+    return {name: login(name) for name in ('alice', 'tech1', 'boss')}
+
+
+@pytest.fixture
+def tickets(app, users):
+    """Five tickets, the first of them resolved and archived"""
+    alice, boss = users['alice'], users['boss']
+    ticket_ids = [alice.post('/api/tickets', json={'title': f'T{i}', 'description': 'x', 'category': 'hardware'})
+                  .get_json()['ticket']['id'] for i in range(5)]
+    boss.put(f'/api/tickets/{ticket_ids[0]}', json={'status': 'resolved'})
+    with app.app_context():
+        assert archive_batch(datetime.utcnow() + timedelta(days=1), ('resolved',), 10) == 1
+    return ticket_ids
+
+
+def export(client, path, **params):
+    response = client.get(f'/api/export/{path}', query_string=params)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.is_streamed
+    return response
+
+
+def test_tickets_stream_as_csv(users, tickets):
+    response = export(users['boss'], 'tickets')
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename=tickets-')
+    assert response.headers['Content-Disposition'].endswith('.csv')
+
+    header, *rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert header[:3] == ['id', 'title', 'description']
+    assert [int(row[0]) for row in rows] == tickets[1:]
+
+    # Archived tickets follow the live ones
+    rows = list(csv.DictReader(io.StringIO(export(users['boss'], 'tickets', include_archived='true')
+                                           .get_data(as_text=True))))
+    assert [int(row['id']) for row in rows] == tickets[1:] + tickets[:1]
+    assert rows[-1]['status'] == 'resolved'
+
+
+def test_activity_logs_stream_as_ndjson(users, tickets):
+    response = export(users['boss'], 'activity_logs', format='ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename=activity_logs-')
+    assert response.headers['Content-Disposition'].endswith('.ndjson')
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert set(rows[0]) == {'id', 'ticket_id', 'user_id', 'action', 'description', 'created_at'}
+    assert sorted({row['ticket_id'] for row in rows}) == tickets[1:]
+
+    rows = [json.loads(line) for line in export(users['boss'], 'activity_logs', format='ndjson',
+                                                include_archived='true').get_data(as_text=True).splitlines()]
+    assert sorted({row['ticket_id'] for row in rows}) == tickets
+    # The archived ticket's creation and resolution
+    assert len([row for row in rows if row['ticket_id'] == tickets[0]]) == 2
+
+
+def test_empty_csv_export_is_just_the_header(users):
+    body = export(users['boss'], 'tickets', status='closed').get_data(as_text=True)
+    assert body.splitlines() == [','.join(['id', 'title', 'description', 'category', 'priority', 'status',
+                                           'created_by', 'assigned_to', 'created_at', 'updated_at',
+                                           'resolved_at'])]
+
+
+@pytest.mark.parametrize('path', ['tickets', 'activity_logs'])
+def test_only_managers_export(app, users, path):
+    for name in ('alice', 'tech1'):
+        response = users[name].get(f'/api/export/{path}')
+        assert (response.status_code, response.get_json()) == (403, {'error': 'Insufficient permissions'})
+    assert app.test_client().get(f'/api/export/{path}').status_code == 401
+    response = users['boss'].get(f'/api/export/{path}', query_string={'format': 'xml'})
+    assert (response.status_code, response.get_json()) == (400, {'error': 'format must be one of csv, ndjson'})
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+
+def test_list_with_usernames_goes_stale_when_a_user_is_deleted(app, add_user, login):
+    add_user('alice')
+    tech_id = add_user('tech1', 'technician')
+    add_user('boss', 'manager')
+    alice, boss = login('alice'), login('boss')
+    ticket_id = alice.post('/api/tickets', json={'title': 'VPN', 'description': 'down', 'category': 'network'}) \
+        .get_json()['ticket']['id']
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': tech_id})
+
+    with_users = alice.get('/api/tickets?include_users=1')
+    plain = alice.get('/api/tickets')
+    assert with_users.get_json()['tickets'][0]['assigned_to_username'] == 'tech1'
+    assert with_users.headers['ETag'] != plain.headers['ETag']
+    for response in (with_users, plain):
+        assert alice.get(response.request.full_path,
+                         headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Deleting the technician unassigns alice's ticket, so both lists change
+    assert boss.delete(f'/api/users/{tech_id}').status_code == 200
+    refreshed = alice.get('/api/tickets?include_users=1', headers={'If-None-Match': with_users.headers['ETag']})
+    assert refreshed.status_code == 200
+    assert refreshed.get_json()['tickets'][0]['assigned_to_username'] is None
+    refreshed = alice.get('/api/tickets', headers={'If-None-Match': plain.headers['ETag']})
+    assert refreshed.status_code == 200
+    assert refreshed.get_json()['tickets'][0]['assigned_to'] is None
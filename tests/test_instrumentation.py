@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import re
+import pytest
+from backend import metrics
+
+
+@pytest.fixture(params=['stdlib', 'orjson'])
+def app(make_app, request):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    return make_app(INSTRUMENTATION_ENABLED=True, JSON_PROVIDER=request.param)
+
+
+def serialization_seconds(app, endpoint):
+    counter = metrics.get_registry(app).counter('serialization_seconds_total', '', ('endpoint',))
+    return sum(value for _, labels, value in counter.samples() if labels == (('endpoint', endpoint),))
+
+
+def test_row_based_list_counts_json_encoding_as_serialization(app, add_user, login):
+    add_user('alice')
+    alice = login('alice')
+    for i in range(20):
+        alice.post('/api/tickets', json={'title': f'T{i}', 'description': 'x' * 200, 'category': 'c'})
+
+    # The list is built from plain rows, so no to_dict() runs: all of its
+    # serialization time is the JSON provider's
+    before = serialization_seconds(app, '/api/tickets')
+    response = alice.get('/api/tickets')
+    assert response.status_code == 200
+    timing = dict(re.findall(r'(\w+);dur=([\d.]+)', response.headers['Server-Timing']))
+    assert 0 <= float(timing['serialize']) <= float(timing['app'])
+    assert serialization_seconds(app, '/api/tickets') > before
+
+
+@pytest.mark.parametrize('app', ['stdlib'], indirect=True)
+def test_metrics_need_a_manager_or_the_scrape_token(app, add_user, login):
+    add_user('alice')
+    add_user('boss', 'manager')
+    client = app.test_client()
+
+    assert client.get('/api/metrics').status_code == 401
+    assert login('alice').get('/api/metrics').status_code == 403
+    response = login('boss').get('/api/metrics')
+    assert response.status_code == 200
+    assert b'# TYPE http_requests_total counter' in response.data
+
+    # No token configured: no bearer token gets in
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
+    app.config['METRICS_TOKEN'] = 's3cret'
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+from datetime import datetime, timedelta
+from email import message_from_bytes
+import pytest
+from backend import jobs, notifications
+from backend.models import db, User, Job
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+REFUSED_DOMAIN = '@refused.example.com'
+
+
+class SmtpRecorder:
+    """aiosmtpd handler that keeps what it receives and refuses REFUSED_DOMAIN"""
+
+    def __init__(self):
+        self.messages = []
+        self.connections = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith(REFUSED_DOMAIN):
+            return '550 No such user here'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(id(session))
+        self.messages.append(message_from_bytes(envelope.content))
+        return '250 Message accepted for delivery'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    recorder = SmtpRecorder()
+    controller = aiosmtpd_controller.Controller(recorder, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield controller, recorder
+    controller.stop()
+
+
+@pytest.fixture
+def app(make_app, smtp_server):
+    controller, _ = smtp_server
+    return make_app(NOTIFICATIONS_ENABLED=True, NOTIFY_DEDUP_SECONDS=0, AUTO_ASSIGN_ENABLED=False,
+                    MAIL_BACKEND='smtp', MAIL_SERVER='127.0.0.1', MAIL_PORT=controller.port,
+                    JOBS_RETRY_BASE_SECONDS=0, JOBS_MAX_ATTEMPTS=2)
+
+
+@pytest.fixture
+def outbox(smtp_server):
+    return smtp_server[1].messages
+
+
+@pytest.fixture
+def users(add_user):
+    return {name: add_user(name, role) for name, role in
+            (('boss', 'manager'), ('tech1', 'technician'), ('tech2', 'technician'), ('alice', 'user'))}
+
+
+@pytest.fixture
+def ticket_id(login, users):
+    response = login('alice').post('/api/tickets', json={'title': 'Printer jam', 'description': 'Tray 2',
+                                                          'category': 'hardware'})
+    return response.get_json()['ticket']['id']
+
+
+def run_jobs(app):
+    """One worker pass; returns how many jobs were claimed"""
+    with app.app_context():
+        try:
+            return jobs.JobRunner(app).run_once()
+        finally:
+            db.session.remove()
+
+
+def queued_jobs(app):
+    with app.app_context():
+        rows = [(job.status, job.attempts, job.payload, job.dedup_key) for job in Job.query.order_by(Job.id)]
+        db.session.remove()
+        return rows
+
+
+def test_assignment_is_mailed_by_the_worker(app, login, users, ticket_id, outbox):
+    login('boss').put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+    assert outbox == []
+
+    assert run_jobs(app) == 1
+    assert [(message['To'], message['Subject']) for message in outbox] == [
+        ('tech1@example.com', f'[Ticket #{ticket_id}] Assigned to you: Printer jam')
+    ]
+    assert queued_jobs(app) == []
+
+
+def test_repeated_updates_fold_into_one_email(app, login, users, ticket_id, outbox):
+    boss = login('boss')
+    boss.put(f'/api/tickets/{ticket_id}', json={'status': 'in_progress'})
+    boss.put(f'/api/tickets/{ticket_id}', json={'status': 'resolved'})
+    assert len(queued_jobs(app)) == 1
+
+    run_jobs(app)
+    assert [message['Subject'] for message in outbox] == [f'[Ticket #{ticket_id}] Now resolved: Printer jam']
+
+
+def test_reassignment_within_the_window_only_mails_the_final_assignee(app, login, users, ticket_id, outbox):
+    boss = login('boss')
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech2']})
+
+    run_jobs(app)
+    assert [message['To'] for message in outbox] == ['tech2@example.com']
+
+
+def test_creator_assigned_and_status_changed_gets_one_assignment_email(app, login, users, outbox):
+    tech1 = login('tech1')
+    ticket = tech1.post('/api/tickets', json={'title': 'VPN', 'description': 'down', 'category': 'network'})
+    ticket_id = ticket.get_json()['ticket']['id']
+
+    response = login('boss').put(f'/api/tickets/{ticket_id}',
+                                 json={'assigned_to': users['tech1'], 'status': 'resolved'})
+    assert response.status_code == 200
+    assert [payload['reason'] for _, _, payload, _ in queued_jobs(app)] == [notifications.ASSIGNED]
+
+    run_jobs(app)
+    assert [message['Subject'] for message in outbox] == [f'[Ticket #{ticket_id}] Assigned to you: VPN']
+
+
+def test_batch_is_sent_over_one_connection(app, login, users, smtp_server):
+    alice = login('alice')
+    ids = [alice.post('/api/tickets', json={'title': f'T{i}', 'description': 'x', 'category': 'c'})
+           .get_json()['ticket']['id'] for i in range(5)]
+    assert login('boss').post('/api/tickets/bulk', json={
+        'action': 'update', 'ticket_ids': ids, 'changes': {'assigned_to': users['tech1']}
+    }).status_code == 200
+
+    assert run_jobs(app) == 5
+    _, recorder = smtp_server
+    assert len(recorder.messages) == 5
+    assert len(recorder.connections) == 1
+
+
+def test_refused_message_is_retried_then_kept_as_failed(app, login, users, ticket_id, outbox):
+    with app.app_context():
+        db.session.get(User, users['tech1']).email = 'tech1' + REFUSED_DOMAIN
+        db.session.commit()
+        db.session.remove()
+    boss = login('boss')
+    alice = login('alice')
+    other = alice.post('/api/tickets', json={'title': 'Other', 'description': 'x', 'category': 'c'})
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+    boss.put(f"/api/tickets/{other.get_json()['ticket']['id']}", json={'assigned_to': users['tech2']})
+
+    run_jobs(app)
+    # Only the refused message is retried; the other one was delivered
+    assert [message['To'] for message in outbox] == ['tech2@example.com']
+    [(status, attempts, _, _)] = queued_jobs(app)
+    assert (status, attempts) == (jobs.PENDING, 1)
+
+    run_jobs(app)
+    [(status, attempts, _, _)] = queued_jobs(app)
+    assert (status, attempts) == (jobs.FAILED, 2)
+    assert run_jobs(app) == 0
+
+
+def test_unreachable_server_fails_the_whole_batch(app, login, users, ticket_id):
+    app.extensions['mailer'] = notifications.SmtpMailer('127.0.0.1', _free_port())
+    app.config.update(JOBS_RETRY_BASE_SECONDS=60, JOBS_MAX_ATTEMPTS=3)
+    login('boss').put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+
+    before = datetime.utcnow()
+    run_jobs(app)
+    with app.app_context():
+        job = Job.query.one()
+        assert (job.status, job.attempts) == (jobs.PENDING, 1)
+        assert 'ConnectionRefusedError' in job.last_error
+        # Backed off by half to all of JOBS_RETRY_BASE_SECONDS
+        assert before + timedelta(seconds=29) <= job.run_at <= datetime.utcnow() + timedelta(seconds=61)
+        db.session.remove()
+    assert run_jobs(app) == 0
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    for attempts, full in ((1, 30), (2, 60), (3, 120), (10, 3600)):
+        delay = jobs.retry_delay(attempts, 30, 3600)
+        assert full / 2 <= delay <= full
+
+
+def test_worker_that_lost_its_lease_leaves_the_job_alone(app, login, users, ticket_id):
+    login('boss').put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+    with app.app_context():
+        [stale] = jobs.claim('stale', 10, lease_seconds=60)
+        # The lease runs out and another worker takes the job over
+        later = datetime.utcnow() + timedelta(seconds=61)
+        [current] = jobs.claim('current', 10, lease_seconds=60, now=later)
+        assert current.id == stale.id and current.attempts == 2
+
+        jobs.finish('stale', [stale.id], [], 5, 0, 0)
+        jobs.finish('stale', [], [(stale, 'timed out')], 5, 0, 0)
+        job = db.session.get(Job, stale.id)
+        assert (job.status, job.locked_by, job.last_error) == (jobs.RUNNING, 'current', None)
+
+        jobs.finish('current', [current.id], [], 5, 0, 0)
+        assert Job.query.count() == 0
+        db.session.remove()
+
+
+def claimed_key(job):
+    return f"{notifications.TICKET_NOTIFICATION}:{job.payload['ticket_id']}:{job.payload['user_id']}"
+
+
+def test_failed_job_covered_by_a_newer_pending_one_is_dropped(app, login, users, ticket_id):
+    boss = login('boss')
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+    with app.app_context():
+        [claimed] = jobs.claim('worker', 10, lease_seconds=60)
+        db.session.remove()
+    # The ticket changes again while the first email is being sent
+    boss.put(f'/api/tickets/{ticket_id}', json={'priority': 'high', 'assigned_to': users['tech2']})
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': users['tech1']})
+
+    with app.app_context():
+        jobs.finish('worker', [], [(claimed, 'SMTPServerDisconnected')], 5, 0, 0)
+        rows = [(job.id, job.status) for job in Job.query.filter_by(dedup_key=claimed_key(claimed))]
+        assert [status for _, status in rows] == [jobs.PENDING]
+        assert rows[0][0] != claimed.id
+        db.session.remove()
+
+
+def test_worker_pool_sends_each_job_once(app, login, users, outbox):
+    alice = login('alice')
+    boss = login('boss')
+    for i in range(20):
+        ticket = alice.post('/api/tickets', json={'title': f'T{i}', 'description': 'x', 'category': 'c'})
+        boss.put(f"/api/tickets/{ticket.get_json()['ticket']['id']}",
+                 json={'assigned_to': users['tech1'] if i % 2 else users['tech2']})
+
+    runner = jobs.JobRunner(app)
+    runner.workers, runner.batch_size, runner.poll_seconds = 3, 4, 0.05
+    runner.start()
+    try:
+        deadline = time.monotonic() + 10
+        while len(outbox) < 20 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        runner.stop()
+    assert sorted(message['Subject'] for message in outbox) == \
+        sorted({message['Subject'] for message in outbox})
+    assert len(outbox) == 20
+    assert queued_jobs(app) == []
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from backend.migrations import MIGRATIONS, upgrade_database
+from backend.models import db
+
+# What db.create_all() built before there were migrations
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL,
+        username VARCHAR(80) NOT NULL,
+        email VARCHAR(120) NOT NULL,
+        password_hash VARCHAR(200) NOT NULL,
+        role VARCHAR(20) NOT NULL,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        UNIQUE (username),
+        UNIQUE (email)
+    )""",
+    """CREATE TABLE tickets (
+        id INTEGER NOT NULL,
+        title VARCHAR(200) NOT NULL,
+        description TEXT NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        priority VARCHAR(20) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        created_by INTEGER NOT NULL,
+        assigned_to INTEGER,
+        created_at DATETIME,
+        updated_at DATETIME,
+        resolved_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(created_by) REFERENCES users (id),
+        FOREIGN KEY(assigned_to) REFERENCES users (id)
+    )""",
+    """CREATE TABLE activity_logs (
+        id INTEGER NOT NULL,
+        ticket_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        action VARCHAR(100) NOT NULL,
+        description TEXT NOT NULL,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(ticket_id) REFERENCES tickets (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+]
+
+
+def describe(engine):
+    """Tables, columns, keys and indexes as the database reports them"""
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        # Bookkeeping and full-text tables aren't part of the models
+        if table == 'schema_migrations' or table.startswith(('ticket_search', 'activity_search')):
+            continue
+        with engine.connect() as conn:
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"), {'name': table}).scalar()
+        schema[table] = {
+            'columns': {(c['name'], str(c['type']), c['nullable']) for c in inspector.get_columns(table)},
+            'primary_key': tuple(inspector.get_pk_constraint(table)['constrained_columns']),
+            'foreign_keys': {(tuple(fk['constrained_columns']), fk['referred_table'], tuple(fk['referred_columns']))
+                             for fk in inspector.get_foreign_keys(table)},
+            'unique': {tuple(u['column_names']) for u in inspector.get_unique_constraints(table)},
+            'indexes': {(ix['name'], tuple(ix['column_names']), bool(ix['unique']),
+                         str(ix.get('dialect_options', {}).get('sqlite_where')))
+                        for ix in inspector.get_indexes(table)},
+            'autoincrement': 'AUTOINCREMENT' in sql.upper(),
+        }
+    return schema
+
+
+@pytest.fixture
+def engines(tmp_path):
+    made = []
+
+    def factory(name):
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        made.append(engine)
+        return engine
+
+    yield factory
+    for engine in made:
+        engine.dispose()
+
+
+@pytest.fixture
+def expected(engines):
+    engine = engines('create_all.db')
+    db.metadata.create_all(engine)
+    return describe(engine)
+
+
+def test_baseline_database_upgrades_to_the_models(engines, expected):
+    engine = engines('baseline.db')
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users VALUES (1, 'alice', 'alice@example.com', 'x', 'user', :now)"),
+                     {'now': now})
+        conn.execute(text("INSERT INTO tickets VALUES (1, 'VPN down', 'x', 'network', 'high', 'open', 1, NULL, "
+                          ":now, :now, NULL)"), {'now': now})
+        conn.execute(text("INSERT INTO activity_logs VALUES (1, 1, 1, 'created', 'Ticket created: VPN down', :now)"),
+                     {'now': now})
+
+    assert upgrade_database(engine) == sorted(version for version, _, _ in MIGRATIONS)
+    assert describe(engine) == expected
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT id, title FROM tickets')).all() == [(1, 'VPN down')]
+        assert conn.execute(text('SELECT ticket_id FROM activity_logs')).all() == [(1,)]
+        assert conn.execute(text("SELECT count FROM ticket_stat_counters "
+                                 "WHERE dimension = 'priority' AND key = 'high'")).scalar() == 1
+
+    # Nothing left to do the second time
+    assert upgrade_database(engine) == []
+    assert describe(engine) == expected
+
+
+def test_empty_database_upgrades_to_the_models(engines, expected):
+    engine = engines('empty.db')
+    upgrade_database(engine)
+    assert describe(engine) == expected
+    assert upgrade_database(engine) == []
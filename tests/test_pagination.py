@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import pytest
+from backend.models import db, Ticket
+from backend.pagination import encode_token, encode_cursor
+
+
+@pytest.fixture
+def alice(app, add_user, login):
+    """alice with 7 tickets, five of them created in the same instant"""
+    alice_id = add_user('alice')
+    with app.app_context():
+        for i in range(7):
+            created_at = datetime(2026, 1, 1, 12, 0) if i < 5 else datetime(2026, 1, i, 9, 0)
+            db.session.add(Ticket(title=f'T{i}', description='x', category='c', created_by=alice_id,
+                                  created_at=created_at, updated_at=created_at))
+        db.session.commit()
+    return login('alice')
+
+
+def all_pages(client, limit):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = f'/api/tickets?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        body = client.get(query).get_json()
+        ids += [ticket['id'] for ticket in body['tickets']]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 50])
+def test_pages_cover_every_ticket_once_in_order(app, alice, limit):
+    ids, pages = all_pages(alice, limit)
+    with app.app_context():
+        expected = [ticket.id for ticket in
+                    Ticket.query.order_by(Ticket.created_at.desc(), Ticket.id.desc())]
+    # Ties on created_at are broken by id, so none are skipped or repeated
+    assert ids == expected
+    assert pages == max(1, -(-7 // limit))
+
+
+def test_last_page_has_no_next_cursor(alice):
+    body = alice.get('/api/tickets?limit=7').get_json()
+    assert body['count'] == 7
+    assert body['next_cursor'] is None
+
+
+def test_cursor_past_the_end_gives_an_empty_page(alice):
+    body = alice.get(f'/api/tickets?cursor={encode_cursor(datetime(2000, 1, 1), 1)}').get_json()
+    assert (body['tickets'], body['next_cursor']) == ([], None)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-base64!!',
+    'e30',  # {}
+    encode_token('text'),
+    encode_token([1, 2, 3]),
+    encode_token(['not a date', 1]),
+    encode_token(['2026-01-01T12:00:00', 'one']),
+    encode_cursor(datetime(2026, 1, 1), 5)[:-3] + '@@@',
+])
+def test_invalid_or_tampered_cursor_is_a_400(alice, cursor):
+    response = alice.get(f'/api/tickets?cursor={cursor}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+@pytest.mark.parametrize('limit,message', [('abc', 'limit must be an integer'), ('0', 'limit must be at least 1')])
+def test_invalid_limit_is_a_400(alice, limit, message):
+    response = alice.get(f'/api/tickets?limit={limit}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': message}
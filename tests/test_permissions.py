@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from backend import events
+from backend.current_user import system_user_id
+
+
+def session_as(app, user_id, role):
+    """Test client with a session for an account that can't log in with a password"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=user_id, role=role)
+    return client
+
+
+def test_system_account_sees_no_tickets(app, add_user, login):
+    add_user('alice')
+    add_user('boss', 'manager')
+    alice = login('alice')
+    ticket_id = alice.post('/api/tickets', json={'title': 'Printer jam', 'description': 'Tray 2',
+                                                 'category': 'hardware'}).get_json()['ticket']['id']
+    with app.app_context():
+        bot = session_as(app, system_user_id(), 'system')
+
+    assert bot.get('/api/tickets').get_json()['tickets'] == []
+    assert bot.get(f'/api/tickets/{ticket_id}').status_code == 403
+    assert bot.get(f'/api/tickets/{ticket_id}/activities').status_code == 403
+    assert bot.get('/api/tickets/changes').get_json()['tickets'] == []
+    search = bot.get('/api/tickets/search?q=printer')
+    if search.status_code == 200:
+        assert search.get_json()['tickets'] == []
+        assert [t['id'] for t in login('boss').get('/api/tickets/search?q=printer').get_json()['tickets']] \
+            == [ticket_id]
+
+    # Managers still see everything
+    assert [t['id'] for t in login('boss').get('/api/tickets').get_json()['tickets']] == [ticket_id]
+
+
+def test_only_known_roles_receive_events():
+    event = {'ticket': {'created_by': 1, 'assigned_to': 2}, 'previous': {}}
+    assert events.can_receive(1, 'user', event)
+    assert events.can_receive(2, 'technician', event)
+    assert events.can_receive(3, 'manager', event)
+    assert not events.can_receive(4, 'system', event)
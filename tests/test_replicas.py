@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import time
+import pytest
+from backend import replicas
+from tests.conftest import app_settings
+
+
+@pytest.fixture
+def replica_path(tmp_path):
+    return tmp_path / 'replica.db'
+
+
+@pytest.fixture
+def app(make_app, replica_path, request):
+    settings = {'SQLALCHEMY_BINDS': {'replica_0': f'sqlite:///{replica_path}'}, 'REPLICA_STICKY_SECONDS': 5}
+    return make_app(**dict(settings, **app_settings(request)))
+
+
+@pytest.fixture
+def alice(app, add_user, login, replica_path):
+    """alice logged in, with a ticket on the primary that the replica hasn't got"""
+    add_user('alice')
+    # The replica starts as a copy of the primary, then falls behind
+    primary = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///'))
+    replica = sqlite3.connect(replica_path)
+    primary.backup(replica)
+    primary.close()
+    replica.close()
+    client = login('alice')
+    response = client.post('/api/tickets', json={'title': 'Only on the primary', 'description': 'x',
+                                                 'category': 'c'})
+    assert response.status_code == 201
+    return client
+
+
+def forget_writes(client):
+    """Move the client's last write past REPLICA_STICKY_SECONDS"""
+    with client.session_transaction() as session:
+        session[replicas.LAST_WRITE_KEY] = time.time() - 60
+
+
+def titles(response):
+    assert response.status_code == 200
+    return [ticket['title'] for ticket in response.get_json()['tickets']]
+
+
+def test_replica_bind_is_picked_up(app):
+    assert len(app.extensions['replica_engines']) == 1
+
+
+def test_reads_go_to_the_replica(alice):
+    forget_writes(alice)
+    assert titles(alice.get('/api/tickets')) == []
+
+
+def test_reads_after_a_write_stay_on_the_primary(alice):
+    # The ticket was created just now, so the list comes from the primary
+    assert titles(alice.get('/api/tickets')) == ['Only on the primary']
+
+    forget_writes(alice)
+    assert titles(alice.get('/api/tickets')) == []
+
+    # Another write sticks the client to the primary again
+    ticket_id = alice.post('/api/tickets', json={'title': 'Second', 'description': 'x', 'category': 'c'}) \
+        .get_json()['ticket']['id']
+    assert titles(alice.get('/api/tickets')) == ['Second', 'Only on the primary']
+    assert alice.get(f'/api/tickets/{ticket_id}').status_code == 200
+
+
+def test_primary_only_endpoint_ignores_the_replica(alice):
+    forget_writes(alice)
+    changes = alice.get('/api/tickets/changes')
+    assert changes.status_code == 200
+    assert [ticket['title'] for ticket in changes.get_json()['tickets']] == ['Only on the primary']
+
+
+@pytest.mark.app_settings(SQLALCHEMY_BINDS={})
+def test_without_replicas_everything_reads_the_primary(app, alice):
+    assert app.extensions['replica_engines'] == []
+    forget_writes(alice)
+    assert titles(alice.get('/api/tickets')) == ['Only on the primary']
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from backend import search
+from backend.archive import archive_batch
+from backend.models import db, Ticket
+
+
+@pytest.fixture
+def app(make_app):
+    # Tickets stay where the tests put them
+    return make_app(AUTO_ASSIGN_ENABLED=False)
+
+
+@pytest.fixture
+def users(app, add_user, login):
+    ids = {name: add_user(name, role) for name, role in
+           [('alice', 'user'), ('bob', 'user'), ('tech1', 'technician'), ('boss', 'manager')]}
+    return ids, {name: login(name) for name in ids}
+
+
+def create(client, title, description='nothing special'):
+    return client.post('/api/tickets', json={'title': title, 'description': description,
+                                             'category': 'hardware'}).get_json()['ticket']['id']
+
+
+def hits(client, q, **params):
+    response = client.get('/api/tickets/search', query_string={'q': q, **params})
+    assert response.status_code == 200, response.get_json()
+    return [ticket['id'] for ticket in response.get_json()['tickets']]
+
+
+def test_title_matches_rank_above_description_matches(users):
+    _, clients = users
+    alice = clients['alice']
+    in_description = create(alice, 'Office move', 'the printer needs to come too')
+    in_title = create(alice, 'Printer jammed')
+    create(alice, 'Laptop fan noise')
+    assert hits(alice, 'printer') == [in_title, in_description]
+
+
+def test_results_follow_the_role_rules(users):
+    ids, clients = users
+    alice_ticket = create(clients['alice'], 'Printer jammed')
+    bob_ticket = create(clients['bob'], 'Printer out of toner')
+    clients['boss'].put(f'/api/tickets/{bob_ticket}', json={'assigned_to': ids['tech1']})
+
+    assert hits(clients['alice'], 'printer') == [alice_ticket]
+    assert hits(clients['bob'], 'printer') == [bob_ticket]
+    assert hits(clients['tech1'], 'printer') == [bob_ticket]
+    assert sorted(hits(clients['boss'], 'printer')) == sorted([alice_ticket, bob_ticket])
+
+
+def test_index_follows_updates_and_deletes(users):
+    _, clients = users
+    alice, boss = clients['alice'], clients['boss']
+    ticket_id = create(alice, 'Printer jammed', 'smells of smoke')
+
+    # The activity history keeps the original title, so change the description
+    boss.put(f'/api/tickets/{ticket_id}', json={'description': 'paper feed broken'})
+    assert hits(alice, 'smoke') == []
+    assert hits(alice, 'feed') == [ticket_id]
+
+    assert boss.delete(f'/api/tickets/{ticket_id}').status_code == 200
+    assert hits(boss, 'feed') == []
+    assert hits(boss, 'printer') == []
+
+
+def test_archived_tickets_leave_the_index(app, users):
+    _, clients = users
+    boss = clients['boss']
+    ticket_id = create(clients['alice'], 'Printer jammed')
+    boss.put(f'/api/tickets/{ticket_id}', json={'status': 'resolved'})
+    assert hits(boss, 'printer') == [ticket_id]
+
+    with app.app_context():
+        assert archive_batch(datetime.utcnow() + timedelta(days=1), ('resolved',), 100) == 1
+    assert hits(boss, 'printer') == []
+
+
+def test_hits_gone_from_the_ticket_table_are_skipped(app, users, monkeypatch):
+    _, clients = users
+    boss = clients['boss']
+    ticket_id = create(clients['alice'], 'Printer jammed')
+
+    # Ranking ran before the ticket disappeared
+    monkeypatch.setattr(search, 'search_tickets', lambda *args, **kwargs: [(ticket_id + 100, 1.0),
+                                                                          (ticket_id, 0.5)])
+    assert hits(boss, 'printer') == [ticket_id]
+    with app.app_context():
+        assert db.session.get(Ticket, ticket_id + 100) is None
+
+
+@pytest.mark.parametrize('page,message', [('abc', 'page must be an integer'), ('0', 'page must be at least 1')])
+def test_invalid_page_is_a_400(users, page, message):
+    _, clients = users
+    response = clients['alice'].get('/api/tickets/search', query_string={'q': 'printer', 'page': page})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': message}
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+import pytest
+from backend import sla
+from backend.models import db, Ticket, ActivityLog
+from tests.conftest import app_settings
+
+
+@pytest.fixture
+def app(make_app, request):
+    # No technicians to reassign to: missed resolution targets bump the priority
+    return make_app(**{'AUTO_ASSIGN_ENABLED': False, **app_settings(request)})
+
+
+@pytest.fixture
+def alice(add_user, login):
+    add_user('alice')
+    return login('alice')
+
+
+def create(app, client, priority='high'):
+    """New ticket's (id, created_at)"""
+    ticket_id = client.post('/api/tickets', json={'title': 'VPN down', 'description': 'x', 'category': 'network',
+                                                  'priority': priority}).get_json()['ticket']['id']
+    with app.app_context():
+        return ticket_id, db.session.get(Ticket, ticket_id).created_at
+
+
+def ticket(app, ticket_id):
+    with app.app_context():
+        return db.session.get(Ticket, ticket_id).to_dict()
+
+
+def test_failed_escalation_is_retried_next_tick(app, alice, monkeypatch):
+    ticket_id, created_at = create(app, alice)
+    scheduler = sla.SlaScheduler(app)
+    now = created_at + timedelta(minutes=61)
+
+    notify = sla.notifications.notify_ticket_changes
+    calls = []
+
+    def fail_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError('mail queue down')
+        return notify(*args)
+    monkeypatch.setattr(sla.notifications, 'notify_ticket_changes', fail_once)
+
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            scheduler.tick(now)
+    assert ticket(app, ticket_id)['priority'] == 'high'
+
+    with app.app_context():
+        assert scheduler.tick(now + timedelta(seconds=30)) == 1
+    assert ticket(app, ticket_id)['priority'] == 'critical'
+
+
+def escalations(app, ticket_id):
+    with app.app_context():
+        return [(activity.user.username, activity.description) for activity in
+                ActivityLog.query.filter_by(ticket_id=ticket_id, action='escalated').order_by(ActivityLog.id)]
+
+
+def test_missed_response_raises_the_priority(app, alice):
+    ticket_id, created_at = create(app, alice)
+    scheduler = sla.SlaScheduler(app)
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(minutes=59)) == 0
+        assert scheduler.tick(created_at + timedelta(minutes=61)) == 1
+
+    escalated = ticket(app, ticket_id)
+    assert escalated['priority'] == 'critical'
+    assert escalated['sla_response_breached_at'] is not None
+    assert escalated['sla_resolution_breached_at'] is None
+    assert escalations(app, ticket_id) == [
+        ('sla-bot', 'SLA response target missed (60 min for high): priority raised from high to critical')]
+
+
+def test_missed_resolution_raises_the_priority(app, alice):
+    ticket_id, created_at = create(app, alice, 'medium')
+    # Picked up in time, so only the resolution target is left
+    with app.app_context():
+        db.session.get(Ticket, ticket_id).status = 'in_progress'
+        db.session.commit()
+    scheduler = sla.SlaScheduler(app)
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(hours=5)) == 0
+        assert scheduler.tick(created_at + timedelta(days=3, minutes=1)) == 1
+
+    escalated = ticket(app, ticket_id)
+    assert escalated['priority'] == 'high'
+    assert escalated['sla_response_breached_at'] is None
+    assert escalated['sla_resolution_breached_at'] is not None
+
+
+def test_critical_tickets_stay_critical(app, alice):
+    ticket_id, created_at = create(app, alice, 'critical')
+    scheduler = sla.SlaScheduler(app)
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(minutes=16)) == 1
+    assert ticket(app, ticket_id)['priority'] == 'critical'
+    assert escalations(app, ticket_id)[0][1].endswith('already at the highest priority')
+
+
+def test_changed_tickets_are_tracked_again(app, alice, add_user, login):
+    add_user('boss', 'manager')
+    boss = login('boss')
+    picked_up, created_at = create(app, alice)
+    raised, _ = create(app, alice, 'low')
+    scheduler = sla.SlaScheduler(app)
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(minutes=1)) == 0
+
+    # Picked up before the response target, and raised to critical
+    boss.put(f'/api/tickets/{picked_up}', json={'status': 'in_progress'})
+    boss.put(f'/api/tickets/{raised}', json={'priority': 'critical'})
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(minutes=61)) == 1
+    assert ticket(app, picked_up)['priority'] == 'high'
+    assert ticket(app, raised)['sla_response_breached_at'] is not None
+
+    # The escalation itself is re-read: the response entry is gone and the
+    # resolution target now follows the critical one (4 hours)
+    with app.app_context():
+        assert scheduler.tick(created_at + timedelta(minutes=62)) == 0
+        assert scheduler.tick(created_at + timedelta(hours=4, minutes=1)) == 1
+    assert ticket(app, raised)['sla_resolution_breached_at'] is not None
+    assert ticket(app, picked_up)['sla_resolution_breached_at'] is None
+
+
+def test_tickets_are_escalated_only_once(app, alice):
+    ticket_id, created_at = create(app, alice)
+    now = created_at + timedelta(minutes=61)
+    first, second = sla.SlaScheduler(app), sla.SlaScheduler(app)
+    with app.app_context():
+        first.load()
+        second.load()
+        # Both queued the ticket; the second one's UPDATE finds it escalated
+        due = second.pop_due(now)
+        assert [ticket_id for ticket_id, _, _ in due] == [ticket_id]
+        assert first.tick(now) == 1
+        assert second.escalate(due, now) == 0
+        assert second.tick(now + timedelta(seconds=30)) == 0
+    assert ticket(app, ticket_id)['priority'] == 'critical'
+    assert len(escalations(app, ticket_id)) == 1
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from backend import stats
+from backend.archive import archive_batch
+from backend.models import db, Ticket, TicketStatCounter, TicketTombstone
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(AUTO_ASSIGN_ENABLED=False)
+
+
+@pytest.fixture
+def clients(add_user, login):
+    ids = {name: add_user(name, role) for name, role in
+           [('alice', 'user'), ('tech1', 'technician'), ('tech2', 'technician'), ('boss', 'manager')]}
+    return ids, {name: login(name) for name in ('alice', 'boss')}
+
+
+def create(client, title, priority='medium', category='hardware'):
+    return client.post('/api/tickets', json={'title': title, 'description': 'x', 'category': category,
+                                             'priority': priority}).get_json()['ticket']['id']
+
+
+def stored_counters():
+    return {(row.dimension, row.key): row.count for row in
+            db.session.execute(select(TicketStatCounter)).scalars() if row.count}
+
+
+def assert_counters_match_tickets(app):
+    with app.app_context():
+        served = stats.read_stats(days=366)
+        assert stored_counters() == dict(stats.compute_counts(db.session.connection()))
+        db.session.rollback()
+        with db.engine.begin() as conn:
+            stats.rebuild_counters(conn)
+        assert stats.read_stats(days=366) == served
+
+
+def test_counters_follow_every_kind_of_write(app, clients):
+    ids, clients = clients
+    alice, boss = clients['alice'], clients['boss']
+    tickets = [create(alice, f'T{i}', priority, category) for i, (priority, category) in
+               enumerate([('low', 'hardware'), ('high', 'network'), ('critical', 'network'),
+                          ('medium', 'software'), ('medium', 'hardware'), ('high', 'software')])]
+
+    boss.put(f'/api/tickets/{tickets[0]}', json={'status': 'in_progress', 'assigned_to': ids['tech1']})
+    boss.put(f'/api/tickets/{tickets[1]}', json={'priority': 'critical', 'assigned_to': ids['tech2']})
+    boss.put(f'/api/tickets/{tickets[2]}', json={'status': 'resolved', 'assigned_to': ids['tech1']})
+    boss.post('/api/tickets/bulk', json={'action': 'update', 'ticket_ids': tickets[3:5],
+                                         'changes': {'status': 'closed', 'assigned_to': ids['tech2']}})
+    boss.delete(f'/api/tickets/{tickets[5]}')
+    with app.app_context():
+        assert archive_batch(datetime.utcnow() + timedelta(days=1), ('closed',), 1) == 1
+    assert boss.delete(f"/api/users/{ids['tech1']}").status_code == 200
+
+    assert_counters_match_tickets(app)
+    with app.app_context():
+        by_technician = {row['technician_id']: row['count'] for row in stats.read_stats()['by_technician']}
+    assert by_technician == {None: 2, ids['tech2']: 3}
+
+
+def test_deleting_a_technician_unassigns_their_tickets(app, clients):
+    ids, clients = clients
+    alice, boss = clients['alice'], clients['boss']
+    ticket_id = create(alice, 'Printer jammed')
+    boss.put(f'/api/tickets/{ticket_id}', json={'assigned_to': ids['tech1']})
+    with app.app_context():
+        assigned_at = db.session.get(Ticket, ticket_id).updated_at
+
+    assert boss.delete(f"/api/users/{ids['tech1']}").status_code == 200
+    with app.app_context():
+        ticket = db.session.get(Ticket, ticket_id)
+        assert ticket.assigned_to is None
+        assert ticket.updated_at > assigned_at
+        tombstones = TicketTombstone.query.filter_by(ticket_id=ticket_id).all()
+        assert [(t.assigned_to, t.reason) for t in tombstones] == [(ids['tech1'], 'unassigned')]
+        assert {row['technician_id'] for row in stats.read_stats()['by_technician']} == {None}
+
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from backend import sync
+from backend.models import db, Ticket
+from tests.conftest import app_settings
+
+
+@pytest.fixture
+def app(make_app, request):
+    # No overlap unless a test asks for it, so each sync returns exactly what changed
+    return make_app(**{'AUTO_ASSIGN_ENABLED': False, 'SYNC_OVERLAP_SECONDS': 0, **app_settings(request)})
+
+
+@pytest.fixture
+def users(add_user, login):
+    ids = {name: add_user(name, role) for name, role in
+           [('alice', 'user'), ('tech1', 'technician'), ('boss', 'manager')]}
+    return ids, {name: login(name) for name in ids}
+
+
+def create(client, title='Printer jammed'):
+    return client.post('/api/tickets', json={'title': title, 'description': 'x',
+                                             'category': 'hardware'}).get_json()['ticket']['id']
+
+
+def changes(client, since=None, limit=None):
+    params = {key: value for key, value in (('since', since), ('limit', limit)) if value is not None}
+    response = client.get('/api/tickets/changes', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_full_load_pages_then_only_new_changes(users):
+    _, clients = users
+    alice = clients['alice']
+    created = [create(alice, f'T{i}') for i in range(5)]
+
+    seen, watermark, pages = [], None, 0
+    while True:
+        body = changes(alice, watermark, limit=2)
+        seen += [ticket['id'] for ticket in body['tickets']]
+        watermark, pages = body['watermark'], pages + 1
+        if not body['has_more']:
+            break
+    assert (seen, pages) == (created, 3)
+
+    assert changes(alice, watermark)['tickets'] == []
+    clients['boss'].put(f'/api/tickets/{created[1]}', json={'status': 'in_progress'})
+    body = changes(alice, watermark)
+    assert [(ticket['id'], ticket['status']) for ticket in body['tickets']] == [(created[1], 'in_progress')]
+    assert (body['deleted'], body['has_more'], body['reset']) == ([], False, False)
+
+
+def test_tombstones_reach_the_users_they_concern(users):
+    ids, clients = users
+    alice, tech1, boss = clients['alice'], clients['tech1'], clients['boss']
+    deleted, reassigned = create(alice), create(alice)
+    boss.put(f'/api/tickets/{reassigned}', json={'assigned_to': ids['tech1']})
+    marks = {name: changes(clients[name])['watermark'] for name in ('alice', 'tech1', 'boss')}
+
+    boss.put(f'/api/tickets/{reassigned}', json={'assigned_to': None})
+    boss.delete(f'/api/tickets/{deleted}')
+
+    # The technician drops the ticket taken off them; its creator just sees it change
+    assert changes(tech1, marks['tech1'])['deleted'] == [reassigned]
+    body = changes(alice, marks['alice'])
+    assert (body['deleted'], [ticket['id'] for ticket in body['tickets']]) == ([deleted], [reassigned])
+    assert changes(boss, marks['boss'])['deleted'] == [deleted]
+
+
+@pytest.mark.app_settings(SYNC_OVERLAP_SECONDS=60)
+def test_caught_up_clients_reread_the_overlap_window(app, users):
+    ids, clients = users
+    alice = clients['alice']
+    sent = create(alice)
+    watermark = changes(alice)['watermark']
+
+    # Commits that landed with older timestamps than the ticket already sent
+    with app.app_context():
+        sent_at = db.session.get(Ticket, sent).updated_at
+        late, stale = [Ticket(title=title, description='x', category='hardware', created_by=ids['alice'],
+                              created_at=updated_at, updated_at=updated_at)
+                       for title, updated_at in (('late', sent_at - timedelta(seconds=1)),
+                                                 ('stale', sent_at - timedelta(minutes=5)))]
+        db.session.add_all([late, stale])
+        db.session.commit()
+        late_id, stale_id = late.id, stale.id
+
+    seen = [ticket['id'] for ticket in changes(alice, watermark)['tickets']]
+    assert late_id in seen
+    assert stale_id not in seen
+
+
+def test_now_token_starts_from_the_present(users):
+    _, clients = users
+    alice = clients['alice']
+    create(alice, 'Before')
+    body = changes(alice, 'now')
+    assert (body['tickets'], body['deleted'], body['has_more']) == ([], [], False)
+
+    after = create(alice, 'After')
+    assert [ticket['id'] for ticket in changes(alice, body['watermark'])['tickets']] == [after]
+
+
+def test_watermark_older_than_retention_resets(app, users):
+    _, clients = users
+    alice = clients['alice']
+    create(alice)
+    with app.app_context():
+        days = app.config['TOMBSTONE_RETENTION_DAYS']
+    synced_at = datetime.utcnow() - timedelta(days=days + 1)
+    old = sync._encode_watermark((synced_at, 0), (synced_at, 0), True, synced_at)
+
+    assert changes(alice, old) == {'tickets': [], 'deleted': [], 'watermark': None,
+                                   'has_more': False, 'reset': True}
+
+
+@pytest.mark.parametrize('since', ['garbage', 'e30'])
+def test_invalid_watermark_is_a_400(users, since):
+    _, clients = users
+    response = clients['alice'].get('/api/tickets/changes', query_string={'since': since})
+    assert (response.status_code, response.get_json()) == (400, {'error': 'Invalid watermark'})